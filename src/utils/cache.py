@@ -0,0 +1,236 @@
+import contextlib
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+
+import pandas as pd
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: the index is only locked between the threads of the process
+    fcntl = None
+
+
+class ResultCache:
+    """Content-addressed on-disk cache of DataFrames returned by Pipes.
+
+    The key of an entry is a hash of the Pipe class, the source the Pipe instance is connected to (see
+    Pipe.cache_identity), the called method, its arguments and a user supplied freshness token (e.g. the date of the
+    last source table load). DataFrames are stored as Parquet files in cache_dir, least recently used entries are
+    evicted if the cache grows over max_bytes.
+
+    The cache directory can be shared by several processes: every change of the index is made under an exclusive
+    lock of cache_dir/index.lock, on the current content of index.json.
+
+    Attach the cache to a Pipe with the cache argument, and decorate the method with @Pipe.cached.
+
+    Args:
+        cache_dir (str): Directory of the cache files
+        max_bytes (int): Maximum size of the cache on disk. Default is 10 GB.
+
+    Examples:
+        cache = ResultCache('data/interim/cache')
+        reader = MySQLReader('mysql_reader', 'loaders', cache=cache)
+        df = reader.run(ip, port, db, table, user, password, cache_token='2019-06-01')
+
+    """
+
+    INDEX_FILE = 'index.json'
+    LOCK_FILE = 'index.lock'
+
+    # The access time of an entry is written to the index at most this often (seconds), so hits rarely write
+    ATIME_RESOLUTION = 60
+
+    def __init__(self, cache_dir='data/interim/cache', max_bytes=10 * 1024 ** 3):
+
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+        self._index = self._load_index()
+
+    def _index_path(self):
+        return os.path.join(self.cache_dir, self.INDEX_FILE)
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, key + '.parquet')
+
+    def _load_index(self):
+
+        if not os.path.exists(self._index_path()):
+            return {}
+
+        with open(self._index_path(), 'r') as f:
+            index = json.load(f)
+
+        # Drop entries whose file was removed by hand
+        return {key: entry for key, entry in index.items() if os.path.exists(self._entry_path(key))}
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Lock the index between threads and processes, and reload it, as other processes may have changed it"""
+
+        with self._lock:
+            with open(os.path.join(self.cache_dir, self.LOCK_FILE), 'a') as lock_file:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    self._index = self._load_index()
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _save_index(self):
+
+        # Write to a temporary file first, so the index is never left half written
+        tmp_path = self._index_path() + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self._index_path())
+
+    @staticmethod
+    def make_key(pipe_name, method_name, args, kwargs, token=None, identity=None):
+        """Create the key of a cache entry.
+
+        Args:
+            pipe_name (str): Qualified name of the Pipe class
+            method_name (str): Name of the cached method
+            args (tuple): Positional arguments of the method
+            kwargs (dict): Keyword arguments of the method
+            token: Freshness token, change it to force a reload
+            identity (str): Source of the Pipe instance, e.g. host:port/db (see Pipe.cache_identity)
+
+        Returns:
+            str: sha256 hex digest
+        """
+
+        content = (pipe_name, identity, method_name, args, sorted(kwargs.items()), token)
+        try:
+            payload = pickle.dumps(content, protocol=4)
+        except Exception:
+            payload = repr(content).encode('utf-8')
+
+        return hashlib.sha256(payload).hexdigest()
+
+    def get(self, key):
+        """Return the cached DataFrame or None if the key is not in the cache"""
+
+        entry = self._index.get(key)
+        now = time.time()
+        if entry is None or now - entry['atime'] > self.ATIME_RESOLUTION:
+            with self._locked():
+                entry = self._index.get(key)
+                if entry is None:
+                    return None
+                entry['atime'] = now
+                self._save_index()
+
+        # The entry may be evicted by another thread in the meantime
+        try:
+            return pd.read_parquet(self._entry_path(key))
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, df, pipe_name=None, identity=None):
+        """Store a DataFrame in the cache.
+
+        Args:
+            key (str): Key of the entry, see make_key
+            df (pandas.DataFrame): DataFrame to be stored
+            pipe_name (str): Qualified name of the Pipe class, used by invalidate
+            identity (str): Source of the Pipe instance, used by invalidate
+
+        Returns:
+            bool: True if the DataFrame is stored. Objects which can not be written to Parquet are not cached.
+        """
+
+        if not isinstance(df, pd.DataFrame):
+            return False
+
+        path = self._entry_path(key)
+        tmp_path = path + '.tmp'
+        try:
+            df.to_parquet(tmp_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+        os.replace(tmp_path, path)
+
+        with self._locked():
+            now = time.time()
+            self._index[key] = {'pipe': pipe_name, 'identity': identity, 'size': os.path.getsize(path),
+                                'ctime': now, 'atime': now}
+            self._evict()
+            self._save_index()
+
+        return True
+
+    def _evict(self):
+        """Remove least recently used entries until the cache fits into max_bytes"""
+
+        total = sum(entry['size'] for entry in self._index.values())
+        for key in sorted(self._index, key=lambda k: self._index[k]['atime']):
+            if total <= self.max_bytes:
+                break
+            total -= self._index.pop(key)['size']
+            self._remove_file(key)
+
+    def _remove_file(self, key):
+
+        path = self._entry_path(key)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def invalidate(self, key=None, pipe_name=None, identity=None):
+        """Remove entries from the cache.
+
+        Args:
+            key (str): Remove the entry with this key
+            pipe_name (str): Remove every entry created by this Pipe class (qualified name, or class name)
+            identity (str): Remove every entry read from this source. Combined with pipe_name, both must match.
+
+        Returns:
+            int: Number of removed entries
+        """
+
+        def matches(entry):
+            if pipe_name is None and identity is None:
+                return False
+            if pipe_name is not None and (entry['pipe'] is None or
+                                          (entry['pipe'] != pipe_name and entry['pipe'].split('.')[-1] != pipe_name)):
+                return False
+            return identity is None or entry.get('identity') == identity
+
+        with self._locked():
+            to_remove = [k for k, entry in self._index.items() if (key is not None and k == key) or matches(entry)]
+
+            for k in to_remove:
+                del self._index[k]
+                self._remove_file(k)
+            self._save_index()
+
+        return len(to_remove)
+
+    def clear(self):
+        """Remove every entry from the cache"""
+
+        with self._locked():
+            for key in list(self._index):
+                self._remove_file(key)
+            self._index = {}
+            self._save_index()
+
+    @property
+    def size(self):
+        """Size of the cache in bytes"""
+
+        return sum(entry['size'] for entry in self._index.values())
@@ -0,0 +1,113 @@
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+import pandas as pd
+import numpy as np
+
+
+def rows_for_budget(df, max_bytes, max_rows=None):
+    """Estimate how many rows of a DataFrame fit into a memory budget.
+
+    Args:
+        df (pandas.DataFrame): Sample of the data, used to estimate the size of one row
+        max_bytes (int): Memory budget of one chunk in bytes
+        max_rows (int): Upper limit of the returned row number
+
+    Returns:
+        int: number of rows (at least 1)
+    """
+
+    if df.empty:
+        return max_rows or 1
+
+    row_bytes = df.memory_usage(index=True, deep=True).sum() / len(df)
+    rows = max(int(max_bytes // max(row_bytes, 1)), 1)
+
+    if max_rows is not None:
+        rows = min(rows, max_rows)
+
+    return rows
+
+
+def iter_query(con, query, params=None, chunksize=100000, max_bytes=None, sample_rows=100):
+    """Execute a query with a server-side cursor, and yield the result in DataFrame chunks.
+
+    Only one chunk is held in memory at a time. If max_bytes is given, the number of rows per chunk is
+    adjusted after every chunk, so a chunk takes approximately max_bytes memory.
+
+    Args:
+        con (sqlalchemy.engine.Engine or Connection): Database connection
+        query (str): SQL query, parameters can be bound with :name
+        params (dict): Bound parameters of the query
+        chunksize (int): Number of rows in one chunk (upper limit, if max_bytes is given)
+        max_bytes (int): Memory budget of one chunk in bytes
+        sample_rows (int): Size of the first chunk used for the estimation of the row size if max_bytes is given
+
+    Yields:
+        pandas.DataFrame
+    """
+
+    if isinstance(con, Engine):
+        with con.connect() as conn:
+            yield from iter_query(conn, query, params, chunksize, max_bytes, sample_rows)
+        return
+
+    # stream_results makes the driver use a server-side cursor (e.g. named cursor in psycopg2, SSCursor in MySQLdb)
+    result = con.execution_options(stream_results=True).execute(text(query), params or {})
+    columns = list(result.keys())
+
+    rows_per_chunk = chunksize if max_bytes is None else min(sample_rows, chunksize or np.inf)
+    try:
+        while True:
+            rows = result.fetchmany(int(rows_per_chunk))
+            if not rows:
+                break
+
+            chunk = pd.DataFrame.from_records(rows, columns=columns)
+            if max_bytes is not None:
+                rows_per_chunk = rows_for_budget(chunk, max_bytes, chunksize)
+
+            yield chunk
+    finally:
+        result.close()
+
+
+def harmonise_dtypes(chunks):
+    """Concatenate DataFrames whose column dtypes may differ, e.g. partitions of a table read separately.
+
+    A column which is integer in one partition can be float in another (NULLs), or object in a partition where it
+    is entirely NULL. The target dtype of a column is decided by the partitions where it has values: the common
+    numpy type of numeric columns, otherwise the dtype if it is the same everywhere, object if not. If there are
+    NULLs, integer columns become float, and bool columns become the nullable boolean dtype.
+
+    Args:
+        chunks (list): pandas.DataFrames with the same columns
+
+    Returns:
+        pandas.DataFrame
+    """
+
+    chunks = [chunk for chunk in chunks if chunk is not None]
+    if not chunks:
+        return pd.DataFrame()
+
+    dtypes = {}
+    for col in chunks[0].columns:
+        with_values = [chunk[col].dtype for chunk in chunks if chunk[col].notnull().any()]
+        if not with_values:
+            continue
+        if all(dtype == with_values[0] for dtype in with_values):
+            target = with_values[0]
+        elif all(isinstance(dtype, np.dtype) and dtype.kind in 'biuf' for dtype in with_values):
+            target = np.result_type(*with_values)
+        else:
+            target = np.dtype(object)
+
+        # Integers and booleans can not hold the NULLs of the other partitions (casting them would make them 0 / False)
+        if isinstance(target, np.dtype) and target.kind in 'biu' and any(chunk[col].isnull().any() for chunk in chunks):
+            target = pd.BooleanDtype() if target.kind == 'b' else np.dtype(np.float64)
+        dtypes[col] = target
+
+    chunks = [chunk.astype({col: dtype for col, dtype in dtypes.items() if chunk[col].dtype != dtype})
+              for chunk in chunks]
+
+    return pd.concat(chunks, axis=0, ignore_index=True)
@@ -0,0 +1,236 @@
+import json
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+
+
+# Signed integer types tried in order when integers are downcast
+_INT_TYPES = [np.int8, np.int16, np.int32, np.int64]
+
+
+def infer_schema(df, category_ratio=0.5, max_categories=None, parse_dates=None):
+    """Smallest lossless dtype of every column of a DataFrame.
+
+    Args:
+        df (pandas.DataFrame): Sample or full DataFrame
+        category_ratio (float): String columns with nunique / non-null count below this ratio become category
+        max_categories (int): String columns with more distinct values are not converted to category
+        parse_dates (list): String columns to be parsed as datetime
+
+    Returns:
+        dict: column -> dtype name (e.g. int16, float32, category, datetime64[ns])
+    """
+
+    parse_dates = set(parse_dates or [])
+    schema = {}
+
+    for col in df.columns:
+        series = df[col]
+        dtype = series.dtype
+
+        if col in parse_dates or dtype.kind == 'M':
+            # The resolution parsed by the installed pandas (ns before, us from pandas 3)
+            schema[col] = str(dtype) if dtype.kind == 'M' else str(pd.to_datetime(series).dtype)
+
+        elif dtype.kind in 'iu':
+            if len(series) == 0:
+                schema[col] = str(dtype)
+                continue
+            lo, hi = series.min(), series.max()
+            schema[col] = next(np.dtype(t).name for t in _INT_TYPES
+                               if np.iinfo(t).min <= lo and hi <= np.iinfo(t).max) if hi <= np.iinfo(np.int64).max else str(dtype)
+
+        elif dtype.kind == 'f':
+            # float32 only if every value survives the round trip
+            values = series.values
+            with np.errstate(over='ignore', invalid='ignore'):
+                lossless = np.array_equal(values.astype(np.float32).astype(values.dtype), values, equal_nan=True)
+            schema[col] = 'float32' if lossless else str(dtype)
+
+        elif dtype.kind == 'O' or isinstance(dtype, pd.CategoricalDtype):
+            count = series.count()
+            nunique = series.nunique()
+            if isinstance(dtype, pd.CategoricalDtype) or (count and nunique / count < category_ratio and
+                                                            (max_categories is None or nunique <= max_categories)):
+                schema[col] = 'category'
+            else:
+                # object, or the string dtype of pandas 3
+                schema[col] = str(dtype)
+
+        else:
+            schema[col] = str(dtype)
+
+    return schema
+
+
+def _lossless(series, dtype):
+    """Whether every value of a numeric Series survives the conversion to dtype, without overflow or lost precision"""
+
+    target = np.dtype(dtype)
+    values = series.values
+
+    if target.kind in 'iu' and len(values):
+        info = np.iinfo(target)
+        if values.min() < info.min or values.max() > info.max:
+            return False
+
+    with np.errstate(over='ignore', invalid='ignore'):
+        return np.array_equal(values.astype(target).astype(values.dtype), values, equal_nan=True)
+
+
+def apply_schema(df, schema):
+    """Convert the columns of a DataFrame to the dtypes of a schema. Columns missing from the schema are kept.
+
+    A schema inferred from an earlier load may be too narrow for a later one. Numeric columns with values out of the
+    range (or the precision) of their schema dtype are converted to int64 / float64 instead, with a warning.
+
+    Args:
+        df (pandas.DataFrame): DataFrame to be converted
+        schema (dict): column -> dtype name, see infer_schema
+
+    Returns:
+        pandas.DataFrame
+    """
+
+    converted = {}
+    for col, dtype in schema.items():
+        if col not in df.columns or str(df[col].dtype) == dtype:
+            continue
+        if dtype.startswith('datetime64'):
+            # Cast to the resolution of the schema, pd.to_datetime parses with the default of the pandas version
+            converted[col] = pd.to_datetime(df[col]).astype(dtype)
+        elif dtype.startswith(('int', 'uint')) and df[col].isnull().any():
+            # A later load has NULLs in an integer column, keep it as float instead of failing
+            converted[col] = df[col].astype(np.float64)
+        elif (dtype.startswith(('int', 'uint', 'float')) and df[col].dtype.kind in 'iuf'
+              and not _lossless(df[col], dtype)):
+            fallback = 'float64' if dtype.startswith('float') or df[col].dtype.kind == 'f' else 'int64'
+            warnings.warn(f'Values of {col} do not fit the {dtype} dtype of the schema, {fallback} is used instead')
+            if str(df[col].dtype) != fallback and _lossless(df[col], fallback):
+                converted[col] = df[col].astype(fallback)
+        else:
+            converted[col] = df[col].astype(dtype)
+
+    return df.assign(**converted) if converted else df
+
+
+def optimise_dtypes(df, category_ratio=0.5, max_categories=None, parse_dates=None):
+    """Downcast numeric columns, convert low cardinality string columns to category, and parse date columns.
+
+    Returns:
+        pandas.DataFrame
+
+    Examples:
+        df = optimise_dtypes(df, parse_dates=['CLAIM_DATE'])
+        print(memory_report(raw_df, df))
+    """
+
+    return apply_schema(df, infer_schema(df, category_ratio, max_categories, parse_dates))
+
+
+def memory_report(before, after):
+    """Memory usage of every column before and after a dtype conversion
+
+    Returns:
+        pandas.DataFrame: column, dtype_before, dtype_after, bytes_before, bytes_after, saved_bytes, saved_ratio,
+            sorted by saved_bytes
+    """
+
+    bytes_before = before.memory_usage(index=False, deep=True)
+    bytes_after = after.memory_usage(index=False, deep=True)
+
+    report = pd.DataFrame({'column': before.columns,
+                           'dtype_before': before.dtypes.astype(str).values,
+                           'dtype_after': after.dtypes.reindex(before.columns).astype(str).values,
+                           'bytes_before': bytes_before.values,
+                           'bytes_after': bytes_after.reindex(before.columns).values})
+    report['saved_bytes'] = report['bytes_before'] - report['bytes_after']
+    report['saved_ratio'] = report['saved_bytes'] / report['bytes_before']
+
+    return report.sort_values('saved_bytes', ascending=False).reset_index(drop=True)
+
+
+def save_schema(schema, path):
+    """Persist a schema as JSON, so later loads can apply it while parsing"""
+
+    folder = os.path.dirname(path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder)
+
+    with open(path, 'w') as f:
+        json.dump(schema, f, indent=2)
+
+
+def load_schema(path):
+
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def _resolve(dtypes):
+    """Schema of the dtypes switch of the readers: a dict, or the path of an existing schema file"""
+
+    if isinstance(dtypes, dict):
+        return dtypes
+    if isinstance(dtypes, str) and dtypes != 'auto' and os.path.exists(dtypes):
+        return load_schema(dtypes)
+
+    return None
+
+
+def read_sql_kwargs(dtypes):
+    """Keyword arguments of pandas.read_sql applying a persisted schema during parsing.
+
+    Args:
+        dtypes: The dtypes switch of the readers: None (off), 'auto' (optimise after the load), a schema dict, or the
+            path of a schema file (used if it exists, otherwise created from the optimised result, see finalise)
+
+    Returns:
+        dict: dtype and parse_dates arguments, empty if there is no schema yet
+    """
+
+    schema = _resolve(dtypes)
+    if schema is None:
+        return {}
+
+    parse_dates = [col for col, dtype in schema.items() if dtype.startswith('datetime64')]
+    dtype = {col: dtype for col, dtype in schema.items()
+             if col not in parse_dates and not dtype.startswith(('int', 'uint', 'float'))}
+
+    # Numeric columns are left to finalise: read_sql can not convert integer columns with NULLs, and it would silently
+    # overflow values out of the range of the schema dtype
+    return {'dtype': dtype, 'parse_dates': parse_dates}
+
+
+def finalise(df, dtypes, logger=None):
+    """Apply the dtypes switch of the readers after the load.
+
+    With a schema, the dtypes not applied during parsing are applied. Otherwise the DataFrame is optimised, the memory
+    saving is logged, and if dtypes is a path, the inferred schema is saved there for the next loads.
+
+    Returns:
+        pandas.DataFrame
+    """
+
+    if dtypes is None:
+        return df
+
+    schema = _resolve(dtypes)
+    if schema is not None:
+        return apply_schema(df, schema)
+
+    schema = infer_schema(df)
+    optimised = apply_schema(df, schema)
+
+    if logger is not None:
+        report = memory_report(df, optimised)
+        logger.info('Dtypes are optimised, memory usage: {} -> {} bytes'.format(report['bytes_before'].sum(),
+                                                                              report['bytes_after'].sum()))
+        logger.debug('Memory saved per column:\n{}'.format(report.to_string()))
+
+    if isinstance(dtypes, str) and dtypes != 'auto':
+        save_schema(schema, dtypes)
+
+    return optimised
@@ -0,0 +1,107 @@
+from sqlalchemy import create_engine
+
+import atexit
+import os
+import threading
+
+
+# Default pool settings of the engines created by get_engine. Change them with configure_pool.
+POOL_SETTINGS = {
+    'pool_size': 5,
+    'max_overflow': 10,
+    'pool_pre_ping': True,  # Test connections on checkout, so dropped connections are replaced silently
+    'pool_recycle': 3600,  # Reconnect connections older than this [s], before the server closes them
+}
+
+_engines = {}
+_lock = threading.Lock()
+
+
+def configure_pool(**settings):
+    """Change the default pool settings. Only engines created after the call are affected.
+
+    Args:
+        **settings: create_engine keyword arguments, e.g. pool_size, max_overflow, pool_pre_ping, pool_recycle
+
+    Examples:
+        configure_pool(pool_size=10, pool_recycle=600)
+    """
+
+    POOL_SETTINGS.update(settings)
+
+
+def _registry_key(url, kwargs):
+
+    return url, repr(sorted(kwargs.items()))
+
+
+def get_engine(url, **kwargs):
+    """Return the process-wide engine of a connection URL, create it at the first call.
+
+    Engines (and their connection pools) are shared by every Pipe of the process, so warm connections are reused
+    instead of paying for connection setup in every run. Do not dispose the returned engine, use dispose_engine.
+
+    Args:
+        url (str): sqlalchemy connection URL
+        **kwargs: Extra create_engine arguments. They override POOL_SETTINGS and are part of the registry key.
+
+    Returns:
+        sqlalchemy.engine.Engine
+    """
+
+    key = _registry_key(url, kwargs)
+
+    with _lock:
+        engine = _engines.get(key)
+        if engine is None:
+            settings = dict(POOL_SETTINGS)
+            settings.update(kwargs)
+            engine = create_engine(url, **settings)
+            _engines[key] = engine
+
+    return engine
+
+
+def dispose_engine(url, **kwargs):
+    """Close the pooled connections of an engine and remove it from the registry"""
+
+    with _lock:
+        engine = _engines.pop(_registry_key(url, kwargs), None)
+
+    if engine is not None:
+        engine.dispose()
+
+
+def dispose_all():
+    """Close every pooled connection. Registered to run at interpreter shutdown."""
+
+    with _lock:
+        engines = list(_engines.values())
+        _engines.clear()
+
+    for engine in engines:
+        engine.dispose()
+
+
+def _after_fork():
+    """Replace the connection pools inherited by a forked child process (e.g. the workers of a process Pipeline).
+
+    The pooled connections of the parent are left open for the parent, the child opens its own connections, so the
+    two processes never share a socket.
+    """
+
+    global _lock
+    _lock = threading.Lock()
+
+    for engine in _engines.values():
+        try:
+            engine.dispose(close=False)
+        except TypeError:
+            # SQLAlchemy < 1.4.33 has no close argument, a new pool is created without closing the old one
+            engine.pool = engine.pool.recreate()
+
+
+atexit.register(dispose_all)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
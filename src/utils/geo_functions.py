@@ -2,41 +2,95 @@ import numpy as np
 import pandas as pd
 
 from pdb import set_trace
+import time
+
+
+# Coefficients of the 5th degree polynomials converting WGS (GPS) coordinates to EOV
+WGS_TO_EOV_1 = np.array([-1446726.767770151, 108117.591628471, -3583.808104234472, -2878.331381368081, 5954.115141624551, 600.6820679113122, -162.8630710077665,
+                         -1.605983921549304, -167.0351526678922, 94.17357187299571, -1.022705170995968, -0.2102529715747726, 8.374653367902908, -1.669835602681263,
+                         -0.5687852934137064, -0.0102364897314749, 3.145747727117474E-03, 4.243461608104641E-02, -0.1220651621472777, 6.164319332818425E-02,
+                         -0.0111868486664331])
+WGS_TO_EOV_2 = np.array([-4572371.701246022, -52255.9076175919, 116715.2509863826, -1754.425960153494, 4925.95947889304, -802.4934365679912, -120.2800919458708,
+                         23.43715857596192, -110.9503311938763, 115.8136579157841, -0.5059586206164071, -0.4012364834317996, 5.931656910019214, -1.601265506199198,
+                         -1.274622462961672, -4.413111236599502E-03, 3.290048806865441E-03, 1.958970187546845E-02, -7.879204301801745E-02, 4.433181641666852E-02,
+                         -2.052809717688681E-03])
+
+# Coefficients of the 5th degree polynomials converting EOV coordinates to WGS (GPS)
+EOV_TO_WGS_1 = np.array([10.7875129788011,1.261583194250094E-05,-1.337106981037251E-06,2.002452331639742E-12,2.084152383162452E-13,-2.054768579822759E-13,-9.738584419072772E-20,-5.483528404311994E-20,1.23213233745917E-19,3.025094136623967E-19,-1.184716569673144E-26,-1.586266440922264E-26,-5.710893755348441E-26,2.386706396303865E-26,1.022531720857679E-25,4.323474303592353E-33,-2.948540564438182E-32,-7.396192857879473E-33,5.827371979438498E-33,-5.800855076829614E-32,7.038862467233239E-32])
+EOV_TO_WGS_2 = np.array([45.03598737541833,9.467557805655573E-07,8.944343409479448E-06,1.513858594286746E-13,-7.156051828482407E-13,5.165384591948798E-15,-2.063583413832688E-20,-4.109505458046855E-20,-1.122684679257782E-19,3.501143099511104E-20,1.028110785949134E-26,-2.622544479899277E-27,-7.552805583186812E-27,-3.616373201962183E-26,1.404861943257385E-26,-1.699287352669952E-33,2.784410147303859E-32,4.57732017597244E-33,3.221377538677363E-33,9.501361872651711E-33,-3.483788985528678E-32])
+
+# Exponents (of the first, of the second variable) of the 21 monomials, in the order of the coefficients:
+# 1, a, b, ab, a^2, b^2, a^3, b^3, a^2b, ab^2, a^4, b^4, a^3b, a^2b^2, ab^3, a^5, b^5, a^4b, a^3b^2, a^2b^3, ab^4
+_EXP_A = np.array([0, 1, 0, 1, 2, 0, 3, 0, 2, 1, 4, 0, 3, 2, 1, 5, 0, 4, 3, 2, 1])
+_EXP_B = np.array([0, 0, 1, 1, 0, 2, 0, 3, 1, 2, 0, 4, 1, 2, 3, 0, 5, 1, 2, 3, 4])
+_EXPONENTS = list(zip(_EXP_A.tolist(), _EXP_B.tolist()))
+
+# Number of points evaluated at once in the batch functions. The basis takes 21 * 8 bytes per point.
+BATCH_CHUNKSIZE = 1000000
+
+
+def _powers(v):
+    """Power table [v^0, ..., v^5], every power is computed with one multiplication from the previous one"""
+
+    table = np.empty((6,) + v.shape)
+    table[0] = 1
+    for i in range(1, 6):
+        table[i] = table[i - 1] * v
+
+    return table
+
+
+def _polynomial(a, b, coef_1, coef_2):
+    """Evaluate two 5th degree polynomials of (a, b) on the shared monomial basis"""
+
+    # Scalars: plain float arithmetic is faster than building numpy power tables
+    if np.ndim(a) == 0 and np.ndim(b) == 0:
+        pow_a, pow_b = [1.0], [1.0]
+        for _ in range(5):
+            pow_a.append(pow_a[-1] * a)
+            pow_b.append(pow_b[-1] * b)
+        basis = np.array([pow_a[i] * pow_b[j] for i, j in _EXPONENTS])
+
+        return coef_1.dot(basis), coef_2.dot(basis)
+
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+
+    basis = _powers(a)[_EXP_A] * _powers(b)[_EXP_B]
+
+    return coef_1.dot(basis), coef_2.dot(basis)
+
+
+def _polynomial_batch(a, b, coef_1, coef_2, chunksize):
+    """Evaluate _polynomial in chunks, so the memory usage of the basis is capped"""
+
+    a = np.ravel(np.asarray(a, dtype=np.float64))
+    b = np.ravel(np.asarray(b, dtype=np.float64))
+    if len(a) != len(b):
+        raise ValueError(f'Coordinate arrays have different lengths: {len(a)}, {len(b)}')
+
+    out_1 = np.empty(len(a))
+    out_2 = np.empty(len(a))
+    for start in range(0, len(a), chunksize):
+        stop = start + chunksize
+        out_1[start:stop], out_2[start:stop] = _polynomial(a[start:stop], b[start:stop], coef_1, coef_2)
+
+    return out_1, out_2
 
 
 def wgs_to_eov(latitude, longitude):
-    l1 = np.array([-1446726.767770151, 108117.591628471, -3583.808104234472, -2878.331381368081, 5954.115141624551, 600.6820679113122, -162.8630710077665,
-                   -1.605983921549304, -167.0351526678922, 94.17357187299571, -1.022705170995968, -0.2102529715747726, 8.374653367902908, -1.669835602681263,
-                   -0.5687852934137064, -0.0102364897314749, 3.145747727117474E-03, 4.243461608104641E-02, -0.1220651621472777, 6.164319332818425E-02,
-                   -0.0111868486664331])
-    l2 = np.array([-4572371.701246022, -52255.9076175919, 116715.2509863826, -1754.425960153494, 4925.95947889304, -802.4934365679912, -120.2800919458708,
-                   23.43715857596192, -110.9503311938763, 115.8136579157841, -0.5059586206164071, -0.4012364834317996, 5.931656910019214, -1.601265506199198,
-                   -1.274622462961672, -4.413111236599502E-03, 3.290048806865441E-03, 1.958970187546845E-02, -7.879204301801745E-02, 4.433181641666852E-02,
-                   -2.052809717688681E-03])
-
-    p = np.array([1,
-                  longitude,
-                  latitude,
-                  longitude * latitude,
-                  longitude * longitude,
-                  latitude  * latitude,
-                  longitude * longitude * longitude,
-                  latitude  * latitude  * latitude,
-                  longitude * longitude * latitude,
-                  longitude * latitude  * latitude,
-                  longitude * longitude * longitude * longitude,
-                  latitude  * latitude  * latitude  * latitude,
-                  longitude * longitude * longitude * latitude,
-                  longitude * longitude * latitude  * latitude,
-                  longitude * latitude  * latitude  * latitude,
-                  longitude * longitude * longitude * longitude * longitude,
-                  latitude  * latitude  * latitude  * latitude  * latitude,
-                  longitude * longitude * longitude * longitude * latitude,
-                  longitude * longitude * longitude * latitude  * latitude,
-                  longitude * longitude * latitude  * latitude  * latitude,
-                  longitude * latitude  * latitude  * latitude  * latitude]).T
-
-    return p.dot(l1), p.dot(l2)
+    """
+    Converts WGS (GPS) coordinates to EOV coordinates
+
+    Args:
+        latitude (float): lat coordinate in WGS
+        longitude (float): lon coordinate in WGS
+
+    Returns:
+        (float, float): EOV coordinates
+    """
+
+    return _polynomial(longitude, latitude, WGS_TO_EOV_1, WGS_TO_EOV_2)
 
 
 def eov_to_wgs(x, y):
@@ -52,34 +106,80 @@ def eov_to_wgs(x, y):
         latitude (float): lat coordinate in WGS
     """
 
-    l1 = np.array([10.7875129788011,1.261583194250094E-05,-1.337106981037251E-06,2.002452331639742E-12,2.084152383162452E-13,-2.054768579822759E-13,-9.738584419072772E-20,-5.483528404311994E-20,1.23213233745917E-19,3.025094136623967E-19,-1.184716569673144E-26,-1.586266440922264E-26,-5.710893755348441E-26,2.386706396303865E-26,1.022531720857679E-25,4.323474303592353E-33,-2.948540564438182E-32,-7.396192857879473E-33,5.827371979438498E-33,-5.800855076829614E-32,7.038862467233239E-32])
-    l2 = np.array([45.03598737541833,9.467557805655573E-07,8.944343409479448E-06,1.513858594286746E-13,-7.156051828482407E-13,5.165384591948798E-15,-2.063583413832688E-20,-4.109505458046855E-20,-1.122684679257782E-19,3.501143099511104E-20,1.028110785949134E-26,-2.622544479899277E-27,-7.552805583186812E-27,-3.616373201962183E-26,1.404861943257385E-26,-1.699287352669952E-33,2.784410147303859E-32,4.57732017597244E-33,3.221377538677363E-33,9.501361872651711E-33,-3.483788985528678E-32])
-
-    p = np.array([1,
-                  x,
-                  y,
-                  x * y,
-                  x * x,
-                  y * y,
-                  x * x * x,
-                  y * y * y,
-                  x * x * y,
-                  x * y * y,
-                  x * x * x * x,
-                  y * y * y * y,
-                  x * x * x * y,
-                  x * x * y * y,
-                  x * y * y * y,
-                  x * x * x * x * x,
-                  y * y * y * y * y,
-                  x * x * x * x * y,
-                  x * x * x * y * y,
-                  x * x * y * y * y,
-                  x * y * y * y * y]).T
-
-    return p.dot(l1), p.dot(l2)
+    return _polynomial(x, y, EOV_TO_WGS_1, EOV_TO_WGS_2)
+
+
+def wgs_to_eov_batch(latitude, longitude, chunksize=BATCH_CHUNKSIZE):
+    """
+    Converts arrays of WGS (GPS) coordinates to EOV coordinates, in chunks of chunksize points.
+
+    Args:
+        latitude (numpy.ndarray or pandas.Series): lat coordinates in WGS
+        longitude (numpy.ndarray or pandas.Series): lon coordinates in WGS
+        chunksize (int): Number of points evaluated at once
+
+    Returns:
+        (numpy.ndarray, numpy.ndarray): EOV coordinates, in the order of wgs_to_eov
+
+    Examples:
+        df['EOV_1'], df['EOV_2'] = wgs_to_eov_batch(df['LATITUDE'], df['LONGITUDE'])
+    """
+
+    return _polynomial_batch(longitude, latitude, WGS_TO_EOV_1, WGS_TO_EOV_2, chunksize)
+
+
+def eov_to_wgs_batch(x, y, chunksize=BATCH_CHUNKSIZE):
+    """
+    Converts arrays of EOV coordinates to WGS (GPS) coordinates, in chunks of chunksize points.
+
+    Args:
+        x (numpy.ndarray or pandas.Series): x coordinates in EOV
+        y (numpy.ndarray or pandas.Series): y coordinates in EOV
+        chunksize (int): Number of points evaluated at once
+
+    Returns:
+        longitude (numpy.ndarray): lon coordinates in WGS
+        latitude (numpy.ndarray): lat coordinates in WGS
+    """
+
+    return _polynomial_batch(x, y, EOV_TO_WGS_1, EOV_TO_WGS_2, chunksize)
+
+
+def benchmark(n=1000000, n_scalar=10000, seed=0):
+    """Compare the throughput of the per-point functions with the batch functions on random Hungarian coordinates.
+
+    Args:
+        n (int): Number of points converted with the batch function
+        n_scalar (int): Number of points converted one by one with the per-point function
+
+    Returns:
+        pandas.DataFrame: points per second by method
+    """
+
+    rng = np.random.RandomState(seed)
+    latitude = rng.uniform(45.8, 48.5, n)
+    longitude = rng.uniform(16.1, 22.9, n)
+
+    ts = time.perf_counter()
+    scalar = [wgs_to_eov(lat, lon) for lat, lon in zip(latitude[:n_scalar], longitude[:n_scalar])]
+    scalar_time = time.perf_counter() - ts
+
+    ts = time.perf_counter()
+    batch_1, batch_2 = wgs_to_eov_batch(latitude, longitude)
+    batch_time = time.perf_counter() - ts
+
+    # Results must be the same up to floating point rounding
+    scalar = np.array(scalar)
+    assert np.allclose(scalar[:, 0], batch_1[:n_scalar]) and np.allclose(scalar[:, 1], batch_2[:n_scalar])
+
+    return pd.DataFrame({'method': ['wgs_to_eov', 'wgs_to_eov_batch'],
+                         'points': [n_scalar, n],
+                         'seconds': [scalar_time, batch_time],
+                         'points_per_second': [n_scalar / scalar_time, n / batch_time]})
 
 
 if __name__ == '__main__':
 
     assert ((wgs_to_eov(46, 20)[0] - 723792) ** 2 + (wgs_to_eov(46, 20)[1] - 73264) ** 2) ** 0.5 < 100
+
+    print(benchmark())
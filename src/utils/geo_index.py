@@ -0,0 +1,277 @@
+import numpy as np
+import pandas as pd
+import pickle
+
+from scipy.spatial import cKDTree
+
+from phoenix.core.geo_functions import wgs_to_eov_batch
+
+
+class SpatialIndex:
+    """KD-tree index of points in EOV (metric) space, for batch k-nearest and radius queries.
+
+    Points are projected from WGS (GPS) to EOV in one vectorized pass, so distances are Euclidean distances in
+    meters, and every query is O(log n) instead of a brute-force distance matrix.
+
+    Points can be inserted and removed without rebuilding the tree at every change. Removed points are only marked
+    (tombstones) and skipped by the queries, inserted points are kept in a small pending tree. The main tree is
+    rebuilt from the live points once the tombstones and the pending points exceed rebuild_ratio of the index.
+    Points are removed by id, and the ids never change, so ids kept by callers stay valid.
+
+    Args:
+        eov_1 (numpy.ndarray): First EOV coordinates of the indexed points (first output of wgs_to_eov)
+        eov_2 (numpy.ndarray): Second EOV coordinates of the indexed points
+        ids (array-like): Identifiers of the points returned by the queries. Default is the position, and the
+            inserted points get the next integers.
+        leafsize (int): Leaf size of the KD-tree
+        rebuild_ratio (float): Rebuild the tree if the number of removed and pending points exceeds this share of
+            the index (at least MIN_REBUILD points)
+
+    Examples:
+        index = SpatialIndex.from_dataframe(pharmacies, 'LATITUDE', 'LONGITUDE', id_col='PHARMACY_ID')
+        index.save('data/interim/pharmacy_index.pkl')
+
+        index = SpatialIndex.load('data/interim/pharmacy_index.pkl')
+        matches = index.match(deliveries, 'LATITUDE', 'LONGITUDE', k=3)
+
+        index.insert([47.49], [19.04], ids=[1001])
+        index.remove([17, 23])
+
+    """
+
+    # Changes below this number never trigger a rebuild
+    MIN_REBUILD = 1000
+
+    def __init__(self, eov_1, eov_2, ids=None, leafsize=16, rebuild_ratio=0.1):
+
+        points = np.column_stack([np.asarray(eov_1, dtype=np.float64), np.asarray(eov_2, dtype=np.float64)])
+
+        self.ids = np.arange(len(points)) if ids is None else np.asarray(ids)
+        if len(self.ids) != len(points):
+            raise ValueError(f'Number of ids ({len(self.ids)}) and points ({len(points)}) are different')
+
+        self.leafsize = leafsize
+        self.rebuild_ratio = rebuild_ratio
+        self._auto_ids = ids is None
+        # Next automatic id, never decreased, so the ids of removed points are not reused after a rebuild
+        self._next_id = len(points)
+        self._build(points, self.ids)
+
+    def _build(self, points, ids):
+        """Build the main tree of the points, without tombstones and pending points"""
+
+        self._points = points
+        self.ids = ids
+        self._alive = np.ones(len(points), dtype=bool)
+        self._n_indexed = len(points)
+        self._pending_tree = None
+        self.tree = cKDTree(points, leafsize=self.leafsize)
+
+    @classmethod
+    def from_wgs(cls, latitude, longitude, ids=None, leafsize=16):
+        """Build the index from WGS (GPS) coordinates"""
+
+        eov_1, eov_2 = wgs_to_eov_batch(latitude, longitude)
+
+        return cls(eov_1, eov_2, ids=ids, leafsize=leafsize)
+
+    @classmethod
+    def from_dataframe(cls, df, lat_col, lon_col, id_col=None, leafsize=16):
+        """Build the index from the WGS (GPS) coordinate columns of a DataFrame"""
+
+        ids = None if id_col is None else df[id_col].values
+
+        return cls.from_wgs(df[lat_col].values, df[lon_col].values, ids=ids, leafsize=leafsize)
+
+    def __len__(self):
+        return int(self._alive.sum())
+
+    def insert(self, latitude, longitude, ids=None):
+        """Add points given in WGS (GPS) coordinates. They are queryable at once, the tree is rebuilt lazily.
+
+        Args:
+            latitude (array-like): lat coordinates in WGS
+            longitude (array-like): lon coordinates in WGS
+            ids (array-like): Identifiers of the new points. Required if the index was built with ids.
+        """
+
+        eov_1, eov_2 = wgs_to_eov_batch(latitude, longitude)
+        if ids is None:
+            if not self._auto_ids:
+                raise ValueError('The index was built with ids, so the ids of the inserted points must be given')
+            ids = np.arange(self._next_id, self._next_id + len(eov_1))
+            self._next_id += len(ids)
+        ids = np.asarray(ids)
+        if len(ids) != len(eov_1):
+            raise ValueError(f'Number of ids ({len(ids)}) and points ({len(eov_1)}) are different')
+
+        self._points = np.concatenate([self._points, np.column_stack([eov_1, eov_2])])
+        self.ids = np.concatenate([self.ids, ids])
+        self._alive = np.concatenate([self._alive, np.ones(len(ids), dtype=bool)])
+        self._pending_tree = None
+        self._maybe_rebuild()
+
+    def remove(self, ids):
+        """Remove the points with the given ids. The points are skipped by the queries, the tree is rebuilt lazily.
+
+        Returns:
+            int: Number of removed points
+        """
+
+        removed = np.isin(self.ids, np.asarray(ids)) & self._alive
+        self._alive[removed] = False
+        self._maybe_rebuild()
+
+        return int(removed.sum())
+
+    def rebuild(self):
+        """Rebuild the tree from the live points, dropping the tombstones"""
+
+        self._build(self._points[self._alive], self.ids[self._alive])
+
+    def _maybe_rebuild(self):
+
+        changes = len(self._points) - self._n_indexed + int((~self._alive[:self._n_indexed]).sum())
+        if changes > max(self.MIN_REBUILD, self.rebuild_ratio * self._n_indexed):
+            self.rebuild()
+
+    def _trees(self):
+        """(tree, position of its first point) of the main tree and of the pending points"""
+
+        trees = [(self.tree, 0)] if self._n_indexed else []
+        if len(self._points) > self._n_indexed:
+            if self._pending_tree is None:
+                self._pending_tree = cKDTree(self._points[self._n_indexed:], leafsize=self.leafsize)
+            trees.append((self._pending_tree, self._n_indexed))
+
+        return trees
+
+    def _query_tree(self, tree, offset, points, k, max_distance):
+        """k nearest live points of one tree. Rows short of live points are queried again with a doubled k.
+
+        Returns:
+            distances (numpy.ndarray): (n, k) array, inf where there is no neighbour
+            positions (numpy.ndarray): (n, k) array of positions in self._points, -1 where there is no neighbour
+        """
+
+        out_distances = np.full((len(points), k), np.inf)
+        out_positions = np.full((len(points), k), -1, dtype=np.int64)
+
+        rows = np.arange(len(points))
+        kk = k
+        while len(rows):
+            kk = min(kk, tree.n)
+            distances, positions = tree.query(points[rows], k=kk, distance_upper_bound=max_distance)
+            distances = distances.reshape(len(rows), kk)
+            positions = positions.reshape(len(rows), kk)
+
+            # Missing neighbours are marked with position n by cKDTree
+            found = positions < tree.n
+            live = found.copy()
+            live[found] = self._alive[positions[found] + offset]
+
+            # A row is complete if it has k live neighbours, or there are no more points (within max_distance)
+            complete = (live.sum(axis=1) >= k) | (found.sum(axis=1) < kk) | (kk == tree.n)
+
+            order = np.argsort(~live[complete], axis=1, kind='stable')[:, :k]
+            width = order.shape[1]
+            out_distances[rows[complete], :width] = np.take_along_axis(np.where(live, distances, np.inf)[complete], order, axis=1)
+            out_positions[rows[complete], :width] = np.take_along_axis(np.where(live, positions + offset, -1)[complete], order, axis=1)
+
+            rows = rows[~complete]
+            kk *= 2
+
+        return out_distances, out_positions
+
+    def query(self, latitude, longitude, k=1, max_distance=np.inf):
+        """k-nearest indexed points of every query point
+
+        Args:
+            latitude (array-like): lat coordinates of the query points in WGS
+            longitude (array-like): lon coordinates of the query points in WGS
+            k (int): Number of neighbours
+            max_distance (float): Neighbours farther than this [m] are not returned
+
+        Returns:
+            distances (numpy.ndarray): (n, k) array of distances in meters, inf where there is no neighbour
+            ids (numpy.ndarray): (n, k) array of the ids of the neighbours, None where there is no neighbour
+        """
+
+        eov_1, eov_2 = wgs_to_eov_batch(latitude, longitude)
+        points = np.column_stack([eov_1, eov_2])
+
+        results = [self._query_tree(tree, offset, points, k, max_distance) for tree, offset in self._trees()]
+        if not results:
+            results = [(np.full((len(points), k), np.inf), np.full((len(points), k), -1, dtype=np.int64))]
+
+        # Merge the neighbours of the main and of the pending tree
+        distances = np.concatenate([r[0] for r in results], axis=1)
+        positions = np.concatenate([r[1] for r in results], axis=1)
+        order = np.argsort(distances, axis=1, kind='stable')[:, :k]
+        distances = np.take_along_axis(distances, order, axis=1)
+        positions = np.take_along_axis(positions, order, axis=1)
+
+        found = positions >= 0
+        ids = np.full(positions.shape, None, dtype=object)
+        ids[found] = self.ids[positions[found]]
+
+        return distances, ids
+
+    def query_radius(self, latitude, longitude, radius):
+        """Indexed points within a radius of every query point
+
+        Args:
+            latitude (array-like): lat coordinates of the query points in WGS
+            longitude (array-like): lon coordinates of the query points in WGS
+            radius (float): Radius in meters
+
+        Returns:
+            list: (distances, ids) array pair for every query point, sorted by distance
+        """
+
+        eov_1, eov_2 = wgs_to_eov_batch(latitude, longitude)
+        points = np.column_stack([eov_1, eov_2])
+
+        neighbours = [[] for _ in range(len(points))]
+        for tree, offset in self._trees():
+            for i, positions in enumerate(tree.query_ball_point(points, radius)):
+                neighbours[i].extend(position + offset for position in positions)
+
+        results = []
+        for point, positions in zip(points, neighbours):
+            positions = np.asarray(positions, dtype=np.int64)
+            positions = positions[self._alive[positions]]
+            distances = np.hypot(*(self._points[positions] - point).T) if len(positions) else np.empty(0)
+            order = np.argsort(distances)
+            results.append((distances[order], self.ids[positions[order]]))
+
+        return results
+
+    def match(self, df, lat_col, lon_col, k=1, max_distance=np.inf):
+        """k-nearest indexed points of every row of a DataFrame, in long format
+
+        Returns:
+            pandas.DataFrame: index (index of the row in df), rank (1 is the nearest), id, distance [m]
+        """
+
+        distances, ids = self.query(df[lat_col].values, df[lon_col].values, k=k, max_distance=max_distance)
+
+        matches = pd.DataFrame({'index': np.repeat(df.index.values, k),
+                                'rank': np.tile(np.arange(1, k + 1), len(df)),
+                                'id': ids.ravel(),
+                                'distance': distances.ravel()})
+
+        return matches[np.isfinite(matches['distance'])].reset_index(drop=True)
+
+    def save(self, path):
+        """Serialize the index, so workers can load it without rebuilding the tree"""
+
+        with open(path, 'wb') as f:
+            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def load(path):
+        """Load an index saved with save()"""
+
+        with open(path, 'rb') as f:
+            return pickle.load(f)
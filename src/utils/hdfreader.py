@@ -1,27 +1,81 @@
 import pandas as pd
 
 from nkmfraud.core.pipe import Pipe
+from nkmfraud.core.chunking import rows_for_budget
 
 
 class HDFReader(Pipe):
     """HDF5 file system reader Pipe"""
 
     @Pipe.timeit
-    def run(self, hdf_path, table_name):
+    def run(self, hdf_path, table_name, where=None, columns=None):
         """
         Args:
             hdf_path (str): Path of the .h5 file
             table_name: Name of the table in the .h5 file
+            where (str or list): Query on the index and the data columns of a table format store,
+                e.g. 'DATE >= "2019-06-01" & STORE = 12'. Only the matching rows are read.
+            columns (list): Columns to be read (table format only)
 
         Returns:
             pandas.DataFrame
 
         Examples:
             df = HDFReader('hdf_reader','loaders').run('hdf_test.h5', 'test_table')
+            df = HDFReader('hdf_reader','loaders').run('sales.h5', 'sales', where='DATE >= "2019-06-01"')
 
         """
 
-        df = pd.read_hdf(hdf_path, table_name)
+        df = pd.read_hdf(hdf_path, table_name, where=where, columns=columns)
         self.logger.info('DataFrame is loaded from {} with shape: {}'.format(hdf_path, df.shape))
 
         return df
+
+    def iter_chunks(self, hdf_path, table_name, chunksize=100000, max_bytes=None, sample_rows=100, where=None,
+                    columns=None):
+        """Read a table of an .h5 file in chunks with bounded memory.
+
+        Both fixed and table format stores are supported, chunks are read with row ranges (start, stop).
+        If where is given (table format only), the coordinates of the matching rows are queried first, and chunks
+        are read by slices of the coordinates.
+
+        Args:
+            hdf_path (str): Path of the .h5 file
+            table_name: Name of the table in the .h5 file
+            chunksize (int): Number of rows in one chunk (upper limit, if max_bytes is given)
+            max_bytes (int): Memory budget of one chunk in bytes
+            sample_rows (int): Size of the first chunk used for the estimation of the row size if max_bytes is given
+            where (str or list): Query on the index and the data columns, see run
+            columns (list): Columns to be read (table format only)
+
+        Yields:
+            pandas.DataFrame
+
+        Examples:
+            for chunk in HDFReader('hdf_reader','loaders').iter_chunks('hdf_test.h5', 'test_table', max_bytes=2**30):
+                process(chunk)
+
+        """
+
+        rows_per_chunk = chunksize if max_bytes is None else min(sample_rows, chunksize)
+
+        with pd.HDFStore(hdf_path, mode='r') as store:
+            coordinates = None if where is None else store.select_as_coordinates(table_name, where=where)
+
+            start = 0
+            while True:
+                if coordinates is None:
+                    chunk = store.select(table_name, start=start, stop=start + rows_per_chunk, columns=columns)
+                else:
+                    if start >= len(coordinates):
+                        break
+                    chunk = store.select(table_name, where=coordinates[start:start + rows_per_chunk], columns=columns)
+                if chunk.empty:
+                    break
+
+                start += len(chunk)
+                if max_bytes is not None:
+                    rows_per_chunk = rows_for_budget(chunk, max_bytes, chunksize)
+
+                self.logger.debug('Chunk is loaded from {} with shape: {}'.format(hdf_path, chunk.shape))
+                yield chunk
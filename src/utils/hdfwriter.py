@@ -4,20 +4,80 @@ from nkmfraud.core.pipe import Pipe
 
 
 class HDFWriter(Pipe):
-    """HDF5 file system reader Pipe"""
+    """HDF5 file system reader Pipe
+
+    By default the table is written in fixed format, replacing the previous content. In table format (format='table')
+    rows can be appended or upserted by key without rewriting the history, and the declared data columns can be
+    queried with HDFReader(where=...).
+    """
 
     @Pipe.timeit
-    def run(self, hdf_path, table_name, df):
+    def run(self, hdf_path, table_name, df, format='fixed', append=False, key_cols=None, data_columns=None,
+            index=True, complevel=None, complib=None):
         """
         Args:
             hdf_path (str): Path of the .h5 file
             table_name: Name of the table in the .h5 file
             df (pandas.DataFrame): DataFrame to be written to HDF5
+            format (str): fixed (fast, written and read in one piece) or table (appendable and queryable)
+            append (bool): Append df to the existing table (table format only). Otherwise the table is replaced.
+            key_cols (list): Upsert by key (table format only): the existing rows with the keys of df are removed
+                before df is appended. Key columns are always data columns.
+            data_columns (list or True): Columns which can be used in where queries (table format only)
+            index (bool): Create a full (completely sorted) PyTables index on the data columns, which makes where
+                queries touch only the matching rows
+            complevel (int): Compression level 0-9
+            complib (str): Compression library, e.g. blosc, zlib
 
         Examples:
             HDFWriter('hdf_writer','loaders').run('hdf_test.h5', 'test_table', df)
 
+            # Daily incremental load, reloaded days are replaced
+            HDFWriter('hdf_writer','loaders').run('sales.h5', 'sales', daily_df, format='table',
+                                                  key_cols=['DATE', 'SKU'], data_columns=['STORE'])
+
         """
 
-        df.to_hdf(hdf_path, table_name, append=False, quoting = 3)
-        self.logger.info('DataFrame is written to {}, with shape: {}'.format(hdf_path, df.shape))
+        if format == 'fixed':
+            if append or key_cols:
+                raise ValueError('append and key_cols require format="table"')
+            df.to_hdf(hdf_path, table_name, append=False, quoting = 3, complevel=complevel, complib=complib)
+            self.logger.info('DataFrame is written to {}, with shape: {}'.format(hdf_path, df.shape))
+            return
+
+        if data_columns is not True:
+            data_columns = list(dict.fromkeys(list(data_columns or []) + list(key_cols or [])))
+
+        with pd.HDFStore(hdf_path, mode='a', complevel=complevel, complib=complib) as store:
+            exists = table_name in store
+
+            if exists and not (append or key_cols):
+                store.remove(table_name)
+                exists = False
+
+            if exists and key_cols:
+                removed = self._remove_keys(store, table_name, df, key_cols)
+                self.logger.info('{} rows with existing keys are removed from {}'.format(removed, table_name))
+
+            # The index is built after the append, indexing row by row during the append would be slower
+            store.append(table_name, df, format='table', data_columns=data_columns, index=False)
+            if index and data_columns:
+                store.create_table_index(table_name, columns=data_columns if data_columns is not True else None,
+                                         optlevel=9, kind='full')
+
+            nrows = store.get_storer(table_name).nrows
+
+        self.logger.info('DataFrame is written to {}, with shape: {}, table rows: {}'.format(hdf_path, df.shape, nrows))
+
+    @staticmethod
+    def _remove_keys(store, table_name, df, key_cols):
+        """Remove the rows of a table format store whose key is in df. Only the key columns are read."""
+
+        keys = pd.MultiIndex.from_frame(df[key_cols].drop_duplicates())
+        existing = pd.MultiIndex.from_arrays([store.select_column(table_name, col).values for col in key_cols])
+        coordinates = existing.isin(keys).nonzero()[0]
+
+        if len(coordinates):
+            store.remove(table_name, where=coordinates)
+
+        return len(coordinates)
@@ -1,8 +1,11 @@
 from phoenix.core.pipe import Pipe
 
+from sqlalchemy import text
+
 import pandas as pd
 import datetime
 import sched
+import threading
 import time
 
 
@@ -13,11 +16,24 @@ class HeartBeat(Pipe):
     Table schema:
         TIMESTAMP: timestamptz
 
-    Note, that this class is not suitable for high frequency and precision heartbeat function implementation!
+    If components are given, one row is kept per component, and the heartbeats of all components are sent in one
+    upsert statement. The component column must be the primary key (or have a unique constraint).
+    Table schema:
+        COMPONENT: text (primary key)
+        TIMESTAMP: timestamptz
+
+    Heartbeats are sent either from the main loop with run_heartbeat, or from a background thread started with start,
+    which keeps a fixed schedule regardless of how busy the main loop is. Both use one persistent connection and a
+    single UPDATE (or upsert) statement per heartbeat. The connection is used under a lock, so heartbeats sent from
+    the main loop and the background thread at the same time are sent one after the other.
+
+    A missing table is created with the schema above at the first heartbeat. Cached read results of the
+    postgresmanager are invalidated after every heartbeat, so reads of the table return the new timestamp.
 
     Args:
         postgresmanager (PostgresManager): Postgres connection object
         table_name: Postgres table where heartbeat is sent
+        components (list): Names of the components, if the table has one row per component
 
     Example:
 
@@ -25,30 +41,156 @@ class HeartBeat(Pipe):
         while True:
             hb.run_heartbeat(60) #Send heartbeat every 60 seconds
 
+        # Or in the background
+        hb = HeartBeat(postgresmanager, 'heartbeat', components=['scorer', 'loader'])
+        hb.start(interval=5)
+        ...
+        hb.stop()
+
     """
 
-    def __init__(self, postgresmanager, table_name, *args, **kwargs):
+    def __init__(self, postgresmanager, table_name, *args, components=None, **kwargs):
 
         super().__init__(*args, **kwargs)
 
         self.postgresmanager = postgresmanager
         self.table_name = table_name
+        self.components = list(components) if components else None
         self.timestamp = None
 
+        # Guards self._conn, which is shared by the main loop and the background thread
+        self._conn = None
+        self._conn_lock = threading.RLock()
+        self._statements = self._prepare_statements()
+        self._table_checked = False
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def _create_statement(self):
+        """CREATE TABLE IF NOT EXISTS statement of the heartbeat table"""
+
+        if self.components is None:
+            return text(f'CREATE TABLE IF NOT EXISTS {self.table_name} ("timestamp" timestamptz)')
+
+        return text(f'CREATE TABLE IF NOT EXISTS {self.table_name} (component text PRIMARY KEY, "timestamp" timestamptz)')
+
+    def _prepare_statements(self):
+        """Build the statements of one heartbeat once, they are only executed afterwards"""
+
+        if self.components is None:
+            update = text(f'UPDATE {self.table_name} SET "timestamp" = :ts')
+            insert = text(f'INSERT INTO {self.table_name} ("timestamp") VALUES (:ts)')
+            return update, insert
+
+        values = ', '.join(f'(:component_{i}, :ts)' for i in range(len(self.components)))
+        upsert = text(f'INSERT INTO {self.table_name} (component, "timestamp") VALUES {values} '
+                      f'ON CONFLICT (component) DO UPDATE SET "timestamp" = EXCLUDED."timestamp"')
+
+        return upsert, None
+
+    def _connection(self):
+        """Persistent connection of the heartbeat, reopened after a failure. Call it holding self._conn_lock."""
+
+        if self._conn is None or self._conn.closed:
+            if self.postgresmanager.engine is None:
+                self.postgresmanager.create_engine()
+            self._conn = self.postgresmanager.engine.connect()
+
+        return self._conn
+
+    def close(self):
+        """Return the persistent connection to the pool"""
+
+        with self._conn_lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
     def send_heartbeat(self, current_time):
         """Send one heartbeat to the target table"""
 
-        hb_df = pd.DataFrame({'timestamp': current_time}, index=[0])
-
         #Make heartbeat timezone aware. Be careful, that this does not do datetime conversion from UTC to local time.
         #Use datetime.now() where necessary and set system timezone to localtime (in docker debian: -e TZ=Europe/Budapest)
-        hb_df['timestamp'] = hb_df['timestamp'].dt.tz_localize('Europe/Budapest')
+        params = {'ts': pd.Timestamp(current_time).tz_localize('Europe/Budapest').to_pydatetime()}
+
+        with self._conn_lock:
+            try:
+                conn = self._connection()
+                with conn.begin():
+                    # Only at the first heartbeat, the table is checked once per HeartBeat
+                    if not self._table_checked:
+                        conn.execute(self._create_statement())
+                    if self.components is None:
+                        update, insert = self._statements
+                        # The row is inserted only at the very first heartbeat on an empty table
+                        if conn.execute(update, params).rowcount == 0:
+                            conn.execute(insert, params)
+                    else:
+                        params.update({f'component_{i}': component for i, component in enumerate(self.components)})
+                        conn.execute(self._statements[0], params)
+                self._table_checked = True
+                self.postgresmanager.invalidate_results()
+                self.logger.info(f'Heartbeat is sent to {self.postgresmanager.host}:{self.postgresmanager.port}: {current_time}')
+            except Exception as e:
+                self.logger.error(f'Heartbeat forwarding to {self.postgresmanager.host}:{self.postgresmanager.port} failed: {e}')
+                # Drop the connection, the next heartbeat reconnects
+                try:
+                    self.close()
+                except Exception:
+                    self._conn = None
+
+    def start(self, interval):
+        """Send heartbeats every interval seconds from a background thread, until stop is called.
+
+        Heartbeats are scheduled on the monotonic clock at fixed times (start + k * interval), so the period does not
+        drift with the time of sending. If a heartbeat is late (e.g. the database was slow), the missed ones are
+        skipped instead of being sent in a burst.
+
+        Args:
+            interval (float): Interval of heartbeat in seconds
+        """
+
+        if self._thread is not None and self._thread.is_alive():
+            raise RuntimeError('Heartbeat is already running')
+
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._loop, args=(interval,), name=f'heartbeat-{self.table_name}', daemon=True)
+        self._thread.start()
+        self.logger.info(f'Heartbeat is started with {interval}s interval')
 
+    def stop(self, timeout=None):
+        """Stop the background heartbeat thread and close its connection"""
+
+        # The connection is closed by the thread itself
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self.logger.info('Heartbeat is stopped')
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _loop(self, interval):
+
+        next_time = time.monotonic()
         try:
-            self.postgresmanager.truncate_insert(self.table_name, hb_df)
-            self.logger.info(f'Heartbeat is sent to {self.postgresmanager.host}:{self.postgresmanager.port}: {current_time}')
-        except Exception as e:
-            self.logger.error(f'Heartbeat forwarding to {self.postgresmanager.host}:{self.postgresmanager.port} failed: {e}')
+            while not self._stop_event.is_set():
+                current_time = datetime.datetime.now()
+                self.send_heartbeat(current_time)
+                self.timestamp = current_time
+
+                next_time += interval
+                now = time.monotonic()
+                if next_time <= now:
+                    next_time += ((now - next_time) // interval + 1) * interval
+
+                # Returns early (True) if stop is called
+                if self._stop_event.wait(next_time - now):
+                    break
+        finally:
+            self.close()
 
 
     def run_heartbeat(self, interval):
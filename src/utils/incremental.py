@@ -0,0 +1,253 @@
+import datetime
+import decimal
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from nkmfraud.core.pipe import Pipe
+
+
+def _encode(value):
+    """JSON value and type name of a watermark"""
+
+    if isinstance(value, (pd.Timestamp, np.datetime64, datetime.date)):
+        return pd.Timestamp(value).isoformat(), 'datetime'
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, decimal.Decimal):
+        # DECIMAL / NUMERIC columns, e.g. numeric ids of Oracle and MSSQL sources. Saved as string, a float could be
+        # rounded above the largest loaded value, and the rows between them would never be loaded.
+        if not value.is_finite():
+            raise ValueError(f'Watermark can not be {value}')
+        return str(value), 'decimal'
+    if isinstance(value, (bool, int, float, str)):
+        return value, type(value).__name__
+
+    raise TypeError(f'Watermark of type {type(value).__name__} can not be stored, use a numeric, string or datetime '
+                    f'watermark column')
+
+
+def _decode(value, kind):
+    """Watermark of a JSON value and type name, see _encode"""
+
+    if kind == 'datetime':
+        return pd.Timestamp(value).to_pydatetime()
+    if kind == 'decimal':
+        return decimal.Decimal(str(value))
+
+    return value
+
+
+class WatermarkStore:
+    """High-water marks of incrementally loaded sources, persisted in a local JSON file.
+
+    Every source has the name of its watermark column (e.g. an autoincrement id or an updated_at timestamp), and the
+    largest value of the column loaded so far. The file is rewritten atomically at every update.
+
+    Args:
+        path (str): Path of the JSON state file
+    """
+
+    def __init__(self, path='data/interim/watermarks.json'):
+
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _load(self):
+
+        if not os.path.exists(self.path):
+            return {}
+
+        with open(self.path, 'r') as f:
+            return json.load(f)
+
+    def get(self, source):
+        """The watermark of a source, or None if it has not been loaded yet
+
+        Returns:
+            (str, object): column name, value (int, float, str, decimal.Decimal or datetime.datetime)
+        """
+
+        with self._lock:
+            state = self._load().get(source)
+
+        if state is None:
+            return None
+
+        return state['column'], _decode(state['value'], state['type'])
+
+    def set(self, source, column, value):
+        """Store the watermark of a source
+
+        Raises:
+            TypeError: if the value is not a number, string or datetime
+        """
+
+        value, kind = _encode(value)
+
+        with self._lock:
+            state = self._load()
+            state[source] = {'column': column, 'value': value, 'type': kind,
+                             'updated': datetime.datetime.now().isoformat()}
+
+            folder = os.path.dirname(self.path)
+            if folder and not os.path.exists(folder):
+                os.makedirs(folder)
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump(state, f, indent=2)
+            os.replace(self.path + '.tmp', self.path)
+
+    def reset(self, source):
+        """Forget the watermark of a source, so the next load is a full load"""
+
+        with self._lock:
+            state = self._load()
+            if state.pop(source, None) is not None:
+                with open(self.path + '.tmp', 'w') as f:
+                    json.dump(state, f, indent=2)
+                os.replace(self.path + '.tmp', self.path)
+
+
+class IncrementalLoader(Pipe):
+    """Incremental extraction of a growing or updated source table into a local Parquet snapshot.
+
+    The first run (or a full refresh) reads the whole table. Later runs read only the rows whose watermark column is
+    greater than the stored watermark, and merge them into the snapshot: rows with the key of a changed row are
+    replaced, new rows are appended. The watermark is saved in the metadata of the snapshot file, so the snapshot and
+    its watermark are replaced together, and a failed run (also without key_cols) is simply repeated. The state file
+    keeps a copy for monitoring, and WatermarkStore.reset forces a full load. Deleted source rows are not detected,
+    use full_refresh periodically if the source deletes.
+
+    The source is read with a callable, so every reader can be used which accepts a where condition with bound
+    parameters (MySQLReader.run, MSSQLReader.run, PostgresManager.read).
+
+    Args:
+        name (str): The name of the Pipe
+        logname (str): The name of the logfile
+        state_path (str): Path of the watermark state file (see WatermarkStore)
+        snapshot_dir (str): Directory of the Parquet snapshots, one <source>.parquet file per source
+
+    Examples:
+        loader = IncrementalLoader('claims_loader', 'loaders')
+
+        df = loader.run('mssql.claims',
+                        lambda where, params: MSSQLReader('mssql_reader', 'loaders').run(ip, db, 'claims',
+                                                                                        where=where, params=params),
+                        watermark_col='UPDATED_AT', key_cols=['CLAIM_ID'])
+
+        df = loader.run('postgres.eta', lambda where, params: postgresmanager.read('eta', where=where, params=params),
+                        watermark_col='ID')
+
+    """
+
+    def __init__(self, name, logname, state_path='data/interim/watermarks.json', snapshot_dir='data/interim/snapshots',
+                 cache=None):
+
+        super().__init__(name, logname, cache=cache)
+
+        self.watermarks = WatermarkStore(state_path)
+        self.snapshot_dir = snapshot_dir
+
+    def snapshot_path(self, source):
+        return os.path.join(self.snapshot_dir, source + '.parquet')
+
+    def snapshot_watermark(self, source):
+        """The watermark saved in the metadata of the snapshot, or None
+
+        Returns:
+            (str, object): column name, value, see WatermarkStore.get
+        """
+
+        path = self.snapshot_path(source)
+        if not os.path.exists(path):
+            return None
+
+        metadata = pq.read_schema(path).metadata or {}
+        if b'watermark' not in metadata:
+            return None
+
+        state = json.loads(metadata[b'watermark'])
+
+        return state['column'], _decode(state['value'], state['type'])
+
+    def _save_snapshot(self, path, snapshot, watermark_col):
+        """Write the snapshot with its watermark in the schema metadata, and replace the old snapshot atomically"""
+
+        table = pa.Table.from_pandas(snapshot, preserve_index=False)
+        if len(snapshot) and snapshot[watermark_col].notnull().any():
+            value, kind = _encode(snapshot[watermark_col].max())
+            metadata = dict(table.schema.metadata or {})
+            metadata[b'watermark'] = json.dumps({'column': watermark_col, 'value': value, 'type': kind}).encode()
+            table = table.replace_schema_metadata(metadata)
+
+        if not os.path.exists(self.snapshot_dir):
+            os.makedirs(self.snapshot_dir)
+        pq.write_table(table, path + '.tmp')
+        os.replace(path + '.tmp', path)
+
+    @Pipe.timeit
+    def run(self, source, read, watermark_col, key_cols=None, lookback=None, full_refresh=False):
+        """
+        Args:
+            source (str): Unique name of the source table, e.g. mssql.claims
+            read (callable): read(where, params) -> pandas.DataFrame. where is None for a full load, otherwise
+                a condition on watermark_col with the bound parameter :watermark
+            watermark_col (str): Column increasing with every insert / update (e.g. ID or UPDATED_AT)
+            key_cols (list): Key columns of the rows. Rows of the snapshot with the key of a loaded row are replaced.
+                If None, loaded rows are only appended (insert-only sources).
+            lookback: Re-read rows this much below the watermark (e.g. datetime.timedelta(minutes=10)), for rows
+                committed late with an older timestamp. Requires key_cols, so re-read rows are not duplicated.
+            full_refresh (bool): Read the whole table, and rebuild the snapshot
+
+        Returns:
+            pandas.DataFrame: the updated snapshot
+        """
+
+        if lookback is not None and not key_cols:
+            raise ValueError('lookback requires key_cols, otherwise re-read rows are duplicated')
+
+        path = self.snapshot_path(source)
+        watermark = None
+        if not full_refresh and os.path.exists(path) and self.watermarks.get(source) is not None:
+            # The watermark of the snapshot, the state file may be behind it after a failed run
+            watermark = self.snapshot_watermark(source) or self.watermarks.get(source)
+
+        if watermark is not None and watermark[0] != watermark_col:
+            self.logger.warning(f'Watermark column of {source} is changed from {watermark[0]} to {watermark_col}, full load')
+            watermark = None
+
+        if watermark is None:
+            self.logger.info(f'Full load of {source}')
+            snapshot = read(None, None)
+            delta_rows = len(snapshot)
+        else:
+            value = watermark[1] if lookback is None else watermark[1] - lookback
+            self.logger.info(f'Incremental load of {source} with {watermark_col} > {value}')
+            delta = read('{} > :watermark'.format(watermark_col), {'watermark': value})
+            delta_rows = len(delta)
+
+            if delta.empty:
+                self.logger.info(f'{source} has no new rows')
+                if self.watermarks.get(source) != watermark:
+                    self.watermarks.set(source, *watermark)
+                return pd.read_parquet(path)
+
+            snapshot = pd.read_parquet(path)
+            if key_cols:
+                changed = pd.MultiIndex.from_frame(snapshot[key_cols]).isin(pd.MultiIndex.from_frame(delta[key_cols]))
+                snapshot = snapshot[~changed]
+            snapshot = pd.concat([snapshot, delta], axis=0, ignore_index=True)
+
+        self._save_snapshot(path, snapshot, watermark_col)
+
+        if len(snapshot) and snapshot[watermark_col].notnull().any():
+            self.watermarks.set(source, watermark_col, snapshot[watermark_col].max())
+
+        self.logger.info(f'{delta_rows} rows are loaded from {source}, snapshot shape: {snapshot.shape}')
+
+        return snapshot
@@ -1,62 +1,167 @@
 import logging
-import logging.config
+import logging.handlers
+import atexit
+import json
+import multiprocessing.util
 import os
+import queue
+import threading
+
+# Logging mode of the process, change it with set_mode
+_settings = {'mode': 'queue', 'json': False}
+
+# logname -> (logging.Logger, logdir, QueueListener or None), every logname is configured once per process
+_loggers = {}
+_lock = threading.RLock()
+
+FORMAT = '%(asctime)s - %(pipename)s - %(levelname)s - %(message)s'
+
+
+class JsonFormatter(logging.Formatter):
+    """Format log records as one JSON object per line"""
+
+    def format(self, record):
+
+        out = {'time': self.formatTime(record),
+               'pipename': getattr(record, 'pipename', None),
+               'level': record.levelname,
+               'message': record.getMessage(),
+               'logger': record.name,
+               'thread': record.threadName}
+        if record.exc_info:
+            out['exception'] = self.formatException(record.exc_info)
+
+        return json.dumps(out, default=str)
+
+
+def set_mode(mode='queue', json_format=False):
+    """Set the logging mode of the process. Loggers already created are reconfigured.
 
-def create_logger(name, logname, logdir = '/log/'):
-    """The logger constructor, called by every Pipe at initation.
-    
     Args:
-        name (str): A unique name of the Pipe, which is included in the log message.
-        logname (str): The name of the log file where the logs will be written to.
+        mode (str): 'queue' (default): Pipes only put the records into a queue, and a background thread writes them
+            to the console and the log file, so logging never blocks a pipeline thread on I/O.
+            'sync': Records are written by the logging thread itself.
+        json_format (bool): Write the records as JSON lines instead of plain text
 
-    Retuns:
-        logging.Logger
-    
+    Examples:
+        log.set_mode('queue', json_format=True)
     """
 
+    if mode not in ('queue', 'sync'):
+        raise ValueError(f'Unknown logging mode: {mode}. Use queue or sync.')
+
+    with _lock:
+        configured = [(logname, logdir) for logname, (_, logdir, _) in _loggers.items()]
+        shutdown()
+        _settings.update({'mode': mode, 'json': json_format})
+        for logname, logdir in configured:
+            _configure(logname, logdir)
+
+
+def _configure(logname, logdir):
+    """Attach the console and the file handler to the logger of logname, directly or through a queue"""
+
     #Create log folder if it does not exist
     if not os.path.exists(logdir):
         os.makedirs(logdir)
 
-    #Add the name of the Pipe to the log message
-    extra = {'pipename':name}
+    formatter = JsonFormatter() if _settings['json'] else logging.Formatter(FORMAT)
+
+    console = logging.StreamHandler()
+    console.setLevel(logging.INFO)
+    console.setFormatter(formatter)
+
+    file = logging.handlers.TimedRotatingFileHandler(logdir + logname + '.log')
+    file.setLevel(logging.DEBUG)
+    file.setFormatter(formatter)
 
-    #Logger config
-    config = {
-        'disable_existing_loggers': False,
-        'version': 1,
-        'formatters': {
-            'default': {
-                'format' : '%(asctime)s - %(pipename)s - %(levelname)s - %(message)s'
-            },
-        },
-        'handlers': {
-            'console': {
-                'level': 'INFO',
-                'formatter': 'default',
-                'class': 'logging.StreamHandler',
-            },
-            'file' : {
-                'level': 'DEBUG',
-                'formatter' : 'default',
-                'class': 'logging.handlers.TimedRotatingFileHandler',
-                'filename' : logdir + logname + '.log'
-            }
-        },
-        'loggers': {
-            logname: {
-                'handlers': ['console', 'file'],
-                'level' : 'DEBUG'
-            },
-        },
-    }
-    
-
-    #Set logging config
-    logging.config.dictConfig(config)
     logger = logging.getLogger(logname)
-    logger = logging.LoggerAdapter(logger, extra)
+    logger.setLevel(logging.DEBUG)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+
+    listener = None
+    if _settings['mode'] == 'queue':
+        records = queue.SimpleQueue()
+        listener = logging.handlers.QueueListener(records, console, file, respect_handler_level=True)
+        listener.start()
+        logger.addHandler(logging.handlers.QueueHandler(records))
+    else:
+        logger.addHandler(console)
+        logger.addHandler(file)
+
+    _loggers[logname] = (logger, logdir, listener)
 
     return logger
 
 
+def shutdown():
+    """Write out the queued records, and close the handlers of every configured logger. Registered at exit."""
+
+    with _lock:
+        for logger, _, listener in _loggers.values():
+            if listener is not None:
+                listener.stop()
+                for handler in listener.handlers:
+                    handler.close()
+            for handler in list(logger.handlers):
+                logger.removeHandler(handler)
+                handler.close()
+        _loggers.clear()
+
+
+atexit.register(shutdown)
+
+
+def _after_fork():
+    """Reconfigure the loggers in a forked child process (e.g. a worker of a process pool Pipeline).
+
+    The child inherits the queue handlers, but not the listener threads of the parent, so its records would stay in
+    the copied queues. The child starts its own listeners, which append to the same log files. Process pool workers
+    exit without running atexit, so the queues are also written out by a multiprocessing finalizer.
+    """
+
+    global _lock
+
+    # The lock may have been held by another thread of the parent at the fork
+    _lock = threading.RLock()
+
+    # The listeners belong to the parent, they are dropped without stopping
+    configured = [(logname, logdir) for logname, (_, logdir, _) in _loggers.items()]
+    _loggers.clear()
+    for logname, logdir in configured:
+        _configure(logname, logdir)
+
+    multiprocessing.util.Finalize(None, shutdown, exitpriority=0)
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def create_logger(name, logname, logdir = '/log/'):
+    """The logger constructor, called by every Pipe at initation.
+
+    The handlers of a logname are configured only at the first call in the process, later calls just wrap the
+    cached logger, so creating many Pipes is cheap.
+
+    Args:
+        name (str): A unique name of the Pipe, which is included in the log message.
+        logname (str): The name of the log file where the logs will be written to.
+
+    Retuns:
+        logging.Logger
+
+    """
+
+    with _lock:
+        if logname in _loggers:
+            logger = _loggers[logname][0]
+        else:
+            logger = _configure(logname, logdir)
+
+    #Add the name of the Pipe to the log message
+    extra = {'pipename':name}
+
+    return logging.LoggerAdapter(logger, extra)
@@ -2,12 +2,87 @@ from phoenix.core.pipe import Pipe
 
 from pymongo import MongoClient
 from pymongo import ASCENDING
+from pymongo.errors import BulkWriteError, OperationFailure
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from copy import deepcopy
 import pandas as pd
-import numpy as np
 import gridfs
+import hashlib
+import io
+import itertools
+import threading
+import time
+import zlib
+from collections import OrderedDict
 from pdb import set_trace
 
+# Optional compression libraries of the model store
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+
+# Size of the pieces models are hashed, compressed and uploaded in
+MODEL_STREAM_CHUNK = 4 * 1024 * 1024
+
+# zstd compresses pickled models best and fastest, zlib is always available
+DEFAULT_MODEL_COMPRESSION = 'zstd' if zstandard is not None else 'zlib'
+
+
+class _LZ4Compressor:
+    """Adapter of the lz4 frame compressor to the compress/flush interface of zlib"""
+
+    def __init__(self):
+        self._compressor = lz4.frame.LZ4FrameCompressor()
+        self._header = self._compressor.begin()
+
+    def compress(self, data):
+        out = self._header + self._compressor.compress(data)
+        self._header = b''
+        return out
+
+    def flush(self):
+        return self._header + self._compressor.flush()
+
+
+def _compressor(codec):
+    """Streaming compressor with compress(data) and flush() methods"""
+
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ImportError('zstandard is required for zstd compression')
+        return zstandard.ZstdCompressor().compressobj()
+    if codec == 'lz4':
+        if lz4 is None:
+            raise ImportError('lz4 is required for lz4 compression')
+        return _LZ4Compressor()
+    if codec == 'zlib':
+        return zlib.compressobj()
+
+    raise ValueError(f'Unknown compression: {codec}. Use zstd, lz4, zlib or None.')
+
+
+def _decompressor(codec):
+    """Streaming decompressor with a decompress(data) method"""
+
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ImportError('zstandard is required for zstd decompression')
+        return zstandard.ZstdDecompressor().decompressobj()
+    if codec == 'lz4':
+        if lz4 is None:
+            raise ImportError('lz4 is required for lz4 decompression')
+        return lz4.frame.LZ4FrameDecompressor()
+    if codec == 'zlib':
+        return zlib.decompressobj()
+
+    raise ValueError(f'Unknown compression: {codec}')
+
 
 class MongoManager(Pipe):
     """Manages calls and queries of MongoDB
@@ -16,10 +91,11 @@ class MongoManager(Pipe):
         host (str): Host name
         port (int): Port number
         db (str): db name (default phoenixpharma in the project)
+        model_cache_bytes (int): Size of the in-memory LRU cache of the models read with get_model. 0 disables it.
 
     """
 
-    def __init__(self, host, port, db='phoenixpharma', *args, **kwargs):
+    def __init__(self, host, port, db='phoenixpharma', *args, model_cache_bytes=512 * 1024 ** 2, **kwargs):
 
         super().__init__(*args, **kwargs)
 
@@ -28,6 +104,13 @@ class MongoManager(Pipe):
         self.db = db
 
         self.client=None
+        self.server_version = None
+
+        # LRU cache of models: (collection, str(id)) -> bytes, and (collection, sha256) -> id
+        self.model_cache_bytes = model_cache_bytes
+        self._model_cache = OrderedDict()
+        self._model_ids = {}
+        self._model_cache_lock = threading.Lock()
 
     def create_client(self):
         """Create Mongo client"""
@@ -35,7 +118,8 @@ class MongoManager(Pipe):
         try:
             self.client = MongoClient(self.host, self.port, serverSelectionTimeoutMS=10000)
             #Force connection to raise exception in case of any problem
-            _ = self.client.server_info()
+            info = self.client.server_info()
+            self.server_version = tuple(info.get('versionArray', [0, 0])[:2])
             self.logger.info(f'MongoClient connected to {self.host}:{self.port}')
 
         except Exception as e:
@@ -62,6 +146,13 @@ class MongoManager(Pipe):
         #Connect to db
         db = self.client[self.db]
 
+        # DataFrames are converted to new documents batch by batch, no copy is needed
+        if isinstance(data, pd.DataFrame):
+            report = self.bulk_insert(data, collection, drop_collection=drop_collection, ordered=True)
+            if report['failed']:
+                self.logger.error('MongoDB insert failed: {} documents are not inserted'.format(report['failed']))
+            return
+
         # pymongo collection.insert() modifies dict in place, thus the copy()!
         data = deepcopy(data)
 
@@ -78,17 +169,104 @@ class MongoManager(Pipe):
             elif isinstance(data, list):
                 db[collection].insert_many(data)
 
-            # use insert_many if data is a dataframe
-            elif isinstance(data, pd.DataFrame):
-                for col in data.dtypes[data.dtypes == 'datetime64[ns]'].index.tolist():
-                    data[col] = pd.to_datetime(data[col]).astype(object)
-                    data[col] = data[col].where(data[col].notnull(), None)
-                data = data.to_dict(orient='records')
-                db[collection].insert_many(data)
-
         except Exception as e:
             self.logger.error('MongoDB insert failed: {}'.format(e))
 
+    @staticmethod
+    def _to_documents(df):
+        """Convert a DataFrame (slice) to a list of BSON compatible documents"""
+
+        # BSON has no NaT, datetime columns are converted to datetime objects with None for missing values
+        datetime_cols = [col for col in df.columns if pd.api.types.is_datetime64_any_dtype(df[col])]
+        if datetime_cols:
+            df = df.assign(**{col: df[col].astype(object).where(df[col].notnull(), None) for col in datetime_cols})
+
+        return df.to_dict(orient='records')
+
+    def _insert_batch(self, collection, df, batch_num, ordered=False):
+        """Insert one batch of a DataFrame, and report the result"""
+
+        ts = time.time()
+        result = {'batch': batch_num, 'rows': len(df), 'inserted': 0, 'failed': 0, 'seconds': None, 'error': None}
+
+        try:
+            docs = self._to_documents(df)
+            self.client[self.db][collection].insert_many(docs, ordered=ordered)
+            result['inserted'] = len(docs)
+
+        except BulkWriteError as e:
+            result['inserted'] = e.details.get('nInserted', 0)
+            result['failed'] = len(df) - result['inserted']
+            result['error'] = '{} write errors, first: {}'.format(len(e.details.get('writeErrors', [])),
+                                                                  (e.details.get('writeErrors') or [{}])[0].get('errmsg'))
+
+        except Exception as e:
+            result['failed'] = len(df)
+            result['error'] = str(e)
+
+        result['seconds'] = time.time() - ts
+
+        return result
+
+    def bulk_insert(self, df, collection, batch_size=10000, n_workers=1, drop_collection=False, ordered=False):
+        """
+        Insert a DataFrame in bounded batches with unordered insert_many, optionally from a thread pool.
+
+        Only the documents of the batches in flight (at most 2 * n_workers) are held in memory, the DataFrame is
+        not copied. Failed documents do not stop the load, they are reported per batch.
+
+        Args:
+            df (pandas.DataFrame): DataFrame to be inserted
+            collection (str): collection name
+            batch_size (int): Number of documents in one insert_many call
+            n_workers (int): Number of batches sent in parallel
+            drop_collection (boolean): If True, collection is dropped before insert. Thus it's a full replace.
+            ordered (boolean): If True, a batch stops at the first failed document (insert_many ordered mode)
+
+        Returns:
+            dict: inserted, failed (number of documents), seconds, docs_per_second and batches (list of per batch
+            reports: batch, rows, inserted, failed, seconds, error)
+        """
+
+        #Establish connection
+        if self.client is None:
+            self.create_client()
+
+        if drop_collection:
+            self.client[self.db].drop_collection(collection)
+
+        ts = time.time()
+        batches = []
+        slices = ((i, df.iloc[start:start + batch_size]) for i, start in enumerate(range(0, len(df), batch_size)))
+
+        if n_workers > 1:
+            with ThreadPoolExecutor(max_workers=n_workers) as executor:
+                running = set()
+                for batch_num, batch in slices:
+                    # Bound the number of batches in flight
+                    if len(running) >= 2 * n_workers:
+                        done, running = wait(running, return_when=FIRST_COMPLETED)
+                        batches.extend(future.result() for future in done)
+                    running.add(executor.submit(self._insert_batch, collection, batch, batch_num, ordered))
+                batches.extend(future.result() for future in wait(running).done)
+        else:
+            batches = [self._insert_batch(collection, batch, batch_num, ordered) for batch_num, batch in slices]
+
+        batches = sorted(batches, key=lambda b: b['batch'])
+        seconds = time.time() - ts
+        report = {'inserted': sum(b['inserted'] for b in batches),
+                  'failed': sum(b['failed'] for b in batches),
+                  'seconds': seconds,
+                  'docs_per_second': sum(b['inserted'] for b in batches) / seconds if seconds > 0 else None,
+                  'batches': batches}
+
+        for batch in batches:
+            if batch['error'] is not None:
+                self.logger.warning(f"[BATCH]: {batch['batch']} insert into [COLLECTION]: {collection} failed for {batch['failed']} documents: {batch['error']}")
+        self.logger.info(f"[DOC_NUM]: {report['inserted']} documents are inserted into [COLLECTION]: {collection}, {report['failed']} failed, {len(batches)} batches, {report['docs_per_second'] or 0:.0f} docs/s")
+
+        return report
+
     def insert_model(self, data, collection):
         """
         Loads a model into the given MongoDB collection
@@ -119,6 +297,8 @@ class MongoManager(Pipe):
     def read_model(self, collection, id):
         """Reads a serialized sklearn model from MongoDB.
 
+        Models stored with put_model are decompressed, and served from the local model cache (see get_model).
+
         Args:
             collection (str): collection name
             id (ObjectId): the id of the file
@@ -126,26 +306,133 @@ class MongoManager(Pipe):
             list
         """
 
+        return self.get_model(collection, id=id)
+
+    def put_model(self, data, collection, compression=DEFAULT_MODEL_COMPRESSION):
+        """Stores a serialized model in GridFS compressed, unless the same content is already stored.
+
+        The content is hashed (sha256) and compressed in pieces of MODEL_STREAM_CHUNK bytes, and streamed into
+        GridFS, so no compressed copy of the whole model is built in memory.
+
+        Args:
+            data (bytes or file-like): Serialized model, e.g. pickle.dumps(model). File-like objects must be seekable.
+            collection (str): collection name (GridFS bucket)
+            compression (str): zstd, lz4, zlib or None. Default is zstd if zstandard is installed, zlib otherwise.
+
+        Returns:
+            ObjectId: id of the stored (or the already existing identical) model
+        """
+
         #Establish connection
         if self.client is None:
             self.create_client()
 
-        #Connect to db
-        db = self.client[self.db]
+        fs = gridfs.GridFS(self.client[self.db], collection)
+        stream = io.BytesIO(data) if isinstance(data, (bytes, bytearray, memoryview)) else data
+
+        # Hash the content first, it is not uploaded again if it exists
+        digest = hashlib.sha256()
+        for piece in iter(lambda: stream.read(MODEL_STREAM_CHUNK), b''):
+            digest.update(piece)
+        sha256 = digest.hexdigest()
+
+        existing = fs.find_one({'metadata.sha256': sha256})
+        if existing is not None:
+            self.logger.info(f'Model is already stored in [COLLECTION]: {collection} with [ID]: {existing._id}, upload is skipped')
+            return existing._id
+
+        stream.seek(0)
+        compressor = _compressor(compression) if compression else None
+        try:
+            with fs.new_file(metadata={'sha256': sha256, 'compression': compression}) as grid_in:
+                for piece in iter(lambda: stream.read(MODEL_STREAM_CHUNK), b''):
+                    grid_in.write(compressor.compress(piece) if compressor else piece)
+                if compressor:
+                    grid_in.write(compressor.flush())
+
+        except Exception as e:
+            self.logger.error('MongoDB model insert failed: {}'.format(e))
+            raise
+
+        self.logger.info(f'Model is stored in [COLLECTION]: {collection} with [ID]: {grid_in._id}, [COMPRESSION]: {compression}, [SIZE]: {grid_in.length} bytes')
+
+        return grid_in._id
+
+    def get_model(self, collection, id=None, sha256=None):
+        """Reads a serialized model from GridFS by id or content hash, decompressed.
+
+        Recently read models are kept in a local LRU cache (model_cache_bytes), so reloading the same model
+        does not touch the network.
+
+        Args:
+            collection (str): collection name (GridFS bucket)
+            id (ObjectId): the id of the file
+            sha256 (str): content hash of the model, used if id is None
+
+        Returns:
+            bytes
+        """
+
+        if id is None and sha256 is None:
+            raise ValueError('Either id or sha256 of the model must be given')
+
+        with self._model_cache_lock:
+            if id is None:
+                id = self._model_ids.get((collection, sha256))
+            if id is not None and (collection, str(id)) in self._model_cache:
+                self._model_cache.move_to_end((collection, str(id)))
+                self.logger.debug(f'Model is read from cache [COLLECTION]: {collection} with [ID]: {id}')
+                return self._model_cache[(collection, str(id))]
 
-        fs = gridfs.GridFSBucket(db, collection)
+        #Establish connection
+        if self.client is None:
+            self.create_client()
+
+        db = self.client[self.db]
 
         try:
-            with fs.open_download_stream(id) as handler:
-                out = handler.read()
-            self.logger.info(f'[GRIDFS_CHUNK_NUM]: {len(out)} chunks are returned from [COLLECTION]: {collection} with [ID]: {id} ')
+            if id is None:
+                grid_out = gridfs.GridFS(db, collection).find_one({'metadata.sha256': sha256})
+                if grid_out is None:
+                    raise gridfs.errors.NoFile(f'No model with [SHA256]: {sha256} in [COLLECTION]: {collection}')
+                id = grid_out._id
+
+            with gridfs.GridFSBucket(db, collection).open_download_stream(id) as handler:
+                metadata = handler.metadata or {}
+                decompressor = _decompressor(metadata['compression']) if metadata.get('compression') else None
+                out = io.BytesIO()
+                for piece in iter(lambda: handler.read(MODEL_STREAM_CHUNK), b''):
+                    out.write(decompressor.decompress(piece) if decompressor else piece)
+                if hasattr(decompressor, 'flush'):
+                    out.write(decompressor.flush())
+                out = out.getvalue()
+            self.logger.info(f'[MODEL_SIZE]: {len(out)} bytes are returned from [COLLECTION]: {collection} with [ID]: {id}')
 
         except Exception as e:
             self.logger.error('MongoDB read failed: {}'.format(e))
             raise
 
+        self._cache_model(collection, id, metadata.get('sha256'), out)
+
         return out
 
+    def _cache_model(self, collection, id, sha256, data):
+        """Put a model into the LRU cache, and evict the least recently used ones over model_cache_bytes"""
+
+        if len(data) > self.model_cache_bytes:
+            return
+
+        with self._model_cache_lock:
+            self._model_cache[(collection, str(id))] = data
+            if sha256:
+                self._model_ids[(collection, sha256)] = id
+
+            size = sum(len(v) for v in self._model_cache.values())
+            while size > self.model_cache_bytes:
+                key, evicted = self._model_cache.popitem(last=False)
+                size -= len(evicted)
+                self._model_ids = {k: v for k, v in self._model_ids.items() if (k[0], str(v)) != key}
+
 
     def delete_model(self, collection, id):
         """Delete moded (GridFS) from collection with id
@@ -171,12 +458,44 @@ class MongoManager(Pipe):
             fs.delete(id)
             self.logger.info(f'Model is deleted from [COLLECTION]: {collection} with [MODEL_ID]: {id}')
 
+            with self._model_cache_lock:
+                self._model_cache.pop((collection, str(id)), None)
+                self._model_ids = {k: v for k, v in self._model_ids.items() if (k[0], str(v)) != (collection, str(id))}
+
         except Exception as e:
             self.logger.error('MongoDB model deletion failed: {}'.format(e))
             raise
 
 
-    def read(self, collection, filter=None, drop_id=True, limit=0, sort=None):
+    def _find(self, collection, filter=None, drop_id=True, limit=0, sort=None, projection=None, batch_size=None):
+        """Create the cursor of a find query. _id is excluded on the server side if drop_id is True."""
+
+        #Establish connection
+        if self.client is None:
+            self.create_client()
+
+        #Connect to db
+        db = self.client[self.db]
+
+        if drop_id:
+            if projection is None:
+                projection = {'_id': False}
+            elif isinstance(projection, dict):
+                projection = dict(projection, _id=False)
+            else:
+                projection = dict.fromkeys(projection, True)
+                projection['_id'] = False
+
+        cursor = db[collection].find(filter, projection).limit(limit)
+        if sort:
+            cursor = cursor.sort(sort)
+        if batch_size:
+            cursor = cursor.batch_size(batch_size)
+
+        return cursor
+
+    def read(self, collection, filter=None, drop_id=True, limit=0, sort=None, projection=None, batch_size=None,
+             as_dataframe=False):
         """Reads data from MongoDB.
 
         Args:
@@ -185,47 +504,56 @@ class MongoManager(Pipe):
             drop_id (bool): If True, Mongo default _id is dropped from every result
             limit (int): Number of documents to be retrieved. Default 0 means that all records are retrieved.
             sort (list): Valid definition of mongo filtering. E.g. [("field1", pymongo.ASCENDING), ("field2", pymongo.DESCENDING)]. Default None means there is no sort.
+            projection (list or dict): Fields to be returned, e.g. ['field1', 'field2'] or {'field3': False}. Default None means every field.
+            batch_size (int): Number of documents returned by the server in one batch. Default None is the server default.
+            as_dataframe (bool): If True, a pandas.DataFrame is returned, built batch by batch (see iter_read)
 
         Returns:
-            list
+            list or pandas.DataFrame
         """
 
-        #Establish connection
-        if self.client is None:
-            self.create_client()
-
-        #Connect to db
-        db = self.client[self.db]
+        if as_dataframe:
+            chunks = list(self.iter_read(collection, filter=filter, drop_id=drop_id, limit=limit, sort=sort,
+                                         projection=projection, batch_size=batch_size or 10000))
+            results = pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+            self.logger.info(f'[DOC_NUM]: {len(results)} elements are returned from [COLLECTION]: {collection}')
 
+            return results
 
         try:
-            results = []
+            results = list(self._find(collection, filter, drop_id, limit, sort, projection, batch_size))
+            self.logger.info(f'[DOC_NUM]: {len(results)} elements are returned from [COLLECTION]: {collection}')
+
+        except Exception as e:
+            self.logger.error('MongoDB read failed: {}'.format(e))
+            raise
 
-            # If sort is applied
-            if sort:
-                for item in db[collection].find(filter).limit(limit).sort(sort):
-                    # Drop id
-                    if drop_id:
-                        del item['_id']
+        return results
 
-                    results.append(item)
+    def iter_read(self, collection, filter=None, drop_id=True, limit=0, sort=None, projection=None, batch_size=10000):
+        """Reads data from MongoDB, and yields it in DataFrames of batch_size documents.
 
-            else:
-                for item in db[collection].find(filter).limit(limit):
-                    # Drop id
-                    if drop_id:
-                        del item['_id']
+        Only one batch is held in memory at a time. See read() for the arguments.
 
-                    results.append(item)
+        Yields:
+            pandas.DataFrame
+        """
 
-            self.logger.info(f'[DOC_NUM]: {len(results)} elements are returned from [COLLECTION]: {collection}')
+        try:
+            cursor = self._find(collection, filter, drop_id, limit, sort, projection, batch_size)
+            try:
+                while True:
+                    docs = list(itertools.islice(cursor, batch_size))
+                    if not docs:
+                        break
+                    yield pd.DataFrame.from_records(docs)
+            finally:
+                cursor.close()
 
         except Exception as e:
             self.logger.error('MongoDB read failed: {}'.format(e))
             raise
 
-        return results
-
     def drop_collection(self, collection):
         """Drop collection.
 
@@ -271,14 +599,97 @@ class MongoManager(Pipe):
             self.logger.error('MongoDB insert failed: {}'.format(e))
             raise
 
-    def get_median(self, collection, filters, output_var):
+    @staticmethod
+    def _quantile_field(q):
+        """Name of the output field of a quantile, e.g. 0.5 -> q50 (dots are not allowed in field names)"""
+
+        return 'q' + format(q * 100, 'g').replace('.', '_')
+
+    def _stats_pipeline(self, variable, filters, group_by, quantiles, method, skip_nulls=True):
+        """Aggregation sub-pipeline computing count, mean and quantiles of one variable by group.
+
+        The exact quantiles are the elements of the sorted values at index ceil((count - 1) * q), the same element as
+        numpy.quantile with method='higher'. The methods:
+            window: $setWindowFields ranks the sorted values, only the quantile rows are kept (MongoDB 5.0+).
+                No array of the values is built, so groups of any size are handled.
+            push: the sorted values of every group are collected into one array (older servers). The values of a
+                group must fit into one 16MB document (about 1 million numbers).
+            approximate: $percentile (MongoDB 7.0+).
         """
-        Returns the median vlaue of a variable.
+
+        value = f'${variable}'
+        group_id = {col: f'${col}' for col in group_by} if group_by else None
+
+        stages = [{'$match': filters}] if filters else []
+        if skip_nulls:
+            stages.append({'$match': {variable: {'$ne': None}}})
+
+        if method == 'approximate':
+            stages.append({'$group': {'_id': group_id,
+                                      'count': {'$sum': 1},
+                                      'mean': {'$avg': value},
+                                      'quantiles': {'$percentile': {'input': value, 'p': list(quantiles), 'method': 'approximate'}}}})
+            fields = {self._quantile_field(q): {'$arrayElemAt': ['$quantiles', i]} for i, q in enumerate(quantiles)}
+
+        elif method == 'window':
+            def rank(count, q):
+                # 1-based rank of the quantile element
+                return {'$add': [{'$ceil': {'$multiply': [{'$subtract': [count, 1]}, q]}}, 1]}
+
+            whole = {'documents': ['unbounded', 'unbounded']}
+            window = {'sortBy': {variable: ASCENDING},
+                      'output': {'_rank': {'$documentNumber': {}},
+                                 '_count': {'$count': {}, 'window': whole},
+                                 '_mean': {'$avg': value, 'window': whole}}}
+            if group_id is not None:
+                window['partitionBy'] = group_id
+            stages += [{'$setWindowFields': window},
+                       {'$match': {'$expr': {'$in': ['$_rank', [rank('$_count', q) for q in quantiles]]}}},
+                       {'$group': {'_id': group_id,
+                                   'count': {'$first': '$_count'},
+                                   'mean': {'$first': '$_mean'},
+                                   'points': {'$push': {'rank': '$_rank', 'value': {'$ifNull': [value, None]}}}}}]
+            fields = {self._quantile_field(q): {'$getField': {'field': 'value', 'input': {'$first': {'$filter': {
+                          'input': '$points', 'cond': {'$eq': ['$$this.rank', rank('$count', q)]}}}}}}
+                      for q in quantiles}
+
+        else:
+            stages += [{'$sort': {variable: ASCENDING}},
+                       {'$group': {'_id': group_id,
+                                   'count': {'$sum': 1},
+                                   'mean': {'$avg': value},
+                                   'values': {'$push': {'$ifNull': [value, None]}}}}]
+            fields = {self._quantile_field(q): {'$arrayElemAt': ['$values', {'$ceil': {'$multiply': [{'$subtract': ['$count', 1]}, q]}}]}
+                      for q in quantiles}
+
+        stages.append({'$project': dict({'_id': 1, 'count': 1, 'mean': 1}, **fields)})
+
+        return stages
+
+    def get_stats_many(self, collection, filter_groups, variables, group_by=None, quantiles=(0.5,), method='exact',
+                       skip_nulls=True):
+        """
+        Count, mean and quantiles of several variables, for several filters, in one aggregation request.
+
+        Every (filter group, variable) pair is a branch of one $facet stage, so the whole calculation takes one
+        round trip. The filters are applied before the $facet stage too, so the documents are selected with the
+        indexes of the collection. The exact method ranks the sorted values with $setWindowFields on MongoDB 5.0+,
+        and collects the values of every group into an array on older servers (see _stats_pipeline for its size
+        limit). The approximate method uses $percentile, it falls back to the exact method on servers older than
+        MongoDB 7.0.
+
         Args:
-            filters (dict): filters to apply before median calculation
-            output_var (str): name of the variable to count the median
+            collection (str): collection name
+            filter_groups (dict): name of the filter group -> filter (dict)
+            variables (list): names of the variables
+            group_by (list): group keys, statistics are calculated by their unique values
+            quantiles (tuple): quantiles between 0 and 1
+            method (str): exact or approximate
+            skip_nulls (bool): Skip the documents where the variable is null or missing. If False, they are counted,
+                and sorted before every value, like in a find().sort() on the variable.
+
         Returns:
-            : median values
+            pandas.DataFrame: filter_group, group keys, variable, count, mean and one column per quantile (q50 for 0.5)
         """
 
         #Establish connection
@@ -288,18 +699,102 @@ class MongoManager(Pipe):
         #Connect to db
         db = self.client[self.db]
 
+        version = self.server_version or (0, 0)
+        if method == 'approximate' and version < (7, 0):
+            self.logger.warning(f'$percentile is not supported by MongoDB {self.server_version}, exact quantiles are calculated')
+            method = 'exact'
+        if method == 'exact':
+            method = 'window' if version >= (5, 0) else 'push'
+
+        # A single filter is applied before the $facet stage only. With several filters, the documents matching
+        # none of them are dropped before the $facet stage, and every branch applies its own filter.
+        group_by = list(group_by or [])
+        shared = len(filter_groups) == 1
+        filters = [f for f in filter_groups.values() if f]
+        pipeline = []
+        if shared and filters:
+            pipeline.append({'$match': filters[0]})
+        elif filters and len(filters) == len(filter_groups):
+            pipeline.append({'$match': {'$or': filters}})
+
+        branches = {}
+        for i, (group_name, filters) in enumerate(filter_groups.items()):
+            for j, variable in enumerate(variables):
+                branches[f'f{i}_v{j}'] = (group_name, variable,
+                                          self._stats_pipeline(variable, None if shared else filters, group_by,
+                                                               quantiles, method, skip_nulls))
+
+        pipeline.append({'$facet': {key: branch[2] for key, branch in branches.items()}})
+
         try:
-            cursor = db[collection]
+            result = next(db[collection].aggregate(pipeline, allowDiskUse=True))
+
+        except OperationFailure as e:
+            if method != 'approximate':
+                raise
+            self.logger.warning(f'Approximate quantile calculation failed: {e}, exact quantiles are calculated')
+            return self.get_stats_many(collection, filter_groups, variables, group_by, quantiles, method='exact',
+                                       skip_nulls=skip_nulls)
+
+        rows = []
+        for key, (group_name, variable, _) in branches.items():
+            for doc in result[key]:
+                row = {'filter_group': group_name}
+                row.update(doc['_id'] or {})
+                row['variable'] = variable
+                row.update({k: v for k, v in doc.items() if k != '_id'})
+                rows.append(row)
+
+        columns = ['filter_group'] + group_by + ['variable', 'count', 'mean'] + [self._quantile_field(q) for q in quantiles]
+        self.logger.info(f'Statistics of {variables} are calculated for {len(filter_groups)} filter groups in [COLLECTION]: {collection}')
+
+        return pd.DataFrame(rows, columns=columns)
+
+    def get_stats(self, collection, variables, filters=None, group_by=None, quantiles=(0.5,), method='exact',
+                  skip_nulls=True):
+        """
+        Count, mean and quantiles of several variables in one aggregation request. See get_stats_many.
+
+        Args:
+            collection (str): collection name
+            variables (list): names of the variables
+            filters (dict): filter to apply before the calculation
+            group_by (list): group keys, statistics are calculated by their unique values
+            quantiles (tuple): quantiles between 0 and 1
+            method (str): exact or approximate
+            skip_nulls (bool): Skip the documents where the variable is null or missing
+
+        Returns:
+            pandas.DataFrame: group keys, variable, count, mean and one column per quantile (q50 for 0.5)
+        """
+
+        stats = self.get_stats_many(collection, {'all': filters or {}}, variables, group_by, quantiles, method,
+                                    skip_nulls)
+
+        return stats.drop(columns='filter_group')
+
+    def get_median(self, collection, filters, output_var):
+        """
+        Returns the median vlaue of a variable.
+
+        The median is the middle element of the sorted values (the upper one for even number of values),
+        calculated with one aggregation request (see get_stats). Documents where the variable is null or missing
+        are counted and sorted first, like in a find().sort() on the variable.
+
+        Args:
+            filters (dict): filters to apply before median calculation
+            output_var (str): name of the variable to count the median
+        Returns:
+            : median values
+        """
 
-            cnt = cursor.count_documents(filters)
-            med = cursor.find(filters).sort([(output_var, ASCENDING)])
-            med = med.skip(int(np.floor(cnt / 2))).limit(1)
-            med = pd.DataFrame(list(med))
-            out = med[output_var].values[0]
+        try:
+            stats = self.get_stats(collection, [output_var], filters=filters, quantiles=(0.5,), skip_nulls=False)
+            out = stats['q50'].values[0]
             if isinstance(out, dict):
                 out = float([*out.values()][0])
 
-        except KeyError as e:
+        except (KeyError, IndexError) as e:
             self.logger.error(f'MongoDB median calculation failed: {e}')
             return None
 
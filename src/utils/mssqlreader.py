@@ -1,30 +1,203 @@
 from nkmfraud.core.pipe import Pipe
-from sqlalchemy import create_engine
+from nkmfraud.core.chunking import iter_query, harmonise_dtypes
+from nkmfraud.core.engines import get_engine
+from nkmfraud.core import dtypes as dtype_utils
+from nkmfraud.core import profiling
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from sqlalchemy import text
+import numpy as np
 import pandas as pd
+import decimal
+import numbers
 
 
 class MSSQLReader(Pipe):
     """Pipe to read and MSSQL table to a pandas.DataFrame"""
 
     @Pipe.timeit
-    def run(self, ip, db, table):
+    @Pipe.cached
+    def run(self, ip, db, table, columns=None, where=None, params=None, partition_col=None, n_partitions=1, dtypes=None):
         """The Pipe uses Windows Authentication to connect to MSSQL server. Log in to VPN if it's required.
 
         Args:
             ip (str): The IP address of the MSSQL server (Test server: 10.10.10.140\SQL2017).
             db (str): Name of the database (Test db: NKM_fraud).
             table (str): SQL table to read.
+            columns (list): Columns to be read. Default None reads every column.
+            where (str): Filter condition executed by the server, parameters can be bound with :name
+            params (dict): Bound parameters of the where condition
+            partition_col (str): Numeric or date column (preferably indexed) used to split the table into
+                n_partitions ranges, which are read over separate pooled connections at the same time
+            n_partitions (int): Number of ranges read in parallel, if partition_col is given
+            dtypes: Dtype optimisation of the result (see dtypes.read_sql_kwargs): None (off), 'auto', a schema dict,
+                or the path of a schema file, created at the first load and applied while parsing at the later loads
+            cache_token: Freshness token of the cached result, used only if the Pipe has a cache (see Pipe.cached)
 
         Returns:
             pandas.DataFrame
+
+        Examples:
+            df = MSSQLReader('mssql_reader', 'loaders').run(ip, db, 'claims', columns=['CLAIM_ID', 'AMOUNT'],
+                                                            where='CLAIM_DATE >= :since', params={'since': '2019-01-01'},
+                                                            partition_col='CLAIM_ID', n_partitions=8)
         """
 
+        if partition_col is not None and n_partitions > 1:
+            partitions = list(self.iter_partitions(ip, db, table, partition_col, n_partitions, columns, where, params))
+            table_df = dtype_utils.finalise(harmonise_dtypes(partitions), dtypes, self.logger)
+            self.logger.info('pandas.DataFrame is read from {}/{}.{} in {} partitions with shape: {}'.format(
+                ip, db, table, len(partitions), table_df.shape))
+
+            return table_df
+
         # Create engine and connect to database
-        engine = create_engine('mssql+turbodbc://{}/{}?driver=SQL+Server+Native+Client+11.0'.format(ip, db))
+        engine = self._create_engine(ip, db)
 
-        # Read the defined table and dispose the engine
-        table_df = pd.read_sql_table(table_name=table, con=engine)
-        engine.dispose()
+        # Read the defined table, the engine is kept for the next reads
+        if columns is None and where is None and dtypes is None:
+            table_df = pd.read_sql_table(table_name=table, con=engine)
+        else:
+            query = self._select(table, columns, [where] if where else [])
+            self.logger.info('Executing query: {}'.format(query))
+            table_df = pd.read_sql(text(query), con=engine, params=params or {}, **dtype_utils.read_sql_kwargs(dtypes))
+            table_df = dtype_utils.finalise(table_df, dtypes, self.logger)
+        profiling.record_frame(table_df)
         self.logger.info('pandas.DataFrame is read from {}/{}.{}'.format(ip, db, table))
 
         return table_df
+
+    @staticmethod
+    def _create_engine(ip, db, pool_size=None):
+
+        url = 'mssql+turbodbc://{}/{}?driver=SQL+Server+Native+Client+11.0'.format(ip, db)
+        if pool_size is None:
+            return get_engine(url)
+
+        return get_engine(url, pool_size=pool_size)
+
+    @staticmethod
+    def _select(table, columns=None, conditions=()):
+
+        query = 'SELECT {} FROM {}'.format(', '.join(columns) if columns else '*', table)
+        conditions = [condition for condition in conditions if condition]
+        if conditions:
+            query += ' WHERE ' + ' AND '.join('({})'.format(condition) for condition in conditions)
+
+        return query
+
+    @staticmethod
+    def _partition_bounds(partition_col, lo, hi, n_partitions):
+        """Inner bounds splitting [lo, hi] into n_partitions ranges.
+
+        Only the inner bounds are returned: the first range has no lower, the last one has no upper bound, so no row is
+        lost if a bound is rounded. Integral DECIMAL values are split as integers, other DECIMAL bounds are Decimal.
+
+        Returns:
+            list
+        """
+
+        if hasattr(lo, 'year') or isinstance(lo, np.datetime64):
+            bounds = [ts.to_pydatetime() for ts in pd.date_range(pd.Timestamp(lo), pd.Timestamp(hi),
+                                                                 periods=n_partitions + 1)]
+            return sorted(set(bounds[1:-1]))
+
+        for value in (lo, hi):
+            if not isinstance(value, numbers.Number) or isinstance(value, bool):
+                raise ValueError(f'Partition column {partition_col} must be numeric or datetime, '
+                                 f'got {type(value).__name__}')
+
+        is_decimal = isinstance(lo, decimal.Decimal) or isinstance(hi, decimal.Decimal)
+        if is_decimal and all(value == value.to_integral_value() for value in map(decimal.Decimal, (lo, hi))):
+            lo, hi, is_decimal = int(lo), int(hi), False
+
+        if isinstance(lo, (int, np.integer)) and isinstance(hi, (int, np.integer)):
+            bounds = np.unique(np.linspace(int(lo), int(hi), n_partitions + 1).round().astype(np.int64)).tolist()
+        else:
+            bounds = np.unique(np.linspace(float(lo), float(hi), n_partitions + 1)).tolist()
+            if is_decimal:
+                bounds = [decimal.Decimal(str(bound)) for bound in bounds]
+
+        return bounds[1:-1]
+
+    def iter_partitions(self, ip, db, table, partition_col, n_partitions=4, columns=None, where=None, params=None,
+                        dtype=None):
+        """Read a table in n_partitions ranges of partition_col in parallel, and yield the partitions as they finish.
+
+        The [MIN, MAX] range of partition_col (within the where filter) is split into equal ranges, and the rows where
+        partition_col is NULL are read as an extra partition. The first and the last ranges are open ended, so rows
+        at MIN and MAX are read even if the bounds are rounded. See run() for the rest of the arguments.
+
+        Args:
+            dtype (dict): Column -> dtype applied to every partition, so the streamed partitions have consistent
+                dtypes (e.g. float for integer columns with NULLs). run() harmonises the dtypes after the read instead.
+
+        Yields:
+            pandas.DataFrame
+        """
+
+        engine = self._create_engine(ip, db, pool_size=n_partitions + 1)
+        params = dict(params or {})
+
+        query = 'SELECT MIN({0}) AS lo, MAX({0}) AS hi FROM {1}'.format(partition_col, table)
+        if where:
+            query += ' WHERE ({})'.format(where)
+        self.logger.info('Executing query: {}'.format(query))
+        lo, hi = pd.read_sql(text(query), con=engine, params=params).values[0]
+
+        ranges = []
+        if not pd.isnull(lo):
+            bounds = self._partition_bounds(partition_col, lo, hi, n_partitions)
+            if bounds:
+                # Every range excludes its lower bound, the first one has no lower, the last one no upper bound
+                ranges = [('{} <= :upper'.format(partition_col), None, bounds[0])]
+                ranges += [('{0} > :lower AND {0} <= :upper'.format(partition_col), bounds[i], bounds[i + 1])
+                           for i in range(len(bounds) - 1)]
+                ranges.append(('{} > :lower'.format(partition_col), bounds[-1], None))
+            else:
+                ranges = [('{} IS NOT NULL'.format(partition_col), None, None)]
+        ranges.append(('{} IS NULL'.format(partition_col), None, None))
+
+        self.logger.warning('{} is read in {} partitions of {}'.format(table, len(ranges), partition_col))
+
+        def read(condition, lower, upper):
+            query = self._select(table, columns, [where, condition])
+            bound = dict(params)
+            bound.update({name: value for name, value in (('lower', lower), ('upper', upper)) if value is not None})
+            partition = pd.read_sql(text(query), con=engine, params=bound)
+            return partition.astype(dtype) if dtype else partition
+
+        with ThreadPoolExecutor(max_workers=n_partitions, thread_name_prefix='mssql_partition') as executor:
+            futures = {executor.submit(read, *r): r for r in ranges}
+            try:
+                for future in as_completed(futures):
+                    partition = future.result()
+                    profiling.record_frame(partition)
+                    self.logger.debug('Partition {} of {} is read with shape: {}'.format(futures[future][1:], table,
+                                                                                       partition.shape))
+                    yield partition
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    def iter_chunks(self, ip, db, table, chunksize=100000, max_bytes=None, columns=None, where=None, params=None):
+        """Read an MSSQL table in chunks with bounded memory. See run() for the connection arguments.
+
+        Args:
+            chunksize (int): Number of rows in one chunk (upper limit, if max_bytes is given)
+            max_bytes (int): Memory budget of one chunk in bytes
+            columns (list): Columns to be read. Default None reads every column.
+            where (str): Filter condition executed by the server, parameters can be bound with :name
+            params (dict): Bound parameters of the where condition
+
+        Yields:
+            pandas.DataFrame
+        """
+
+        engine = self._create_engine(ip, db)
+
+        query = self._select(table, columns, [where] if where else [])
+        self.logger.info('Executing query: {} in chunks'.format(query))
+        for chunk in iter_query(engine, query, params=params, chunksize=chunksize, max_bytes=max_bytes):
+            self.logger.debug('Chunk is read from {}/{}.{} with shape: {}'.format(ip, db, table, chunk.shape))
+            profiling.record_frame(chunk)
+            yield chunk
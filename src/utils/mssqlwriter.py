@@ -2,19 +2,91 @@ import sys
 sys.path.append('...')
 
 from nkmfraud.core.pipe import Pipe
-from sqlalchemy import create_engine
+from nkmfraud.core.engines import get_engine
+from nkmfraud.core import profiling
+from sqlalchemy import inspect
+from sqlalchemy.dialects import mssql
+from sqlalchemy.types import String
 import pandas as pd
 import numpy as np
+import time
+import uuid
+
+
+# Number of rows sent in one fast_executemany batch
+BATCH_SIZE = 50000
+
+# Lengths of the NVARCHAR columns, the shortest one which fits the longest value is used, NVARCHAR(max) above them.
+# Columns of existing tables are widened if a later load has longer values (see MSSQLWriter._widen_strings).
+NVARCHAR_LENGTHS = (50, 255, 4000)
+
+# MSSQL type of every integer type: TINYINT is unsigned, so int8 needs SMALLINT, and unsigned types need the next
+# wider signed type. uint64 does not fit into BIGINT.
+INTEGER_TYPES = {'int8': mssql.SMALLINT, 'int16': mssql.SMALLINT, 'int32': mssql.INTEGER, 'int64': mssql.BIGINT,
+                 'uint8': mssql.SMALLINT, 'uint16': mssql.INTEGER, 'uint32': mssql.BIGINT,
+                 'uint64': lambda: mssql.DECIMAL(20, 0)}
+
+
+def nvarchar_length(series):
+    """Length of the NVARCHAR column of the string values of a Series, None means NVARCHAR(max)"""
+
+    lengths = series.dropna().astype(str).str.len()
+    longest = int(lengths.max()) if len(lengths) else 0
+
+    return next((n for n in NVARCHAR_LENGTHS if longest <= n), None)
+
+
+def sql_dtypes(df, dtype=None):
+    """Explicit MSSQL column types of a DataFrame, instead of the NVARCHAR(max) / FLOAT defaults of to_sql.
+
+    Args:
+        df (pandas.DataFrame): DataFrame to be written
+        dtype (dict): Column -> sqlalchemy type, overrides the derived types
+
+    Returns:
+        dict: column -> sqlalchemy type
+    """
+
+    types = {}
+    for col, col_dtype in df.dtypes.items():
+        if isinstance(col_dtype, pd.DatetimeTZDtype):
+            types[col] = mssql.DATETIMEOFFSET()
+        elif col_dtype.kind == 'M':
+            types[col] = mssql.DATETIME2()
+        elif col_dtype.kind == 'b':
+            types[col] = mssql.BIT()
+        elif col_dtype.kind in 'iu':
+            # Nullable extension types (Int64, UInt8, ...) are looked up by their numpy type
+            types[col] = INTEGER_TYPES[getattr(col_dtype, 'numpy_dtype', col_dtype).name]()
+        elif col_dtype.kind == 'f':
+            types[col] = mssql.FLOAT(53)
+        else:
+            types[col] = mssql.NVARCHAR(nvarchar_length(df[col]))
+
+    types.update(dtype or {})
+
+    return types
 
 
 class MSSQLWriter(Pipe):
-    """Write pandas.DataFrame to an MSSQL table"""
+    """Write pandas.DataFrame to an MSSQL table
+
+    Rows are sent with pyodbc fast_executemany in batches of batch_size rows, and tables are created with explicit
+    column types (see sql_dtypes). NVARCHAR columns of existing tables are widened if the DataFrame has longer strings.
+
+    Modes:
+        replace: The data is loaded into a staging table, then the target table is emptied and filled from the staging
+            table in one transaction, so its column types, indexes and permissions are kept, and readers never see a
+            half loaded table. A missing target table is created.
+        append: The data is inserted into the target table (created if missing).
+        merge: The data is loaded into a staging table, and merged into the target by key_cols: existing rows are
+            updated, new rows are inserted.
+    """
 
     @Pipe.timeit
-    def run(self, ip, db, table, df):
+    def run(self, ip, db, table, df, mode='replace', key_cols=None, dtype=None, batch_size=BATCH_SIZE):
         """The Pipe uses Windows Authentication to connect to MSSQL server. Log in to VPN if it's required.
 
-        If the a table with the same name (table argument) already exists, it will be overwritten.
         The index of the DataFrame is not written.
 
         Args:
@@ -22,16 +94,104 @@ class MSSQLWriter(Pipe):
             db (str): Name of the database (Test db: NKM_fraud).
             table (str): Name of the table where the DataFrame will be written.
             df (pandas.DataFrame): DataFrame to be written to MSSQL
+            mode (str): replace, append or merge
+            key_cols (list): Key columns of the merge mode
+            dtype (dict): Column -> sqlalchemy type, overrides the derived types of the new tables
+            batch_size (int): Number of rows sent in one batch
+
+        Returns:
+            dict: rows, seconds, rows_per_second
 
         """
 
-        # Create engine and connect to database
-        engine = create_engine('mssql+turbodbc://{}/{}?driver=SQL+Server+Native+Client+11.0'.format(ip, db))
+        if mode not in ('replace', 'append', 'merge'):
+            raise ValueError(f'Unknown write mode: {mode}. Use replace, append or merge.')
+        if mode == 'merge' and not key_cols:
+            raise ValueError('key_cols are required in merge mode')
+
+        ts = time.perf_counter()
+
+        #Create engine and connect to database. fast_executemany is set by the dialect, so no event listener
+        #is registered again on the shared engine at every run
+        engine = get_engine('mssql+pyodbc://{}/{}?driver=SQL+Server+Native+Client+11.0'.format(ip, db), fast_executemany=True)
 
         # Replace - and + inf with np.nan
         df = df.replace([np.inf, -np.inf], np.nan)
+        types = sql_dtypes(df, dtype)
+
+        if mode == 'append':
+            with engine.begin() as conn:
+                self._widen_strings(conn, table, df)
+                df.to_sql(name=table, con=conn, if_exists='append', index=False, dtype=types, chunksize=batch_size)
+        else:
+            self._write_staged(engine, table, df, types, mode, key_cols, batch_size)
+
+        seconds = time.perf_counter() - ts
+        report = {'rows': len(df), 'seconds': seconds, 'rows_per_second': len(df) / seconds if seconds else None}
+        profiling.record(rows_out=len(df))
+        self.logger.info('pandas.DataFrame is written to {}/{}.{} in {} mode: {} rows in {:.1f} s ({:.0f} rows/s)'.format(
+            ip, db, table, mode, len(df), seconds, report['rows_per_second'] or 0))
+
+        return report
+
+    def _widen_strings(self, conn, table, df):
+        """Widen the NVARCHAR columns of an existing table which are shorter than the strings of df"""
+
+        if not conn.dialect.has_table(conn, table):
+            return
+
+        quote = conn.dialect.identifier_preparer.quote
+        columns = {column['name']: column for column in inspect(conn).get_columns(table)}
+        for col in df.columns:
+            column = columns.get(col)
+            if column is None or df[col].dtype.kind != 'O' or not isinstance(column['type'], String) or \
+                    column['type'].length is None:
+                continue
+
+            length = nvarchar_length(df[col])
+            if length is not None and length <= column['type'].length:
+                continue
+
+            conn.execute('ALTER TABLE {} ALTER COLUMN {} NVARCHAR({}) {}'.format(
+                quote(table), quote(col), length or 'MAX', 'NULL' if column['nullable'] else 'NOT NULL'))
+            self.logger.warning('Column {}.{} is widened from NVARCHAR({}) to NVARCHAR({})'.format(
+                table, col, column['type'].length, length or 'MAX'))
+
+    def _write_staged(self, engine, table, df, types, mode, key_cols, batch_size):
+        """Load df into a staging table, then replace or merge the target table from it in one transaction"""
+
+        # Unique name, so concurrent writes of the same table do not share the staging table
+        staging = '{}_staging_{}'.format(table, uuid.uuid4().hex[:8])
+        try:
+            df.to_sql(name=staging, con=engine, if_exists='fail', index=False, dtype=types, chunksize=batch_size)
+
+            with engine.begin() as conn:
+                self._merge_staged(conn, table, staging, df, mode, key_cols)
+        finally:
+            with engine.begin() as conn:
+                conn.execute('DROP TABLE IF EXISTS {}'.format(conn.dialect.identifier_preparer.quote(staging)))
+
+    def _merge_staged(self, conn, table, staging, df, mode, key_cols):
+        """Replace or merge the target table from the staging table, in the transaction of conn"""
+
+        quote = conn.dialect.identifier_preparer.quote
+        target, source = quote(table), quote(staging)
+        columns = ', '.join(quote(col) for col in df.columns)
+
+        if not conn.dialect.has_table(conn, table):
+            conn.execute("EXEC sp_rename '{}', '{}'".format(staging, table))
+            self.logger.info('Table {} is created from the staging table'.format(table))
+            return
+
+        self._widen_strings(conn, table, df)
 
-        # Write table to SQL and dispose the engine
-        df.to_sql(name=table, con=engine, if_exists='replace', index=False)
-        engine.dispose()
-        self.logger.info('pandas.DataFrame is written to {}/{}.{}'.format(ip, db, table))
+        if mode == 'replace':
+            conn.execute('TRUNCATE TABLE {}'.format(target))
+            conn.execute('INSERT INTO {0} WITH (TABLOCK) ({1}) SELECT {1} FROM {2}'.format(target, columns, source))
+        else:
+            match = ' AND '.join('t.{0} = s.{0}'.format(quote(col)) for col in key_cols)
+            updates = ', '.join('t.{0} = s.{0}'.format(quote(col)) for col in df.columns if col not in key_cols)
+            values = ', '.join('s.{}'.format(quote(col)) for col in df.columns)
+            conn.execute('MERGE {0} WITH (HOLDLOCK) AS t USING {1} AS s ON {2} '.format(target, source, match) +
+                         ('WHEN MATCHED THEN UPDATE SET {} '.format(updates) if updates else '') +
+                         'WHEN NOT MATCHED BY TARGET THEN INSERT ({}) VALUES ({});'.format(columns, values))
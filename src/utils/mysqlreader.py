@@ -1,8 +1,16 @@
 from nkmfraud.core.pipe import Pipe
-from sqlalchemy import create_engine
+from nkmfraud.core.chunking import iter_query, rows_for_budget
+from nkmfraud.core.engines import get_engine
+from nkmfraud.core import dtypes as dtype_utils
+from nkmfraud.core import profiling
+from sqlalchemy import text
 import pandas as pd
 from pdb import set_trace
 import numpy as np
+import decimal
+import numbers
+import queue
+import threading
 
 class MySQLReader(Pipe):
     """Load MySQL table as a pandas.DataFrame.
@@ -16,42 +24,72 @@ class MySQLReader(Pipe):
         password(str): User password
         rowlim (int): Number of rows to be read from the table.
         chunksize (int): Number of rows to be read in one chunk. Full table (with rowlim) is read if chunksize is None
+        key (str): Indexed, unique column (e.g. the primary key) used for keyset pagination. If it is given, chunks
+            are read with WHERE key > last_key ORDER BY key LIMIT chunksize instead of LIMIT offset scans.
+        n_workers (int): Number of parallel connections in keyset mode. The key range is split into n_workers parts,
+            so the key must be numeric if n_workers > 1.
+        where (str): Filter condition executed by the server, parameters can be bound with :name
+            (e.g. 'updated_at > :watermark' for incremental loads)
+        params (dict): Bound parameters of the where condition
+        dtypes: Dtype optimisation of the result (see dtypes.read_sql_kwargs): None (off), 'auto', a schema dict,
+            or the path of a schema file, created at the first load and applied while parsing at the later loads
+        cache_token: Freshness token of the cached result, used only if the Pipe has a cache (see Pipe.cached)
 
     Returns:
         pandas.DataFrame
 
     """
     @Pipe.timeit
-    def run(self, ip, port, db, table, user, password, rowlim=None, chunksize=None):
+    @Pipe.cached
+    def run(self, ip, port, db, table, user, password, rowlim=None, chunksize=None, key=None, n_workers=1, where=None,
+            params=None, dtypes=None):
+
+        # Keyset pagination
+        if key is not None:
+            chunks = list(self.iter_chunks(ip, port, db, table, user, password, key,
+                                           chunksize=chunksize or 100000, n_workers=n_workers, rowlim=rowlim,
+                                           where=where, params=params))
+            if chunks:
+                table_df = pd.concat(chunks, axis=0, ignore_index=True)
+            else:
+                # No matching rows, return an empty DataFrame with the columns of the table
+                query = 'SELECT * FROM {}.{} LIMIT 0'.format(db, table)
+                self.logger.info('Executing query: {}'.format(query))
+                table_df = pd.read_sql(text(query), con=self._create_engine(ip, port, user, password))
+            table_df = dtype_utils.finalise(table_df, dtypes, self.logger)
+            self.logger.info('Memory usage of the loaded DataFrame: {}'.format(table_df.memory_usage(index=True).sum()))
+
+            return table_df
 
         # Create engine and connect to database
         self.logger.info('Connecting to {}:{}'.format(ip,port))
-        # conn_string = 'mysql+mysqlconnector://{}:{}@{}:{}/?auth_plugin=mysql_native_password'.format(user, password, ip, port)
-        conn_string = 'mysql+mysqldb://{}:{}@{}:{}'.format(user, password, ip, port)
-        engine = create_engine(conn_string)
+        engine = self._create_engine(ip, port, user, password)
 
         #To shut down process on failure
         failed_load = False
 
+        condition = ' WHERE {}'.format(where) if where else ''
+        params = params or {}
+
         try:
             #Read in chunks         
             if chunksize is not None:
                 
                 #Get row numbers
-                query = 'SELECT count(*) FROM {}.{}'.format(db, table)
+                query = 'SELECT count(*) FROM {}.{}{}'.format(db, table, condition)
                 self.logger.info('Executing query: {}'.format(query))
                 if rowlim is None:
-                    rowlim = pd.read_sql(query, con=engine).values[0][0]
+                    rowlim = pd.read_sql(text(query), con=engine, params=params).values[0][0]
                 self.logger.warning('{} is read in chunks with size {}. Number of total rows: {}'.format(table, chunksize, rowlim))
 
                 df_cont = []
                 for startindex in np.arange(0, rowlim, chunksize):
-                    query = 'SELECT * FROM {}.{} LIMIT {},{};'.format(db, table, startindex, chunksize)
+                    query = 'SELECT * FROM {}.{}{} LIMIT {},{};'.format(db, table, condition, startindex, chunksize)
                     self.logger.info('Executing query: {}'.format(query))
                     # with engine.connect() as con:
                     #     res = con.execute(query)
                     #     table_df = pd.DataFrame(res.fetchall(), columns=res.keys())
-                    table_df = pd.concat(pd.read_sql(query, con=engine, chunksize=100000))
+                    table_df = pd.read_sql(text(query), con=engine, params=params)
                     self.logger.info('Memory usage of the loaded DataFrame: {}'.format(table_df.memory_usage(index=True).sum()))
                     df_cont.append(table_df)
 
@@ -60,22 +98,201 @@ class MySQLReader(Pipe):
             #Read whole table
             else:
                 if rowlim:
-                    query = 'SELECT * FROM {}.{} LIMIT {}'.format(db,table, rowlim)
+                    query = 'SELECT * FROM {}.{}{} LIMIT {}'.format(db,table, condition, rowlim)
                 else:
-                    query = 'SELECT * FROM {}.{}'.format(db,table)
+                    query = 'SELECT * FROM {}.{}{}'.format(db,table, condition)
                 
                 self.logger.info('Executing query: {}'.format(query))
-                table_df = pd.concat(pd.read_sql(query, con=engine, chunksize=100000))
-                self.logger.info('Memory usage of the loaded DataFrame: {}'.format(table_df.memory_usage(index=True).sum()))
+                table_df = pd.read_sql(text(query), con=engine, params=params, **dtype_utils.read_sql_kwargs(dtypes))
+
+            profiling.record_frame(table_df)
+            table_df = dtype_utils.finalise(table_df, dtypes, self.logger)
+            self.logger.info('Memory usage of the loaded DataFrame: {}'.format(table_df.memory_usage(index=True).sum()))
 
         except:
             self.logger.exception('Table reading failed')
             failed_load=True
 
-        finally:
-            engine.dispose()
-
         if failed_load:
             raise Exception('Reading from table {} failed'.format(table))
 
         return table_df
+
+    @staticmethod
+    def _create_engine(ip, port, user, password, pool_size=None):
+        """Return the shared engine of the server (see engines.get_engine)"""
+
+        # conn_string = 'mysql+mysqlconnector://{}:{}@{}:{}/?auth_plugin=mysql_native_password'.format(user, password, ip, port)
+        conn_string = 'mysql+mysqldb://{}:{}@{}:{}'.format(user, password, ip, port)
+
+        if pool_size is None:
+            return get_engine(conn_string)
+
+        return get_engine(conn_string, pool_size=pool_size)
+
+    def iter_chunks(self, ip, port, db, table, user, password, key=None, chunksize=100000, n_workers=1, rowlim=None,
+                    max_bytes=None, where=None, params=None):
+        """Read the table in chunks, and yield the chunks as they arrive, so only a bounded working set is in memory.
+
+        If key is None, the table is streamed with one server-side cursor. Otherwise every chunk is read with an index range scan (WHERE key > last_key ORDER BY key LIMIT chunksize), so the
+        cost of a full table read is linear in the number of rows. If n_workers > 1, the [MIN(key), MAX(key)] range
+        is split into n_workers parts, which are read over separate connections at the same time. In this case
+        the chunks are yielded in the order of arrival, not in key order.
+
+        Args:
+            key (str): Indexed, unique column used for keyset pagination (numeric if n_workers > 1)
+            chunksize (int): Number of rows in one chunk (upper limit, if max_bytes is given)
+            n_workers (int): Number of parallel connections in keyset mode
+            rowlim (int): Maximum number of rows to be read
+            max_bytes (int): Memory budget of one chunk in bytes
+            where (str): Filter condition executed by the server, parameters can be bound with :name
+            params (dict): Bound parameters of the where condition
+
+            See the class docstring for the rest of the arguments.
+
+        Yields:
+            pandas.DataFrame
+        """
+
+        self.logger.info('Connecting to {}:{}'.format(ip, port))
+        engine = self._create_engine(ip, port, user, password, pool_size=n_workers if n_workers > 1 else None)
+
+        if key is None:
+            query = 'SELECT * FROM {}.{}'.format(db, table) + (' WHERE {}'.format(where) if where else '') + \
+                    (' LIMIT {}'.format(int(rowlim)) if rowlim else '')
+            self.logger.info('Executing query: {} in chunks'.format(query))
+            chunks = iter_query(engine, query, params=params, chunksize=chunksize, max_bytes=max_bytes)
+        elif n_workers > 1:
+            chunks = self._iter_parallel(engine, db, table, key, chunksize, n_workers, max_bytes, where, params)
+        else:
+            chunks = self._iter_key_range(engine, db, table, key, chunksize, max_bytes=max_bytes, where=where,
+                                          params=params)
+
+        try:
+            rownum = 0
+            for chunk in chunks:
+                if rowlim is not None and rownum + len(chunk) >= rowlim:
+                    yield chunk.iloc[:rowlim - rownum]
+                    break
+                rownum += len(chunk)
+                profiling.record_frame(chunk)
+                yield chunk
+
+        finally:
+            chunks.close()
+
+    def _iter_key_range(self, engine, db, table, key, chunksize, lower=None, lower_inclusive=True, upper=None, stop=None,
+                        max_bytes=None, where=None, params=None):
+        """Keyset pagination over (lower, upper]. Range is not limited if the bounds are None."""
+
+        rows_per_chunk = chunksize if max_bytes is None else min(100, chunksize)
+        where_params = params or {}
+        last = None
+        while stop is None or not stop.is_set():
+
+            conditions = ['({})'.format(where)] if where else []
+            params = dict(where_params, chunksize=int(rows_per_chunk))
+            if last is not None:
+                conditions.append('{} > :last'.format(key))
+                params['last'] = last
+            elif lower is not None:
+                conditions.append('{} {} :lower'.format(key, '>=' if lower_inclusive else '>'))
+                params['lower'] = lower
+            if upper is not None:
+                conditions.append('{} <= :upper'.format(key))
+                params['upper'] = upper
+
+            clause = 'WHERE {} '.format(' AND '.join(conditions)) if conditions else ''
+            query = 'SELECT * FROM {}.{} {}ORDER BY {} LIMIT :chunksize'.format(db, table, clause, key)
+            self.logger.debug('Executing query: {} with {}'.format(query, params))
+
+            chunk = pd.read_sql(text(query), con=engine, params=params)
+            if chunk.empty:
+                break
+
+            yield chunk
+
+            if len(chunk) < rows_per_chunk:
+                break
+            if max_bytes is not None:
+                rows_per_chunk = rows_for_budget(chunk, max_bytes, chunksize)
+            last = chunk[key].iloc[-1]
+            # Convert numpy scalars to python types for the DB API
+            if isinstance(last, np.generic):
+                last = last.item()
+
+    @staticmethod
+    def _numeric_bounds(key, lo, hi):
+        """MIN and MAX of the key as numbers np.linspace can split. DECIMAL keys are converted to int."""
+
+        for value in (lo, hi):
+            if not isinstance(value, numbers.Number) or isinstance(value, bool):
+                raise ValueError(f'Key {key} must be numeric to be read with n_workers > 1, got {type(value).__name__}')
+            if isinstance(value, decimal.Decimal) and value != value.to_integral_value():
+                raise ValueError(f'Key {key} must be integral to be read with n_workers > 1, got {value}')
+
+        if isinstance(lo, decimal.Decimal) or isinstance(hi, decimal.Decimal):
+            return int(lo), int(hi)
+
+        return lo, hi
+
+    def _iter_parallel(self, engine, db, table, key, chunksize, n_workers, max_bytes=None, where=None, params=None):
+        """Split the key range into n_workers parts and read them in parallel threads"""
+
+        query = 'SELECT MIN({0}), MAX({0}) FROM {1}.{2}'.format(key, db, table) + (' WHERE {}'.format(where) if where else '')
+        self.logger.info('Executing query: {}'.format(query))
+        lo, hi = pd.read_sql(text(query), con=engine, params=params or {}).values[0]
+        if lo is None or pd.isnull(lo):
+            return
+        lo, hi = self._numeric_bounds(key, lo, hi)
+
+        bounds = np.linspace(lo, hi, n_workers + 1)
+        if np.issubdtype(np.asarray([lo, hi]).dtype, np.integer):
+            bounds = np.unique(np.round(bounds).astype(np.int64))
+        bounds = [b.item() for b in bounds]
+
+        # (lower, lower_inclusive, upper) per worker, the first range includes MIN(key)
+        ranges = [(bounds[0], True, bounds[1] if len(bounds) > 1 else bounds[0])]
+        ranges += [(bounds[i], False, bounds[i + 1]) for i in range(1, len(bounds) - 1)]
+        self.logger.warning('{} is read with {} parallel workers on key ranges: {}'.format(table, len(ranges), ranges))
+
+        # Bounded queue, so fast workers can not fill up the memory
+        out = queue.Queue(maxsize=2 * len(ranges))
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    out.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    continue
+
+        def worker(lower, lower_inclusive, upper):
+            try:
+                for chunk in self._iter_key_range(engine, db, table, key, chunksize, lower, lower_inclusive, upper, stop,
+                                                  max_bytes, where, params):
+                    put(('chunk', chunk))
+                put(('done', None))
+            except Exception as e:
+                put(('error', e))
+
+        threads = [threading.Thread(target=worker, args=r, daemon=True) for r in ranges]
+        for thread in threads:
+            thread.start()
+
+        try:
+            finished = 0
+            while finished < len(threads):
+                kind, item = out.get()
+                if kind == 'chunk':
+                    yield item
+                elif kind == 'done':
+                    finished += 1
+                else:
+                    self.logger.error('Reading key range of {} failed: {}'.format(table, item))
+                    raise item
+        finally:
+            stop.set()
+            for thread in threads:
+                thread.join()
@@ -1,7 +1,81 @@
 from nkmfraud.core.pipe import Pipe
-from sqlalchemy import create_engine
-import mysql.connector
+from nkmfraud.core.engines import get_engine
+from nkmfraud.core import profiling
+from sqlalchemy import inspect
+from sqlalchemy.types import VARCHAR
 import pandas as pd
+import numpy as np
+import csv
+import io
+import os
+import tempfile
+import time
+import uuid
+
+
+# Number of rows sent in one INSERT statement, or loaded from one LOAD DATA file
+BATCH_SIZE = 10000
+
+
+def _quote(name):
+    return '`{}`'.format(name.replace('`', '``'))
+
+
+def multirow_insert(table, conn, keys, data_iter, update_cols=None):
+    """pandas.to_sql method: insert a chunk with a multi-row INSERT, optionally with ON DUPLICATE KEY UPDATE.
+
+    MySQLdb executemany sends the rows of the chunk as one INSERT ... VALUES (...), (...) statement.
+
+    Args:
+        table (pandas.io.sql.SQLTable): Target table
+        conn (sqlalchemy.engine.Connection): Connection in the current transaction
+        keys (list): Column names
+        data_iter (iterable): Rows of the chunk
+        update_cols (list): Columns updated on duplicate key. None means plain INSERT.
+    """
+
+    name = _quote(table.name) if table.schema is None else '{}.{}'.format(_quote(table.schema), _quote(table.name))
+    query = 'INSERT INTO {} ({}) VALUES ({})'.format(name, ', '.join(_quote(k) for k in keys), ', '.join(['%s'] * len(keys)))
+    if update_cols:
+        query += ' ON DUPLICATE KEY UPDATE ' + ', '.join('{0} = VALUES({0})'.format(_quote(col)) for col in update_cols)
+
+    cursor = conn.connection.cursor()
+    try:
+        cursor.executemany(query, list(data_iter))
+    finally:
+        cursor.close()
+
+
+def to_load_data_csv(df, path_or_buf=None):
+    """CSV of a DataFrame in the format of LOAD DATA ... FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"'
+
+    NULLs are written as \\N, backslashes of the strings are escaped, booleans are written as 0/1. Lines are
+    terminated by \\n, open files with newline='', so it is not translated to \\r\\n on Windows.
+
+    Args:
+        df (pandas.DataFrame): DataFrame to be written
+        path_or_buf (file): Open text file the CSV is written to. Default None returns the CSV in memory.
+
+    Returns:
+        io.StringIO, or None if path_or_buf is given
+    """
+
+    df = df.copy(deep=False)
+    for col, dtype in df.dtypes.items():
+        if dtype.kind == 'b':
+            df[col] = df[col].astype(np.int8)
+        elif dtype.kind == 'O':
+            df[col] = df[col].where(df[col].isnull(), df[col].astype(str).str.replace('\\', '\\\\', regex=False))
+
+    buffer = io.StringIO() if path_or_buf is None else path_or_buf
+    df.to_csv(buffer, index=False, header=False, na_rep='\\N', quoting=csv.QUOTE_MINIMAL, lineterminator='\n',
+              date_format='%Y-%m-%d %H:%M:%S.%f')
+    if path_or_buf is not None:
+        return None
+
+    buffer.seek(0)
+
+    return buffer
 
 
 class MySQLWriter(Pipe):
@@ -14,30 +88,162 @@ class MySQLWriter(Pipe):
         table (str): The table name
         user (str): User with access to read
         password(str): User password
+        df (pandas.DataFrame): DataFrame to be written. The index is not written.
+        mode (str):
+            append: Insert the rows into the table (created if missing).
+            replace: Load the rows into a staging copy of the table, then swap the two tables with one atomic
+                RENAME TABLE, so readers never see a half loaded table, and the definition and indexes are kept.
+            upsert: Insert the rows, update the existing rows on duplicate primary / unique key. The table must have a
+                primary or unique key, a missing table is created with the primary key of key_cols.
+        method (str):
+            insert: Multi-row INSERT statements of batch_size rows.
+            load_data: LOAD DATA LOCAL INFILE of batch_size rows per file. CSV batches are written straight to a
+                temporary file for the load. Fastest for large loads, requires local_infile=1 on the server.
+        key_cols (list): Key columns, which are not updated in upsert mode, and the primary key of a table created in
+            upsert mode. Default updates every column.
+        batch_size (int): Number of rows in one INSERT statement / LOAD DATA file
+
+    Returns:
+        dict: rows, seconds, rows_per_second
 
-    Todo:
-        Not tested, not finished
+    Examples:
+        MySQLWriter('mysql_writer', 'loaders').run(ip, port, db, 'scores', user, password, df, mode='upsert',
+                                                   method='load_data', key_cols=['CUSTOMER_ID'])
 
     """
 
-    def run(self, ip, port, db, table, user, password, df):
+    @Pipe.timeit
+    def run(self, ip, port, db, table, user, password, df, mode='append', method='insert', key_cols=None,
+            batch_size=BATCH_SIZE):
+
+        if mode not in ('append', 'replace', 'upsert'):
+            raise ValueError(f'Unknown write mode: {mode}. Use append, replace or upsert.')
+        if method not in ('insert', 'load_data'):
+            raise ValueError(f'Unknown write method: {method}. Use insert or load_data.')
 
-        self.ip = ip
-        self.port = port
-        self.db = db
-        self.table = table
-        self.user = user
-        self.password = password
-        self.df = df
+        ts = time.perf_counter()
 
         # Create engine and connect to database
-        self.logger.info('Connecting to {}:{}'.format(self.ip,self.port))
-        conn_string = 'mysql+mysqlconnector://{}:{}@{}:{}/{}?auth_plugin=mysql_native_password'.format(self.user, self.password, self.ip, self.port,self.db)
-        engine = create_engine(conn_string)
+        self.logger.info('Connecting to {}:{}'.format(ip, port))
+        conn_string = 'mysql+mysqldb://{}:{}@{}:{}/{}?charset=utf8mb4'.format(user, password, ip, port, db)
+        engine = get_engine(conn_string, connect_args={'local_infile': 1})
+
+        with engine.connect() as conn:
+            if not engine.dialect.has_table(conn, table):
+                if mode == 'upsert' and not key_cols:
+                    raise ValueError(f'Table {table} does not exist, upsert mode requires key_cols for its primary key')
+                self._create_table(conn, table, df, key_cols if mode == 'upsert' else None)
+                self.logger.info('Table {}.{} is created'.format(db, table))
+            elif mode == 'upsert':
+                self._check_unique_key(conn, table)
+
+            if mode == 'replace':
+                # Unique names, so concurrent replaces of the same table do not drop or rename each other's tables
+                suffix = uuid.uuid4().hex[:8]
+                staging, old = '{}_staging_{}'.format(table, suffix), '{}_old_{}'.format(table, suffix)
+                conn.execute('CREATE TABLE {} LIKE {}'.format(_quote(staging), _quote(table)))
+                try:
+                    self._load(conn, staging, df, method, None, batch_size)
+                    conn.execute('RENAME TABLE {0} TO {1}, {2} TO {0}'.format(_quote(table), _quote(old),
+                                                                             _quote(staging)))
+                finally:
+                    conn.execute('DROP TABLE IF EXISTS {}, {}'.format(_quote(staging), _quote(old)))
+
+            elif mode == 'upsert':
+                update_cols = [col for col in df.columns if col not in (key_cols or [])]
+                self._load(conn, table, df, method, update_cols, batch_size)
+
+            else:
+                self._load(conn, table, df, method, None, batch_size)
+
+        seconds = time.perf_counter() - ts
+        report = {'rows': len(df), 'seconds': seconds, 'rows_per_second': len(df) / seconds if seconds else None}
+        profiling.record(rows_out=len(df))
+        self.logger.info('DataFrame is loaded into {}:{}/{}.{} in {} mode with {}: {} rows in {:.1f} s ({:.0f} rows/s)'.format(
+            ip, port, db, table, mode, method, len(df), seconds, report['rows_per_second'] or 0))
+
+        return report
+
+    @staticmethod
+    def _create_table(conn, table, df, key_cols=None):
+        """Create a missing table from the dtypes of the DataFrame, with the primary key of key_cols"""
+
+        # String keys can not be TEXT, MySQL indexes only VARCHAR columns without a prefix length
+        dtype = {col: VARCHAR(max([255] + df[col].dropna().astype(str).str.len().tolist()))
+                 for col in key_cols or [] if df[col].dtype.kind == 'O'}
+        df.head(0).to_sql(name=table, con=conn, index=False, dtype=dtype or None)
+
+        if key_cols:
+            conn.execute('ALTER TABLE {} ADD PRIMARY KEY ({})'.format(_quote(table),
+                                                                      ', '.join(_quote(col) for col in key_cols)))
+
+    @staticmethod
+    def _check_unique_key(conn, table):
+        """Raise ValueError if the table has no primary or unique key, as ON DUPLICATE KEY UPDATE would only insert"""
+
+        inspector = inspect(conn)
+        if inspector.get_pk_constraint(table).get('constrained_columns'):
+            return
+        if any(c['column_names'] for c in inspector.get_unique_constraints(table)) or \
+                any(i.get('unique') for i in inspector.get_indexes(table)):
+            return
+
+        raise ValueError(f'Table {table} has no primary or unique key, upserted rows would be duplicated')
+
+    def _load(self, conn, table, df, method, update_cols, batch_size):
+        """Insert df into table in batches, update_cols are updated on duplicate key"""
+
+        if method == 'insert':
+            with conn.begin():
+                df.to_sql(name=table, con=conn, if_exists='append', index=False, chunksize=batch_size,
+                          method=lambda *args: multirow_insert(*args, update_cols=update_cols))
+            return
+
+        # LOAD DATA can not update on duplicate key, so upserted rows are loaded into a temporary table first
+        columns = ', '.join(_quote(col) for col in df.columns)
+        if not update_cols:
+            for start in range(0, len(df), batch_size):
+                self._load_data(conn, table, columns, df.iloc[start:start + batch_size])
+            return
+
+        # A pooled connection may still have the staging table of a failed run
+        staging = table + '_upsert_staging'
+        conn.execute('DROP TEMPORARY TABLE IF EXISTS {}'.format(_quote(staging)))
+        conn.execute('CREATE TEMPORARY TABLE {} LIKE {}'.format(_quote(staging), _quote(table)))
+        try:
+            for start in range(0, len(df), batch_size):
+                self._load_data(conn, staging, columns, df.iloc[start:start + batch_size])
+
+            updates = ', '.join('{0} = VALUES({0})'.format(_quote(col)) for col in update_cols)
+            with conn.begin():
+                conn.execute('INSERT INTO {0} ({1}) SELECT {1} FROM {2} ON DUPLICATE KEY UPDATE {3}'.format(
+                    _quote(table), columns, _quote(staging), updates))
+        finally:
+            conn.execute('DROP TEMPORARY TABLE IF EXISTS {}'.format(_quote(staging)))
+
+    def _load_data(self, conn, table, columns, batch):
+        """Load one batch with LOAD DATA LOCAL INFILE from a temporary CSV file"""
 
-        # Write table to sql
-        self.logger.info('DataFrame is loaded into {}:{}/{}.{}'.format(self.ip, self.port, self.db, self.table))
-        df.to_sql(name=self.table, con=engine, if_exists='replace', index=False)
+        # newline='': the lines are terminated by \n on every platform, as the LOAD DATA statement declares
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', encoding='utf-8', newline='', delete=False) as f:
+            path = f.name
+            try:
+                to_load_data_csv(batch, f)
+            except Exception:
+                f.close()
+                os.remove(path)
+                raise
 
-        # Break connection down
-        engine.dispose()
+        query = ("LOAD DATA LOCAL INFILE '{}' INTO TABLE {} CHARACTER SET utf8mb4 "
+                 "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '\\\\' "
+                 "LINES TERMINATED BY '\\n' ({})").format(path.replace('\\', '/'), _quote(table), columns)
+        try:
+            cursor = conn.connection.cursor()
+            try:
+                cursor.execute(query)
+            finally:
+                cursor.close()
+            conn.connection.commit()
+            self.logger.debug('{} rows are loaded into {}'.format(len(batch), table))
+        finally:
+            os.remove(path)
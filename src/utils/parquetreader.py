@@ -0,0 +1,69 @@
+import os
+
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from nkmfraud.core.pipe import Pipe
+from nkmfraud.core import profiling
+
+
+class ParquetReader(Pipe):
+    """Parquet file system reader Pipe
+
+    Reads a single .parquet file or a (hive) partitioned dataset directory written by ParquetWriter. Only the
+    requested columns are decoded, and row groups / partitions not matching the filters are skipped using the
+    partition values and the row group statistics.
+    """
+
+    @Pipe.timeit
+    def run(self, parquet_path, columns=None, filters=None):
+        """
+        Args:
+            parquet_path (str): Path of the .parquet file or of the dataset directory
+            columns (list): Columns to be read. Default None reads every column.
+            filters (list): Row filters pushed down to the partitions and row groups, in pyarrow DNF format:
+                list of (column, op, value) tuples combined with AND, or list of such lists combined with OR.
+                op is one of =, ==, !=, <, >, <=, >=, in, not in
+
+        Returns:
+            pandas.DataFrame
+
+        Examples:
+            df = ParquetReader('parquet_reader','loaders').run('data/processed/sales', columns=['SKU', 'QTY'],
+                                                               filters=[('YEAR', '=', 2019), ('MONTH', '>=', 6)])
+
+        """
+
+        table = pq.read_table(parquet_path, columns=columns, filters=filters)
+        df = table.to_pandas()
+
+        profiling.record(bytes_read=table.nbytes)
+        self.logger.info('DataFrame is loaded from {} with shape: {}'.format(parquet_path, df.shape))
+
+        return df
+
+    def iter_chunks(self, parquet_path, columns=None, filters=None, chunksize=100000):
+        """Read a .parquet file or dataset in chunks of at most chunksize rows, one chunk in memory at a time
+
+        Args:
+            parquet_path (str): Path of the .parquet file or of the dataset directory
+            columns (list): Columns to be read. Default None reads every column.
+            filters (list): Row filters in pyarrow DNF format, see run
+            chunksize (int): Maximum number of rows in one chunk
+
+        Yields:
+            pandas.DataFrame
+        """
+
+        partitioning = 'hive' if os.path.isdir(parquet_path) else None
+        dataset = ds.dataset(parquet_path, format='parquet', partitioning=partitioning)
+        expression = pq.filters_to_expression(filters) if filters else None
+
+        for batch in dataset.to_batches(columns=columns, filter=expression, batch_size=chunksize):
+            if batch.num_rows == 0:
+                continue
+
+            profiling.record(bytes_read=batch.nbytes)
+            chunk = batch.to_pandas()
+            self.logger.debug('Chunk is loaded from {} with shape: {}'.format(parquet_path, chunk.shape))
+            yield chunk
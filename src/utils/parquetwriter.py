@@ -0,0 +1,54 @@
+import uuid
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from nkmfraud.core.pipe import Pipe
+from nkmfraud.core import profiling
+
+
+class ParquetWriter(Pipe):
+    """Parquet file system writer Pipe"""
+
+    @Pipe.timeit
+    def run(self, parquet_path, df, partition_cols=None, compression='snappy', use_dictionary=True,
+            row_group_size=None, append=False):
+        """
+        Args:
+            parquet_path (str): Path of the .parquet file, or of the dataset directory if partition_cols is given
+            df (pandas.DataFrame): DataFrame to be written to Parquet. The index is not written, use reset_index to
+                keep it as a column.
+            partition_cols (list): Columns the dataset is partitioned by (hive style: COL=value directories).
+                Readers filtering on these columns only open the matching directories.
+            compression (str): snappy, zstd, gzip, brotli, lz4 or None
+            use_dictionary (bool or list): Dictionary encode every column, or only the listed columns.
+                Efficient for low cardinality (e.g. string code) columns.
+            row_group_size (int): Maximum number of rows in a row group. Smaller row groups make filters on
+                sorted columns more selective.
+            append (bool): Add the data as new files to a partitioned dataset. Otherwise the partitions in df are
+                replaced (partitioned dataset), or the file is overwritten.
+
+        Examples:
+            ParquetWriter('parquet_writer','loaders').run('data/processed/sales', df, partition_cols=['YEAR', 'MONTH'],
+                                                          compression='zstd')
+
+        """
+
+        # A filtered or sorted index would be written as an extra __index_level_0__ column
+        table = pa.Table.from_pandas(df, preserve_index=False)
+
+        if partition_cols:
+            # Unique file names, so appended files do not overwrite the existing ones
+            basename = 'part-' + uuid.uuid4().hex + '-{i}.parquet'
+            pq.write_to_dataset(table, parquet_path, partition_cols=partition_cols, compression=compression,
+                                use_dictionary=use_dictionary, basename_template=basename,
+                                max_rows_per_group=row_group_size or 1024 * 1024,
+                                existing_data_behavior='overwrite_or_ignore' if append else 'delete_matching')
+        else:
+            if append:
+                raise ValueError('append is supported only for partitioned datasets (partition_cols)')
+            pq.write_table(table, parquet_path, compression=compression, use_dictionary=use_dictionary,
+                           row_group_size=row_group_size)
+
+        profiling.record(bytes_written=table.nbytes)
+        self.logger.info('DataFrame is written to {}, with shape: {}'.format(parquet_path, df.shape))
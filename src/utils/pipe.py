@@ -1,7 +1,9 @@
 import pandas as pd
 import abc
 from nkmfraud.core import log
+from nkmfraud.core import profiling
 import time
+import functools
 from sqlalchemy import create_engine
 from pdb import set_trace
 
@@ -17,6 +19,7 @@ class Pipe(metaclass=abc.ABCMeta):
     Args:
         name (str): The name of the Pipe, will be used in the log files, so make it unique.
         logname(str): The name of the logfile, where logs will be saved to.
+        cache (ResultCache): Cache of the methods decorated with @Pipe.cached. Default None means no caching.
 
     Examples:
         class SamplePipe(Pipe):
@@ -25,24 +28,77 @@ class Pipe(metaclass=abc.ABCMeta):
                 return df
     """
 
-    def __init__(self, name, logname):
+    def __init__(self, name, logname, cache=None):
 
         # This logger must be the same as the pipeline logger
         self.logger = log.create_logger(name=name, logname=logname)
+        self.name = name
         self.logname = logname
+        self.cache = cache
 
     @staticmethod
     def timeit(method):
-        """Decorator to measure execution time [s]. Use @Pipe.timeit on run(self) for implementation"""
+        """Decorator to measure execution time [s]. Use @Pipe.timeit on run(self) for implementation
 
-        def timed(*args, **kwargs):
-            ts = time.time()  # Start timer
-            result = method(*args, **kwargs)  # Execute method
-            te = time.time()  # Stop timer
-            args[0].logger.debug('Execution time: {0:.3f} s'.format((te-ts)))
+        If a profiling.Profiler is active, the call is measured as a stage named <pipe name>.<method>, with the rows
+        of the DataFrame arguments as rows_in, and the rows of the returned DataFrame as rows_out.
+        """
+
+        @functools.wraps(method)
+        def timed(self, *args, **kwargs):
+            rows_in = sum(len(arg) for arg in list(args) + list(kwargs.values()) if isinstance(arg, pd.DataFrame))
+
+            with profiling.profile('{}.{}'.format(getattr(self, 'name', type(self).__name__), method.__name__),
+                                   rows_in=rows_in) as stage:
+                ts = time.perf_counter()  # Start timer
+                result = method(self, *args, **kwargs)  # Execute method
+                te = time.perf_counter()  # Stop timer
+                if stage is not None and isinstance(result, pd.DataFrame):
+                    stage.add(rows_out=len(result))
+
+            self.logger.debug('Execution time: {0:.3f} s'.format((te-ts)))
             return result
         return timed
 
+    @staticmethod
+    def cached(method):
+        """Decorator to cache the returned DataFrame in self.cache. Use @Pipe.cached on reader methods.
+
+        The decorated method accepts an extra cache_token keyword argument, which is part of the cache key.
+        Change it (e.g. to the date of the last source load) to force a reload. The source of the instance
+        (see cache_identity) is part of the key too, so instances connected to different servers never share results.
+        """
+
+        @functools.wraps(method)
+        def cached_method(self, *args, cache_token=None, **kwargs):
+            if self.cache is None:
+                return method(self, *args, **kwargs)
+
+            pipe_name = '{}.{}'.format(type(self).__module__, type(self).__qualname__)
+            identity = self.cache_identity()
+            key = self.cache.make_key(pipe_name, method.__name__, args, kwargs, cache_token, identity=identity)
+
+            result = self.cache.get(key)
+            if result is not None:
+                self.logger.info('Result is loaded from cache [KEY]: {}'.format(key))
+                return result
+
+            result = method(self, *args, **kwargs)
+            if self.cache.put(key, result, pipe_name=pipe_name, identity=identity):
+                self.logger.debug('Result is stored in cache [KEY]: {}'.format(key))
+
+            return result
+        return cached_method
+
+    def cache_identity(self):
+        """The source the instance reads from (e.g. host:port/db), part of the keys of its cached results.
+
+        Override it in Pipes whose connection is set in __init__ instead of the arguments of the cached method.
+        Default None means the arguments identify the source.
+        """
+
+        return None
+
     @abc.abstractmethod
     def run(self):
         """The method to be implemented by Pipe subclasses
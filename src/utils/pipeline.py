@@ -0,0 +1,222 @@
+from nkmfraud.core.pipe import Pipe
+from nkmfraud.core import profiling
+
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+import contextvars
+import time
+
+
+def _execute_step(pipe, method, kwargs):
+    """Call a Pipe method. Module level function, so it can be pickled for process pools."""
+
+    return getattr(pipe, method)(**kwargs)
+
+
+def _profiled_step(name, pipe, method, kwargs):
+    """Call a Pipe method in a profiling stage named after the step"""
+
+    with profiling.profile(name):
+        return _execute_step(pipe, method, kwargs)
+
+
+class Step:
+    """A node of a Pipeline DAG.
+
+    Args:
+        name (str): Unique name of the step
+        pipe (Pipe): The Pipe to be executed
+        inputs (dict): Mapping of method argument names to named outputs of other steps (or Pipeline inputs)
+        params (dict): Mapping of method argument names to constant values
+        outputs (str or list): Name(s) of the output(s). If a list is given, the returned tuple is unpacked.
+        method (str): Name of the Pipe method to be called. Default is run.
+
+    """
+
+    def __init__(self, name, pipe, inputs=None, params=None, outputs=None, method='run'):
+
+        self.name = name
+        self.pipe = pipe
+        self.inputs = inputs or {}
+        self.params = params or {}
+        self.method = method
+
+        if outputs is None:
+            outputs = []
+        elif isinstance(outputs, str):
+            outputs = [outputs]
+            self.unpack = False
+        else:
+            outputs = list(outputs)
+            self.unpack = True
+        self.outputs = outputs
+
+    def store(self, result, results):
+        """Store the return value of the step in the results dictionary by output names"""
+
+        if not self.outputs:
+            return
+
+        if not self.unpack:
+            results[self.outputs[0]] = result
+            return
+
+        if len(result) != len(self.outputs):
+            raise ValueError(f'Step {self.name} returned {len(result)} values, but {len(self.outputs)} outputs are declared')
+
+        for output, value in zip(self.outputs, result):
+            results[output] = value
+
+
+class Pipeline(Pipe):
+    """Run a DAG of Pipes, with independent branches executed in parallel.
+
+    Every step declares which named outputs it consumes (inputs) and which named outputs it produces (outputs).
+    A step is submitted to the executor as soon as all of its inputs are available, so independent branches
+    (e.g. two database reads feeding one join) run at the same time.
+
+    Use executor='thread' for I/O bound steps (database reads, writes), and executor='process' for CPU bound ones.
+    In the latter case the Pipes and their inputs/outputs must be picklable.
+
+    Args:
+        name (str): The name of the Pipe, will be used in the log files, so make it unique.
+        logname(str): The name of the logfile, where logs will be saved to.
+        executor (str): 'thread' or 'process'
+        max_workers (int): Maximum number of steps running at the same time. 1 means sequential execution.
+
+    Examples:
+        pipeline = Pipeline('abt_pipeline', 'abt', max_workers=2)
+        pipeline.add('sales', MSSQLReader('mssql_reader', 'abt'), params={'ip': IP, 'db': DB, 'table': 'SALES'}, outputs='sales')
+        pipeline.add('customers', MySQLReader('mysql_reader', 'abt'), params=mysql_params, outputs='customers')
+        pipeline.add('join', JoinPipe('join', 'abt'), inputs={'left': 'sales', 'right': 'customers'}, outputs='abt')
+        abt = pipeline.run(outputs=['abt'])['abt']
+
+    """
+
+    def __init__(self, name, logname, executor='thread', max_workers=None, *args, **kwargs):
+
+        super().__init__(name, logname, *args, **kwargs)
+
+        if executor not in ('thread', 'process'):
+            raise ValueError(f'Unknown executor: {executor}. Use thread or process.')
+
+        self.executor = executor
+        self.max_workers = max_workers
+        self.steps = {}
+
+    def add(self, name, pipe, inputs=None, params=None, outputs=None, method='run'):
+        """Add a step to the Pipeline. See Step for the arguments.
+
+        Returns:
+            Pipeline: self, so add calls can be chained
+        """
+
+        if name in self.steps:
+            raise ValueError(f'Step {name} is already defined in the Pipeline')
+
+        step = Step(name, pipe, inputs=inputs, params=params, outputs=outputs, method=method)
+
+        # Every output must have exactly one producer
+        produced = {output: s.name for s in self.steps.values() for output in s.outputs}
+        for output in step.outputs:
+            if output in produced:
+                raise ValueError(f'Output {output} of step {name} is already produced by step {produced[output]}')
+
+        self.steps[name] = step
+
+        return self
+
+    def _validate(self, available):
+        """Check that every input is produced and the steps do not form a cycle"""
+
+        produced = {output for step in self.steps.values() for output in step.outputs}
+        for step in self.steps.values():
+            for source in step.inputs.values():
+                if source not in produced and source not in available:
+                    raise ValueError(f'Input {source} of step {step.name} is not produced by any step nor given to run()')
+
+        # Kahn's algorithm on the output dependencies
+        resolved = set(available)
+        remaining = dict(self.steps)
+        while remaining:
+            ready = [name for name, step in remaining.items() if all(src in resolved for src in step.inputs.values())]
+            if not ready:
+                raise ValueError('Pipeline steps contain a cycle: {}'.format(sorted(remaining)))
+            for name in ready:
+                resolved.update(remaining.pop(name).outputs)
+
+    def _create_executor(self):
+
+        if self.executor == 'process':
+            return ProcessPoolExecutor(max_workers=self.max_workers)
+
+        return ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='pipeline')
+
+    @Pipe.timeit
+    def run(self, outputs=None, **inputs):
+        """Execute the Pipeline.
+
+        Args:
+            outputs (list): Names of the outputs to be returned. Intermediate results which are not requested are
+                released as soon as all of their consumers are finished. If None, every output is returned.
+            **inputs: Named inputs of the Pipeline, which can be consumed by the steps
+
+        Returns:
+            dict: output name -> value
+        """
+
+        self._validate(inputs)
+
+        results = dict(inputs)
+        pending = dict(self.steps)
+        running = {}
+
+        # Count consumers, so intermediate results can be released early
+        consumers = {}
+        for step in self.steps.values():
+            for source in set(step.inputs.values()):
+                consumers[source] = consumers.get(source, 0) + 1
+        keep = None if outputs is None else set(outputs)
+
+        with self._create_executor() as executor:
+            try:
+                while pending or running:
+
+                    # Submit every step whose inputs are ready
+                    for name, step in list(pending.items()):
+                        if all(source in results for source in step.inputs.values()):
+                            kwargs = dict(step.params)
+                            kwargs.update({arg: results[source] for arg, source in step.inputs.items()})
+                            self.logger.info(f'Starting step: {name}')
+                            if self.executor == 'process':
+                                future = executor.submit(_execute_step, step.pipe, step.method, kwargs)
+                            else:
+                                # Run the step in a copy of the current context, so its stages are nested into the
+                                # stage of the Pipeline if a profiler is active
+                                future = executor.submit(contextvars.copy_context().run, _profiled_step, name,
+                                                         step.pipe, step.method, kwargs)
+                            running[future] = (step, time.perf_counter())
+                            del pending[name]
+
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+                    for future in done:
+                        step, ts = running.pop(future)
+                        step.store(future.result(), results)
+                        self.logger.info('Step {} is finished in {:.3f} s'.format(step.name, time.perf_counter() - ts))
+
+                        if keep is not None:
+                            for source in set(step.inputs.values()):
+                                consumers[source] -= 1
+                                if consumers[source] == 0 and source not in keep:
+                                    results.pop(source, None)
+
+            except Exception:
+                self.logger.exception('Pipeline execution failed')
+                for future in running:
+                    future.cancel()
+                raise
+
+        if keep is not None:
+            return {output: results[output] for output in outputs}
+
+        return results
@@ -1,12 +1,55 @@
 from phoenix.core.pipe import Pipe
+from phoenix.core.chunking import iter_query
+from phoenix.core.engines import get_engine
+from phoenix.core import dtypes as dtype_utils
+from phoenix.core import profiling
 
 import pandas as pd
 import datetime as dt
-from sqlalchemy import create_engine, Table, MetaData, and_
+import io
+import threading
+import time
+from sqlalchemy import Table, MetaData, and_, text
 from sqlalchemy.sql.expression import bindparam
 from pdb import set_trace
 
 
+# Number of rows sent in one COPY statement in bulk mode
+COPY_CHUNKSIZE = 100000
+
+
+def copy_insert(table, conn, keys, data_iter):
+    """Insert method for pandas.DataFrame.to_sql, which streams the rows through COPY FROM STDIN in CSV format.
+
+    Every to_sql chunk is serialized into an in-memory buffer and sent with one COPY statement, which is an order
+    of magnitude faster than batched INSERT statements.
+
+    Args:
+        table (pandas.io.sql.SQLTable): Target table
+        conn (sqlalchemy.engine.Connection): Connection in the current transaction
+        keys (list): Column names
+        data_iter (iterable): Rows of the chunk
+    """
+
+    quote = conn.dialect.identifier_preparer.quote
+    table_name = quote(table.name) if table.schema is None else '{}.{}'.format(quote(table.schema), quote(table.name))
+    columns = ', '.join(quote(key) for key in keys)
+
+    # Every value is quoted, NULL is an unquoted empty field (the CSV default of COPY), so neither empty strings
+    # nor strings like \N are read back as NULL
+    buf = io.StringIO()
+    for row in data_iter:
+        buf.write(','.join('' if value is None else '"{}"'.format(str(value).replace('"', '""')) for value in row))
+        buf.write('\n')
+    buf.seek(0)
+
+    cursor = conn.connection.cursor()
+    try:
+        cursor.copy_expert('COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(table_name, columns), buf)
+    finally:
+        cursor.close()
+
+
 class PostgresManager(Pipe):
     """Manages reading & writing of external Postgres databases
 
@@ -16,10 +59,11 @@ class PostgresManager(Pipe):
         db (str): Database name
         user (str): Username
         password (str): Password
+        schema_cache_ttl (int): Reflected table definitions are reused for this many seconds. 0 disables the cache.
 
     """
 
-    def __init__(self, host, port, db, user, password, *args, **kwargs):
+    def __init__(self, host, port, db, user, password, *args, schema_cache_ttl=300, **kwargs):
 
         super().__init__(*args, **kwargs)
 
@@ -31,26 +75,93 @@ class PostgresManager(Pipe):
 
         self.engine = None
 
+        # Reflected sqlalchemy Table objects: table_name -> (Table, reflection time)
+        self.schema_cache_ttl = schema_cache_ttl
+        self.schema_cache_stats = {'hits': 0, 'misses': 0}
+        self._tables = {}
+        self._tables_lock = threading.Lock()
+
+    def get_table(self, table_name, conn=None):
+        """Return the reflected sqlalchemy Table, from the schema cache if it is not older than schema_cache_ttl.
+
+        Args:
+            table_name (str): Name of the table
+            conn (sqlalchemy.engine.Connection): Connection used for the reflection. Default is the engine.
+
+        Returns:
+            sqlalchemy.Table
+        """
+
+        with self._tables_lock:
+            cached = self._tables.get(table_name)
+            if cached is not None and time.monotonic() - cached[1] < self.schema_cache_ttl:
+                self.schema_cache_stats['hits'] += 1
+                return cached[0]
+            self.schema_cache_stats['misses'] += 1
+
+        # Check if connection exists
+        if self.engine is None:
+            self.create_engine()
+
+        metadata = MetaData(bind=None)
+        table = Table(table_name, metadata, autoload=True, autoload_with=conn if conn is not None else self.engine)
+        self.logger.debug(f'Table definition of {table_name} is reflected')
+
+        with self._tables_lock:
+            self._tables[table_name] = (table, time.monotonic())
+
+        return table
+
+    def invalidate_table(self, table_name=None):
+        """Drop table definitions from the schema cache. Call it after schema changes made outside of this manager.
+
+        Args:
+            table_name (str): Name of the table. Default None drops every table definition.
+        """
+
+        with self._tables_lock:
+            if table_name is None:
+                self._tables.clear()
+            else:
+                self._tables.pop(table_name, None)
+
+    def cache_identity(self):
+        return '{}:{}/{}'.format(self.host, self.port, self.db)
+
+    def invalidate_results(self):
+        """Drop the cached read results of this database, called after every write. Does nothing without a cache."""
+
+        if self.cache is not None:
+            removed = self.cache.invalidate(pipe_name='{}.{}'.format(type(self).__module__, type(self).__qualname__),
+                                            identity=self.cache_identity())
+            if removed:
+                self.logger.debug(f'{removed} cached results of {self.db} are invalidated')
+
     def create_engine(self):
         """Connect to PosgreSQL server"""
 
         try:
             # Create engine and connect to database
             conn_string = 'postgresql+psycopg2://{}:{}@{}:{}/{}'.format(self.user, self.password, self.host, self.port, self.db)
-            self.engine = create_engine(conn_string, connect_args={'connect_timeout': 10})
+            self.engine = get_engine(conn_string, connect_args={'connect_timeout': 10})
             self.logger.info('Connected to {}:{}'.format(self.host, self.port))
 
         except Exception as e:
             self.logger.error('Connecting to {}.{} failed: {}'.format(self.host, self.port, e))
             raise
 
-    def write(self, df, table_name, dtype=None):
+    def write(self, df, table_name, dtype=None, bulk=False):
         """Write pandas DataFrame to PostgreSQL server. An existing table is always replaced.
 
         Args:
             table_name (str): Name of the table
             df (pd.DataFrame): pandas DataFrame to be written
             dtype (dict): type specifictaion
+            bulk (bool): If True, the data is loaded into a staging table with COPY, then the staging table is swapped
+                with the target table in the same transaction, so readers never see a half loaded table.
+                The table grants are copied to the new table. Indexes, constraints and triggers of the old table are
+                not: create them again after the write. Views and foreign keys depending on the table make the
+                swap fail, and the transaction is rolled back, use bulk=False for such tables.
 
         """
 
@@ -59,41 +170,140 @@ class PostgresManager(Pipe):
             self.create_engine()
 
         with self.engine.begin() as conn:
-            df.to_sql(name=table_name, con=conn, dtype=dtype, if_exists='replace', index=False, chunksize=10000)
+            if bulk:
+                staging_name = table_name + '_staging'
+                df.head(0).to_sql(name=staging_name, con=conn, dtype=dtype, if_exists='replace', index=False)
+                self.bulk_insert(conn, df, staging_name)
+
+                quote = conn.dialect.identifier_preparer.quote
+                self._copy_grants(conn, table_name, staging_name)
+                conn.execute('DROP TABLE IF EXISTS {}'.format(quote(table_name)))
+                conn.execute('ALTER TABLE {} RENAME TO {}'.format(quote(staging_name), quote(table_name)))
+            else:
+                df.to_sql(name=table_name, con=conn, dtype=dtype, if_exists='replace', index=False, chunksize=10000)
+
+            # The table is recreated, its definition may have changed
+            self.invalidate_table(table_name)
             self.logger.info(f'DataFrame is loaded into {self.db}.{table_name} with shape {df.shape}')
 
+        self.invalidate_results()
+
+    @staticmethod
+    def _copy_grants(conn, table_name, target_name):
+        """Grant the privileges of the other roles on table_name on target_name too"""
+
+        quote = conn.dialect.identifier_preparer.quote
+        grants = conn.execute(text('SELECT grantee, privilege_type FROM information_schema.role_table_grants '
+                                   'WHERE table_schema = current_schema() AND table_name = :table_name '
+                                   'AND grantee <> current_user'), table_name=table_name).fetchall()
+        for grantee, privilege in grants:
+            conn.execute('GRANT {} ON {} TO {}'.format(privilege, quote(target_name),
+                                                      'PUBLIC' if grantee == 'PUBLIC' else quote(grantee)))
+
+    @staticmethod
+    def bulk_insert(conn, df, table_name, chunksize=COPY_CHUNKSIZE):
+        """Append a DataFrame to an existing table with COPY FROM STDIN
+
+        Args:
+            conn (sqlalchemy.engine.Connection): Connection, the load is part of its transaction
+            df (pd.DataFrame): DataFrame to be inserted
+            table_name (str): Name of the table
+            chunksize (int): Number of rows sent in one COPY statement
+        """
+
+        df.to_sql(name=table_name, con=conn, if_exists='append', index=False, chunksize=chunksize, method=copy_insert)
+
     def update_eta(self, eta_update_df, table_name):
         """Update PosgreSQL ETA output, and insert new records if it not exists.
 
+        Every record of the table with a SPRINT_ID present in the update is replaced (see upsert). A missing table is
+        created from the DataFrame.
+
         Args:
             table_name (str): Name of the table
             eta_update_df (pd.DataFrame): pandas dataframe with the updateable data
         """
 
-        # Check if connection exists
-        if self.engine is None:
-            self.create_engine()
+        self.upsert(eta_update_df, table_name, key_cols=['SPRINT_ID'], how='delete_insert')
+        self.logger.info(f'Records with [SPRINT_ID]: {eta_update_df.SPRINT_ID.nunique()} ids are replaced in ETA live table. ROWNUM: {len(eta_update_df)}')
 
-        # Do update
-        with self.engine.connect() as conn:
+    def upsert(self, df, table_name, key_cols, how='on_conflict'):
+        """Insert or update records by key columns in one transaction, with a fixed number of round trips.
 
-            # Drop all predictions with the current ETA ID
-            for id in eta_update_df.SPRINT_ID.unique():
-                metadata = MetaData(bind=None)
-                eta = Table(table_name, metadata, autoload=True, autoload_with=conn)
-                stmt = eta.delete().where(eta.c.SPRINT_ID == id)
-                conn.execute(stmt)
-                self.logger.info(f'Record with [SPRINT_ID]: {id} is deleted from ETA live table')
+        The DataFrame is loaded into a temporary staging table with COPY, then merged into the target with one
+        set-based statement:
+            on_conflict: INSERT ... ON CONFLICT (key_cols) DO UPDATE. Requires a unique index on key_cols.
+            delete_insert: DELETE ... USING staging, then INSERT. Every existing record with a key present in df
+                is replaced, so it works without a unique index and for non-unique keys too.
 
-            # Write records
-            eta_update_df.to_sql(name=table_name, con=conn, if_exists='append', index=False, chunksize=10000)
-            self.logger.info(f'Records with [SPRINT_ID]: {id} inserted to ETA live table. ROWNUM: {len(eta_update_df)}')
+        A missing target table is created from the dtypes of df, with the primary key of key_cols in on_conflict mode.
 
-    def read(self, table_name):
+        Args:
+            df (pd.DataFrame): Records to be upserted, columns must exist in the target table
+            table_name (str): Name of the target table
+            key_cols (list): Key columns
+            how (str): on_conflict or delete_insert
+        """
+
+        if how not in ('on_conflict', 'delete_insert'):
+            raise ValueError(f'Unknown upsert method: {how}. Use on_conflict or delete_insert.')
+
+        # Check if connection exists
+        if self.engine is None:
+            self.create_engine()
+
+        with self.engine.begin() as conn:
+            quote = conn.dialect.identifier_preparer.quote
+            target = quote(table_name)
+            staging = quote(table_name + '_upsert_staging')
+            columns = ', '.join(quote(col) for col in df.columns)
+
+            if not conn.dialect.has_table(conn, table_name):
+                # The empty table is created in the transaction, and the rows are merged into it as usual
+                df.head(0).to_sql(name=table_name, con=conn, if_exists='fail', index=False)
+                if how == 'on_conflict':
+                    conn.execute('ALTER TABLE {} ADD PRIMARY KEY ({})'.format(
+                        target, ', '.join(quote(col) for col in key_cols)))
+                self.invalidate_table(table_name)
+                self.logger.info(f'Table {self.db}.{table_name} is created')
+
+            # Only the columns of df, without the NOT NULL constraints of the target, so columns with defaults can be
+            # left out of df, and the rows are checked by the target at the merge
+            conn.execute('CREATE TEMPORARY TABLE {} ON COMMIT DROP AS SELECT {} FROM {} WITH NO DATA'.format(
+                staging, columns, target))
+            self.bulk_insert(conn, df, table_name + '_upsert_staging')
+
+            if how == 'on_conflict':
+                updates = [col for col in df.columns if col not in key_cols]
+                if updates:
+                    action = 'DO UPDATE SET ' + ', '.join('{0} = EXCLUDED.{0}'.format(quote(col)) for col in updates)
+                else:
+                    action = 'DO NOTHING'
+                conn.execute('INSERT INTO {0} ({1}) SELECT {1} FROM {2} ON CONFLICT ({3}) {4}'.format(
+                    target, columns, staging, ', '.join(quote(col) for col in key_cols), action))
+
+            else:
+                keys = ', '.join(quote(col) for col in key_cols)
+                match = ' AND '.join('t.{0} = s.{0}'.format(quote(col)) for col in key_cols)
+                conn.execute('DELETE FROM {} t USING (SELECT DISTINCT {} FROM {}) s WHERE {}'.format(target, keys, staging, match))
+                conn.execute('INSERT INTO {0} ({1}) SELECT {1} FROM {2}'.format(target, columns, staging))
+
+            self.logger.info(f'{len(df)} records are upserted into {self.db}.{table_name} on {key_cols}')
+
+        self.invalidate_results()
+
+    @Pipe.cached
+    def read(self, table_name, where=None, params=None, dtypes=None):
         """Read table from PostgreSQL
 
         Args:
             table_name (str): Name of the table
+            where (str): Filter condition executed by the server, parameters can be bound with :name
+                (e.g. 'updated_at > :watermark' for incremental loads)
+            params (dict): Bound parameters of the where condition
+            dtypes: Dtype optimisation of the result (see dtypes.read_sql_kwargs): None (off), 'auto', a schema dict,
+                or the path of a schema file, created at the first load and applied while parsing at the later loads
+            cache_token: Freshness token of the cached result, used only if the manager has a cache (see Pipe.cached)
         """
 
         # Check if connection exists
@@ -103,13 +313,40 @@ class PostgresManager(Pipe):
         df = None
 
         with self.engine.begin() as conn:
-            query = 'SELECT * FROM {}'.format(table_name)
+            query = 'SELECT * FROM {}'.format(table_name) + (' WHERE {}'.format(where) if where else '')
             self.logger.info('Executing query: {}'.format(query))
-            df = pd.read_sql(query, conn)
+            df = pd.read_sql(text(query), conn, params=params or {}, **dtype_utils.read_sql_kwargs(dtypes))
+            profiling.record_frame(df)
+            df = dtype_utils.finalise(df, dtypes, self.logger)
             self.logger.info(f'{self.db}.{table_name} is loaded with shape: {df.shape}')
 
         return df
 
+    def iter_chunks(self, table_name, chunksize=100000, max_bytes=None):
+        """Read table from PostgreSQL in chunks with a server-side cursor, so only one chunk is held in memory.
+
+        Args:
+            table_name (str): Name of the table
+            chunksize (int): Number of rows in one chunk (upper limit, if max_bytes is given)
+            max_bytes (int): Memory budget of one chunk in bytes
+
+        Yields:
+            pandas.DataFrame
+        """
+
+        # Check if connection exists
+        if self.engine is None:
+            self.create_engine()
+
+        # Server-side (named) cursors live in a transaction
+        with self.engine.begin() as conn:
+            query = 'SELECT * FROM {}'.format(table_name)
+            self.logger.info('Executing query: {} in chunks'.format(query))
+            for chunk in iter_query(conn, query, chunksize=chunksize, max_bytes=max_bytes):
+                self.logger.debug(f'Chunk is loaded from {self.db}.{table_name} with shape: {chunk.shape}')
+                profiling.record_frame(chunk)
+                yield chunk
+
     def truncate(self, table_name):
         """Truncate table
 
@@ -127,6 +364,8 @@ class PostgresManager(Pipe):
             conn.execute(query)
             self.logger.info(f'{self.db}.{table_name} is truncated')
 
+        self.invalidate_results()
+
 
     def drop_old_recs(self, table_name, col, delta_min=10):
         """Delete all records which are older than the given time period.
@@ -142,19 +381,21 @@ class PostgresManager(Pipe):
             self.create_engine()
 
         with self.engine.begin() as conn:
-            metadata = MetaData(bind=None)
-            table = Table(table_name, metadata, autoload=True, autoload_with=conn)
+            table = self.get_table(table_name, conn)
             too_old = (dt.datetime.now() - dt.timedelta(minutes=delta_min)).strftime('%Y-%m-%d %H:%M:%S.%f %Z') + ' Europe/Budapest'
             conn.execute(table.delete().where(table.c[col] <= too_old))
             self.logger.info(f'Records where {col} is older than {too_old} are deleted')
 
+        self.invalidate_results()
+
 
-    def truncate_insert(self, table_name, df):
+    def truncate_insert(self, table_name, df, bulk=False):
         """Truncate table then inert records
 
         Args:
             table_name (str): name of the table to do insert into
             df (pd.DataFrame): DataFrame to be inserted
+            bulk (bool): If True, the table is truncated and loaded with COPY in one transaction
         """
 
         #Check if connection exists
@@ -162,10 +403,16 @@ class PostgresManager(Pipe):
             self.create_engine()
 
         with self.engine.begin() as conn:
-            self.truncate(table_name)
-            df.to_sql(name=table_name, con=conn, if_exists='append', index=False, chunksize=10000)
+            if bulk:
+                conn.execute('TRUNCATE TABLE {}'.format(table_name))
+                self.bulk_insert(conn, df, table_name)
+            else:
+                self.truncate(table_name)
+                df.to_sql(name=table_name, con=conn, if_exists='append', index=False, chunksize=10000)
             self.logger.info(f'Data is truncate-inserted into {table_name} with {df.shape[0]} records')
 
+        self.invalidate_results()
+
     def delete(self, table_name, filter):
         """Delete records from the postgres table.
 
@@ -181,9 +428,10 @@ class PostgresManager(Pipe):
             self.create_engine()
 
         with self.engine.begin() as conn:
-            metadata = MetaData(bind=None)
-            table = Table(table_name, metadata, autoload=True, autoload_with=conn)
+            table = self.get_table(table_name, conn)
             terms = [table.c[x] == filter[x] for x in filter.keys()]
             stmt = table.delete().where(and_(*terms))
             conn.execute(stmt)
             self.logger.info(f'Data is deleted from {table_name} on filter {filter}')
+
+        self.invalidate_results()
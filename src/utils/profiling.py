@@ -0,0 +1,328 @@
+import contextlib
+import contextvars
+import datetime
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    # Windows: only the tracemalloc memory measurement is available
+    resource = None
+
+
+# The innermost open stage of the current thread / task. Copied into the worker threads of the Pipeline.
+_current_stage = contextvars.ContextVar('profiling_stage', default=None)
+
+COUNTERS = ('rows_in', 'rows_out', 'bytes_read', 'bytes_written')
+
+# Prometheus metric name, help text and record field of the exported measurements
+_METRICS = [('pipe_stage_wall_seconds', 'Wall time of the stage', 'wall_s'),
+            ('pipe_stage_cpu_seconds', 'Process CPU time during the stage', 'cpu_s'),
+            ('pipe_stage_peak_memory_bytes', 'Peak memory allocated during the stage', 'peak_memory_bytes'),
+            ('pipe_stage_rows_in', 'Rows passed to the stage', 'rows_in'),
+            ('pipe_stage_rows_out', 'Rows returned by the stage', 'rows_out'),
+            ('pipe_stage_bytes_read', 'Bytes read by the stage', 'bytes_read'),
+            ('pipe_stage_bytes_written', 'Bytes written by the stage', 'bytes_written')]
+
+
+class Stage:
+    """One measured stage, nested into its parent stage"""
+
+    def __init__(self, profiler, name, parent=None, **counters):
+
+        self.profiler = profiler
+        self.name = name
+        self.parent = parent
+        self.path = name if parent is None else parent.path + '/' + name
+        self.depth = 0 if parent is None else parent.depth + 1
+        self.counters = {counter: counters.get(counter) or 0 for counter in COUNTERS}
+
+        self.start = None
+        self.wall_s = None
+        self.cpu_s = None
+        self.peak_memory_bytes = None
+
+        self._ts = None
+        self._cpu = None
+        self._memory_start = None
+        self._peak = 0
+
+    def add(self, **counters):
+        """Increase the row and byte counters of the stage"""
+
+        for counter, value in counters.items():
+            if counter not in self.counters:
+                raise ValueError(f'Unknown counter: {counter}. Use one of {COUNTERS}')
+            self.counters[counter] += value or 0
+
+    def record(self):
+
+        out = {'run': self.profiler.name, 'stage': self.path, 'name': self.name, 'depth': self.depth,
+               'start': self.start, 'wall_s': self.wall_s, 'cpu_s': self.cpu_s,
+               'peak_memory_bytes': self.peak_memory_bytes}
+        out.update(self.counters)
+
+        return out
+
+
+class Profiler:
+    """Hierarchical profiler of Pipes and Pipelines.
+
+    Stages are opened with the stage context manager (or automatically by methods decorated with @Pipe.timeit and
+    by the steps of a Pipeline) while the profiler is active, and are nested into the enclosing stage. Every stage
+    records wall time (perf_counter), CPU time of the process (process_time), peak memory, and rows / bytes
+    counters, which are filled by @Pipe.timeit from DataFrame arguments and results, or by calling record().
+
+    CPU time and memory are process-wide measurements, so stages running in parallel threads see each other's load.
+
+    Args:
+        name (str): Name of the run, e.g. the name of the nightly job
+        memory (str): Peak memory measurement: 'tracemalloc' (precise, slows down allocation heavy code),
+            'rss' (growth of the peak resident set size, cheap) or None
+
+    Examples:
+        profiler = Profiler('nightly')
+        with profiler:
+            with profiler.stage('load'):
+                df = reader.run(...)
+            pipeline.run()
+
+        print(profiler.summary())
+        profiler.to_prometheus('reports/profiling/nightly.prom')
+        profiler.compare('reports/profiling/nightly_prev.json')
+
+    """
+
+    def __init__(self, name='run', memory='tracemalloc'):
+
+        if memory not in ('tracemalloc', 'rss', None):
+            raise ValueError(f'Unknown memory measurement: {memory}. Use tracemalloc, rss or None.')
+        if memory == 'rss' and resource is None:
+            raise ValueError('rss memory measurement is not available on this platform. Use tracemalloc or None.')
+
+        self.name = name
+        self.memory = memory
+        self.stages = []
+        self._open_stages = set()
+        self._lock = threading.Lock()
+        self._root = None
+        self._token = None
+        self._started_tracemalloc = False
+
+    def __enter__(self):
+
+        if self.memory == 'tracemalloc' and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+        self._root = Stage(self, self.name)
+        self._open(self._root)
+        self._token = _current_stage.set(self._root)
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+
+        _current_stage.reset(self._token)
+        self._close(self._root)
+
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+        return False
+
+    @contextlib.contextmanager
+    def stage(self, name, **counters):
+        """Measure a stage nested into the current stage of this profiler
+
+        Args:
+            name (str): Name of the stage
+            **counters: Initial value of rows_in, rows_out, bytes_read, bytes_written
+
+        Yields:
+            Stage: call its add method to increase the counters
+        """
+
+        parent = _current_stage.get()
+        if parent is None or parent.profiler is not self:
+            parent = self._root
+
+        stage = Stage(self, name, parent, **counters)
+        self._open(stage)
+        token = _current_stage.set(stage)
+        try:
+            yield stage
+        finally:
+            _current_stage.reset(token)
+            self._close(stage)
+
+    def _memory(self):
+        """Current and peak memory since the last reset"""
+
+        if self.memory == 'tracemalloc':
+            return tracemalloc.get_traced_memory()
+
+        # ru_maxrss is in kilobytes on Linux
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return peak, peak
+
+    def _propagate_peak(self):
+        """Move the peak since the last reset to every open stage, so the peak can be reset for a new stage"""
+
+        if self.memory != 'tracemalloc':
+            return
+
+        _, peak = tracemalloc.get_traced_memory()
+        for stage in self._open_stages:
+            stage._peak = max(stage._peak, peak)
+        tracemalloc.reset_peak()
+
+    def _open(self, stage):
+
+        with self._lock:
+            self._propagate_peak()
+            stage._memory_start, stage._peak = self._memory()
+            self._open_stages.add(stage)
+            stage.start = datetime.datetime.now().isoformat()
+            stage._cpu = time.process_time()
+            stage._ts = time.perf_counter()
+
+    def _close(self, stage):
+
+        with self._lock:
+            stage.wall_s = time.perf_counter() - stage._ts
+            stage.cpu_s = time.process_time() - stage._cpu
+            if self.memory is not None:
+                _, peak = self._memory()
+                self._propagate_peak()
+                stage.peak_memory_bytes = max(stage._peak, peak) - stage._memory_start
+            self._open_stages.discard(stage)
+            self.stages.append(stage)
+
+    def summary(self):
+        """Per stage summary of the run, repeated stages (e.g. chunks of a loop) are aggregated
+
+        Returns:
+            pandas.DataFrame: stage, depth, calls, wall_s, cpu_s, peak_memory_bytes, rows_in, rows_out, bytes_read,
+                bytes_written, share (of the wall time of the run) in the order of the first start of the stages
+        """
+
+        records = pd.DataFrame([stage.record() for stage in self.stages])
+        if records.empty:
+            return records
+
+        records = records.sort_values('start', kind='mergesort')
+        summary = records.groupby('stage', sort=False).agg(depth=('depth', 'first'), calls=('stage', 'size'),
+                                                           wall_s=('wall_s', 'sum'), cpu_s=('cpu_s', 'sum'),
+                                                           peak_memory_bytes=('peak_memory_bytes', 'max'),
+                                                           rows_in=('rows_in', 'sum'), rows_out=('rows_out', 'sum'),
+                                                           bytes_read=('bytes_read', 'sum'),
+                                                           bytes_written=('bytes_written', 'sum')).reset_index()
+
+        total = summary.loc[summary['depth'] == 0, 'wall_s'].sum()
+        summary['share'] = summary['wall_s'] / total if total else None
+
+        return summary
+
+    def to_json(self, path):
+        """Save every stage of the run as JSON"""
+
+        self._makedirs(path)
+        with open(path, 'w') as f:
+            json.dump({'run': self.name, 'stages': [stage.record() for stage in self.stages]}, f, indent=2)
+
+    def to_prometheus(self, path):
+        """Save the summary in Prometheus text exposition format (e.g. for the node exporter textfile collector)"""
+
+        summary = self.summary()
+
+        lines = []
+        for metric, help_text, field in _METRICS:
+            lines.append(f'# HELP {metric} {help_text}')
+            lines.append(f'# TYPE {metric} gauge')
+            for _, row in summary.iterrows():
+                if pd.notnull(row[field]):
+                    lines.append(f'{metric}{{run="{self.name}",stage="{row["stage"]}"}} {row[field]}')
+
+        self._makedirs(path)
+        with open(path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    def compare(self, path):
+        """Compare the run with a previous run saved with to_json
+
+        Returns:
+            pandas.DataFrame: summary with the wall time of the previous run (wall_s_prev) and the ratio of the two,
+                the slowest relative change first
+        """
+
+        with open(path, 'r') as f:
+            previous = pd.DataFrame(json.load(f)['stages'])
+
+        previous = previous.groupby('stage')['wall_s'].sum().rename('wall_s_prev').reset_index()
+        comparison = self.summary().merge(previous, on='stage', how='left')
+        comparison['wall_ratio'] = comparison['wall_s'] / comparison['wall_s_prev']
+
+        return comparison.sort_values('wall_ratio', ascending=False).reset_index(drop=True)
+
+    @staticmethod
+    def _makedirs(path):
+
+        folder = os.path.dirname(path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+
+
+def current_stage():
+    """The innermost open stage, or None if no profiler is active"""
+
+    return _current_stage.get()
+
+
+@contextlib.contextmanager
+def profile(name, **counters):
+    """Open a stage in the active profiler. Does nothing (yields None) if no profiler is active.
+
+    Examples:
+        with profile('feature_engineering', rows_in=len(df)) as stage:
+            df = build_features(df)
+    """
+
+    stage = _current_stage.get()
+    if stage is None:
+        yield None
+        return
+
+    with stage.profiler.stage(name, **counters) as stage:
+        yield stage
+
+
+def record(**counters):
+    """Increase the rows_in, rows_out, bytes_read, bytes_written counters of the current stage, if any
+
+    Examples:
+        record(bytes_read=os.path.getsize(path))
+    """
+
+    stage = _current_stage.get()
+    if stage is not None:
+        stage.add(**counters)
+
+
+def record_frame(df, counter='bytes_read'):
+    """Increase a byte counter of the current stage with the memory usage of a DataFrame (with the strings).
+
+    Used by the SQL readers, where the size of the decoded result is the measure of the data read. The size is
+    computed only if a profiler is active.
+    """
+
+    stage = _current_stage.get()
+    if stage is not None:
+        stage.add(**{counter: int(df.memory_usage(index=True, deep=True).sum())})
@@ -0,0 +1,79 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from nkmfraud.core.pipe import Pipe
+from nkmfraud.core.snapshotwriter import MANIFEST_FILE
+
+
+class SnapshotReader(Pipe):
+    """Memory-mapped snapshot reader Pipe, for snapshots written by SnapshotWriter.
+
+    Numeric, bool, datetime and categorical columns are memory mapped read-only (mmap_mode='r'), and wrapped into the
+    DataFrame without copy, so loading takes milliseconds regardless of the size, and processes reading the same
+    snapshot share the pages of the OS page cache. The returned DataFrame is read-only: assigning to its mapped columns
+    raises an error, copy it (df.copy()) or replace whole columns instead.
+    """
+
+    @Pipe.timeit
+    def run(self, snapshot_path, columns=None, mmap=True):
+        """
+        Args:
+            snapshot_path (str): Directory of the snapshot
+            columns (list): Columns to be loaded. Default None loads every column.
+            mmap (bool): Memory map the columns. If False, the columns are read into memory.
+
+        Returns:
+            pandas.DataFrame
+
+        Examples:
+            df = SnapshotReader('snapshot_reader','loaders').run('data/interim/abt', columns=['SKU', 'QTY'])
+
+        """
+
+        with open(os.path.join(snapshot_path, MANIFEST_FILE), 'r') as f:
+            manifest = json.load(f)
+
+        entries = manifest['columns']
+        if columns is not None:
+            by_name = {entry['name']: entry for entry in entries}
+            missing = [col for col in columns if col not in by_name]
+            if missing:
+                raise KeyError(f'Columns are not in the snapshot: {missing}')
+            entries = [by_name[col] for col in columns]
+
+        mmap_mode = 'r' if mmap else None
+        data = {entry['name']: self._load_column(snapshot_path, entry, mmap_mode) for entry in entries}
+
+        index = manifest['index']
+        if index['kind'] == 'range':
+            index = pd.RangeIndex(index['start'], index['stop'], index['step'], name=index['name'])
+        else:
+            index = pd.Index(self._load_column(snapshot_path, index, mmap_mode), name=index['name'])
+
+        # copy=False keeps the memory mapped arrays as the blocks of the DataFrame
+        df = pd.DataFrame(data, index=index, columns=[entry['name'] for entry in entries], copy=False)
+        self.logger.info('DataFrame is loaded from {} with shape: {}'.format(snapshot_path, df.shape))
+
+        return df
+
+    @staticmethod
+    def _load_column(path, entry, mmap_mode):
+
+        if entry['kind'] == 'object':
+            return np.load(os.path.join(path, entry['file']), allow_pickle=True)
+
+        values = np.load(os.path.join(path, entry['file']), mmap_mode=mmap_mode)
+
+        if entry['kind'] == 'category':
+            categories = np.load(os.path.join(path, entry['categories_file']), allow_pickle=True)
+            return pd.Categorical.from_codes(values, categories=categories, ordered=entry['ordered'])
+
+        if entry['kind'] == 'datetimetz':
+            # Older snapshots have UTC nanoseconds as int64
+            values = values.view('M8[ns]') if values.dtype.kind == 'i' else values
+            return pd.DatetimeIndex(values).tz_localize('UTC').tz_convert(entry['tz'])
+
+        return values
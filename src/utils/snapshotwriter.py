@@ -0,0 +1,99 @@
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from nkmfraud.core.pipe import Pipe
+from nkmfraud.core import profiling
+
+
+MANIFEST_FILE = 'manifest.json'
+
+
+class SnapshotWriter(Pipe):
+    """Memory-mappable snapshot writer Pipe, for handing DataFrames over between Pipes and processes.
+
+    Every column is saved as a .npy file in the snapshot directory, and described in manifest.json. Numeric, bool
+    and datetime columns, and the codes of categorical columns are read back by SnapshotReader with memory mapping,
+    without deserialization or copy. Other (e.g. string) columns are pickled, and are loaded into memory, so convert
+    them to category before writing where possible.
+    """
+
+    @Pipe.timeit
+    def run(self, snapshot_path, df):
+        """
+        Args:
+            snapshot_path (str): Directory of the snapshot, replaced if it exists
+            df (pandas.DataFrame): DataFrame to be written. MultiIndex columns or index, and duplicate column names
+                are not supported.
+
+        Examples:
+            SnapshotWriter('snapshot_writer','loaders').run('data/interim/abt', abt_df)
+
+        """
+
+        if isinstance(df.columns, pd.MultiIndex) or isinstance(df.index, pd.MultiIndex):
+            raise ValueError('MultiIndex columns and index are not supported, reset or flatten them before writing')
+        if df.columns.has_duplicates:
+            raise ValueError('Duplicate column names: {}'.format(df.columns[df.columns.duplicated()].unique().tolist()))
+
+        # Written to a temporary directory first, so readers never see a half written snapshot
+        snapshot_path = snapshot_path.rstrip('/')
+        tmp_path = '{}.tmp-{}'.format(snapshot_path, uuid.uuid4().hex[:8])
+        os.makedirs(tmp_path)
+
+        columns = [self._save_column(tmp_path, f'col_{i}', name, df[name]) for i, name in enumerate(df.columns)]
+
+        if isinstance(df.index, pd.RangeIndex):
+            index = {'kind': 'range', 'start': int(df.index.start), 'stop': int(df.index.stop),
+                     'step': int(df.index.step), 'name': df.index.name}
+        else:
+            index = self._save_column(tmp_path, 'index', df.index.name, df.index.to_series())
+
+        manifest = {'nrows': len(df), 'columns': columns, 'index': index}
+        with open(os.path.join(tmp_path, MANIFEST_FILE), 'w') as f:
+            json.dump(manifest, f, indent=2, default=str)
+
+        # The old snapshot is renamed aside before the new one is renamed into its place, so the path always holds a
+        # complete snapshot, except for the moment between the two renames. The old snapshot is deleted afterwards,
+        # processes which still map its files keep reading them, the files are freed after they are closed.
+        old_path = None
+        if os.path.exists(snapshot_path):
+            old_path = '{}.old-{}'.format(snapshot_path, uuid.uuid4().hex[:8])
+            os.rename(snapshot_path, old_path)
+        os.rename(tmp_path, snapshot_path)
+        if old_path is not None:
+            shutil.rmtree(old_path, ignore_errors=True)
+
+        profiling.record(bytes_written=sum(os.path.getsize(os.path.join(snapshot_path, f)) for f in os.listdir(snapshot_path)))
+        self.logger.info('DataFrame is written to {}, with shape: {}'.format(snapshot_path, df.shape))
+
+    @staticmethod
+    def _save_column(path, file_name, name, series):
+        """Save one column as .npy file(s), and return its manifest entry"""
+
+        entry = {'name': name, 'file': file_name + '.npy', 'dtype': str(series.dtype)}
+
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            entry.update({'kind': 'category', 'categories_file': file_name + '_categories.npy',
+                          'ordered': bool(series.cat.ordered)})
+            np.save(os.path.join(path, entry['file']), series.cat.codes.values)
+            np.save(os.path.join(path, entry['categories_file']), series.cat.categories.values, allow_pickle=True)
+
+        elif isinstance(series.dtype, pd.DatetimeTZDtype):
+            # Saved as UTC datetime64 of the resolution of the column, the time zone is restored at read
+            entry.update({'kind': 'datetimetz', 'tz': str(series.dt.tz)})
+            np.save(os.path.join(path, entry['file']), series.dt.tz_convert('UTC').dt.tz_localize(None).values)
+
+        elif series.dtype.kind in 'biufcmM':
+            entry['kind'] = 'numpy'
+            np.save(os.path.join(path, entry['file']), series.values)
+
+        else:
+            entry['kind'] = 'object'
+            np.save(os.path.join(path, entry['file']), series.values.astype(object), allow_pickle=True)
+
+        return entry
@@ -0,0 +1,104 @@
+from src.utils.pipe import Pipe
+from src.utils.cache import ResultCache
+
+import pandas as pd
+
+
+class CountingReader(Pipe):
+    """Reader which counts how many times the source is hit"""
+
+    calls = 0
+
+    @Pipe.cached
+    def run(self, table):
+        CountingReader.calls += 1
+        return pd.DataFrame({'table': [table] * 3, 'value': [1.0, 2.0, 3.0]})
+
+
+class ServerReader(CountingReader):
+    """Reader connected to a server in __init__"""
+
+    def __init__(self, host, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.host = host
+
+    def cache_identity(self):
+        return self.host
+
+
+# TESTS
+# =====
+def test_cache_hit(tmp_path):
+    """Test if the second call is served from the cache"""
+
+    CountingReader.calls = 0
+    reader = CountingReader('reader', 'test', cache=ResultCache(str(tmp_path)))
+
+    first = reader.run('sales', cache_token='2019-01-01')
+    second = reader.run('sales', cache_token='2019-01-01')
+
+    assert CountingReader.calls == 1, 'Cached result is not reused'
+    assert first.equals(second), 'Cached and original results are different'
+
+
+def test_cache_token(tmp_path):
+    """Test if a new freshness token forces a reload"""
+
+    CountingReader.calls = 0
+    reader = CountingReader('reader', 'test', cache=ResultCache(str(tmp_path)))
+
+    reader.run('sales', cache_token='2019-01-01')
+    reader.run('sales', cache_token='2019-01-02')
+
+    assert CountingReader.calls == 2
+
+
+def test_cache_invalidate_and_evict(tmp_path):
+    """Test explicit invalidation and size based eviction"""
+
+    CountingReader.calls = 0
+    cache = ResultCache(str(tmp_path))
+    reader = CountingReader('reader', 'test', cache=cache)
+
+    reader.run('sales')
+    assert cache.invalidate(pipe_name='CountingReader') == 1
+    reader.run('sales')
+    assert CountingReader.calls == 2
+
+    cache.max_bytes = cache.size
+    reader.run('stock')
+    assert len(cache._index) == 1, 'Least recently used entry is not evicted'
+
+
+def test_cache_identity(tmp_path):
+    """Test if instances connected to different servers do not share results, and invalidation by source"""
+
+    CountingReader.calls = 0
+    cache = ResultCache(str(tmp_path))
+    prod = ServerReader('prod', 'reader', 'test', cache=cache)
+    test = ServerReader('test', 'reader', 'test', cache=cache)
+
+    prod.run('sales')
+    test.run('sales')
+    assert CountingReader.calls == 2, 'Results of different servers are shared'
+
+    assert cache.invalidate(identity='prod') == 1
+    test.run('sales')
+    prod.run('sales')
+    assert CountingReader.calls == 3
+
+
+def test_cache_shared_index(tmp_path):
+    """Test if a second cache instance on the same directory sees the entries of the first one"""
+
+    CountingReader.calls = 0
+    first = CountingReader('reader', 'test', cache=ResultCache(str(tmp_path)))
+    second = CountingReader('reader', 'test', cache=ResultCache(str(tmp_path)))
+
+    first.run('sales')
+    second.run('stock')
+    second.run('sales')
+    first.run('stock')
+
+    assert CountingReader.calls == 2, 'Entries of the other instance are not seen'
+    assert len(ResultCache(str(tmp_path))._index) == 2, 'Index entries are lost'
@@ -0,0 +1,33 @@
+from src.utils.chunking import harmonise_dtypes
+
+import numpy as np
+import pandas as pd
+
+
+# TESTS
+# =====
+def test_harmonise_dtypes_nulls():
+    """Test if NULLs of partitions read separately are kept as NULLs, not cast to 0 / False"""
+
+    chunks = [pd.DataFrame({'ID': [1, 2], 'FLAG': [True, False], 'QTY': [1, 2]}),
+              pd.DataFrame({'ID': [3], 'FLAG': [None], 'QTY': [None]}),
+              pd.DataFrame({'ID': [4], 'FLAG': [True], 'QTY': [np.nan]})]
+
+    df = harmonise_dtypes(chunks)
+
+    assert str(df['FLAG'].dtype) == 'boolean'
+    assert df['FLAG'].isnull().tolist() == [False, False, True, False], 'NULL of the all-NULL partition is lost'
+    assert df['QTY'].dtype == np.float64 and df['QTY'].isnull().sum() == 2
+    assert df['ID'].dtype == np.int64
+
+
+def test_harmonise_dtypes_without_nulls():
+    """Test if the common numeric type is used and bool columns without NULLs stay bool"""
+
+    chunks = [pd.DataFrame({'FLAG': [True], 'QTY': np.array([1], dtype=np.int32)}),
+              pd.DataFrame({'FLAG': [False], 'QTY': [2.5]})]
+
+    df = harmonise_dtypes(chunks)
+
+    assert df['FLAG'].dtype == bool
+    assert df['QTY'].tolist() == [1.0, 2.5]
@@ -0,0 +1,51 @@
+from src.utils.dtypes import (optimise_dtypes, infer_schema, apply_schema, memory_report, save_schema, load_schema,
+                              read_sql_kwargs)
+
+import numpy as np
+import pandas as pd
+import pytest
+
+
+# TESTS
+# =====
+def test_optimise_dtypes(tmp_path):
+    """Test downcasting, categorisation, date parsing and the persisted schema"""
+
+    n = 1000
+    df = pd.DataFrame({'ID': np.arange(n),
+                       'HALF': np.arange(n) / 2,
+                       'RANDOM': np.random.RandomState(0).rand(n),
+                       'CODE': np.random.RandomState(0).choice(['aa', 'bb', 'cc'], n),
+                       'NAME': [str(i) for i in range(n)],
+                       'DATE': ['2019-01-0{}'.format(i % 9 + 1) for i in range(n)]})
+
+    optimised = optimise_dtypes(df, parse_dates=['DATE'])
+    report = memory_report(df, optimised).set_index('column')
+
+    assert optimised.dtypes.astype(str).to_dict() == {'ID': 'int16', 'HALF': 'float32', 'RANDOM': 'float64',
+                                                      'CODE': 'category', 'NAME': str(df['NAME'].dtype),
+                                                      'DATE': str(pd.to_datetime(df['DATE']).dtype)}
+    assert np.array_equal(optimised['HALF'].values, df['HALF'].values), 'Float downcast is not lossless'
+    assert report.loc['CODE', 'saved_bytes'] > 0
+    assert report.loc['NAME', 'saved_bytes'] == 0
+
+    save_schema(infer_schema(df, parse_dates=['DATE']), str(tmp_path / 'schema.json'))
+    reloaded = apply_schema(df, load_schema(str(tmp_path / 'schema.json')))
+
+    pd.testing.assert_frame_equal(reloaded, optimised)
+
+
+def test_apply_schema_out_of_range():
+    """Test if values out of the range of a narrow schema dtype fall back to the wider dtype instead of overflowing"""
+
+    df = pd.DataFrame({'ID': [1, 300, -5], 'SMALL': [1, 2, 3], 'VALUE': [0.5, 1e300, 0.1], 'HALF': [0.5, 1.5, 2.5]})
+    schema = {'ID': 'int8', 'SMALL': 'int8', 'VALUE': 'float32', 'HALF': 'float32'}
+
+    with pytest.warns(UserWarning):
+        converted = apply_schema(df, schema)
+
+    assert converted.dtypes.astype(str).to_dict() == {'ID': 'int64', 'SMALL': 'int8', 'VALUE': 'float64',
+                                                      'HALF': 'float32'}
+    assert converted['ID'].tolist() == [1, 300, -5]
+    assert converted['VALUE'].tolist() == [0.5, 1e300, 0.1]
+    assert 'ID' not in read_sql_kwargs(schema)['dtype'] and 'VALUE' not in read_sql_kwargs(schema)['dtype']
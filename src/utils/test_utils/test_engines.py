@@ -0,0 +1,37 @@
+from src.utils import engines
+
+import multiprocessing
+import os
+
+import pytest
+from sqlalchemy.pool import QueuePool
+
+
+# TESTS
+# =====
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='fork start method is not available')
+def test_engine_pool_after_fork(tmp_path):
+    """Test if a forked child gets a new connection pool, instead of the pooled connections of the parent"""
+
+    engine = engines.get_engine('sqlite:///{}'.format(tmp_path / 'test.db'), poolclass=QueuePool)
+    with engine.connect() as conn:
+        conn.execute('SELECT 1')
+    parent_pool = id(engine.pool)
+
+    def child(queue):
+        engine = engines.get_engine('sqlite:///{}'.format(tmp_path / 'test.db'), poolclass=QueuePool)
+        with engine.connect() as conn:
+            queue.put((id(engine.pool), conn.execute('SELECT 1').scalar()))
+
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    process = context.Process(target=child, args=(queue,))
+    process.start()
+    child_pool, result = queue.get(timeout=30)
+    process.join()
+
+    assert child_pool != parent_pool, 'Child process uses the connection pool of the parent'
+    assert result == 1
+    assert id(engine.pool) == parent_pool, 'Pool of the parent is replaced'
+
+    engines.dispose_all()
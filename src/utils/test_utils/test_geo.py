@@ -0,0 +1,48 @@
+from src.utils.geo_functions import wgs_to_eov, eov_to_wgs, wgs_to_eov_batch, eov_to_wgs_batch
+
+import numpy as np
+
+# Centre of the EOV projection (Gellérthegy), which is mapped to EOV (650000, 200000)
+CENTRE_LAT = 47 + 8 / 60 + 39.8174 / 3600
+CENTRE_LON = 19 + 2 / 60 + 54.8584 / 3600
+
+# Random points inside Hungary
+rng = np.random.RandomState(0)
+latitude = rng.uniform(45.8, 48.5, 1000)
+longitude = rng.uniform(16.2, 22.8, 1000)
+
+
+# TESTS
+# =====
+def test_wgs_to_eov_known_point():
+    """Test if the centre of the projection is converted to the EOV origin within the accuracy of the polynomials"""
+
+    eov_1, eov_2 = wgs_to_eov(CENTRE_LAT, CENTRE_LON)
+
+    assert abs(eov_1 - 650000) < 150 and abs(eov_2 - 200000) < 150, f'EOV of the centre is ({eov_1}, {eov_2})'
+
+
+def test_eov_to_wgs_round_trip():
+    """Test if converting to EOV and back returns the original coordinates"""
+
+    lon, lat = eov_to_wgs(*wgs_to_eov(47.4979, 19.0402))
+
+    assert abs(lat - 47.4979) < 1e-4 and abs(lon - 19.0402) < 1e-4, f'Round trip returned ({lat}, {lon})'
+
+
+def test_batch_equals_scalar():
+    """Test if the batch functions return the values of the per-point functions, also across chunks"""
+
+    eov_1, eov_2 = wgs_to_eov_batch(latitude, longitude, chunksize=300)
+    expected = np.array([wgs_to_eov(lat, lon) for lat, lon in zip(latitude, longitude)])
+
+    np.testing.assert_allclose(eov_1, expected[:, 0], rtol=0, atol=1e-6)
+    np.testing.assert_allclose(eov_2, expected[:, 1], rtol=0, atol=1e-6)
+
+    lon, lat = eov_to_wgs_batch(eov_1, eov_2, chunksize=300)
+    expected = np.array([eov_to_wgs(x, y) for x, y in zip(eov_1, eov_2)])
+
+    np.testing.assert_allclose(lon, expected[:, 0], rtol=0, atol=1e-9)
+    np.testing.assert_allclose(lat, expected[:, 1], rtol=0, atol=1e-9)
+    np.testing.assert_allclose(lat, latitude, rtol=0, atol=1e-3)
+    np.testing.assert_allclose(lon, longitude, rtol=0, atol=1e-3)
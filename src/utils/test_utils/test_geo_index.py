@@ -0,0 +1,112 @@
+from src.utils.geo_functions import wgs_to_eov_batch
+from src.utils.geo_index import SpatialIndex
+
+import numpy as np
+import pandas as pd
+
+# Random points inside Hungary
+rng = np.random.RandomState(0)
+points = pd.DataFrame({'ID': np.arange(100, 600),
+                       'LATITUDE': rng.uniform(45.8, 48.5, 500),
+                       'LONGITUDE': rng.uniform(16.2, 22.8, 500)})
+queries = pd.DataFrame({'LATITUDE': rng.uniform(45.8, 48.5, 50),
+                        'LONGITUDE': rng.uniform(16.2, 22.8, 50)})
+
+
+def brute_force(k):
+    """Ids and distances of the k nearest points of every query point by a full distance matrix"""
+
+    p_1, p_2 = wgs_to_eov_batch(points['LATITUDE'], points['LONGITUDE'])
+    q_1, q_2 = wgs_to_eov_batch(queries['LATITUDE'], queries['LONGITUDE'])
+    distances = np.hypot(q_1[:, None] - p_1[None, :], q_2[:, None] - p_2[None, :])
+    order = np.argsort(distances, axis=1)[:, :k]
+
+    return np.take_along_axis(distances, order, axis=1), points['ID'].values[order]
+
+
+# TESTS
+# =====
+def test_query_equals_brute_force():
+    """Test if the k nearest neighbours are the ones of the brute-force search"""
+
+    index = SpatialIndex.from_dataframe(points, 'LATITUDE', 'LONGITUDE', id_col='ID')
+    distances, ids = index.query(queries['LATITUDE'], queries['LONGITUDE'], k=3)
+    expected_distances, expected_ids = brute_force(3)
+
+    np.testing.assert_allclose(distances, expected_distances)
+    assert (ids == expected_ids).all(), 'Nearest neighbours are different from the brute-force search'
+
+
+def test_query_radius_and_max_distance():
+    """Test if radius queries and max_distance return only the points within the distance"""
+
+    index = SpatialIndex.from_dataframe(points, 'LATITUDE', 'LONGITUDE', id_col='ID')
+    expected_distances, expected_ids = brute_force(len(points))
+
+    for (distances, ids), row_distances, row_ids in zip(index.query_radius(queries['LATITUDE'], queries['LONGITUDE'],
+                                                                           20000), expected_distances, expected_ids):
+        within = row_distances <= 20000
+        np.testing.assert_allclose(distances, row_distances[within])
+        assert set(ids) == set(row_ids[within])
+
+    distances, ids = index.query(queries['LATITUDE'], queries['LONGITUDE'], k=2, max_distance=10000)
+    assert (np.isinf(distances) == (expected_distances[:, :2] > 10000)).all()
+    assert all(i is None for i in ids[np.isinf(distances)]), 'Missing neighbours are not None'
+
+
+def test_match_and_save_load(tmp_path):
+    """Test the long format of match, and if a saved index returns the same matches"""
+
+    index = SpatialIndex.from_dataframe(points, 'LATITUDE', 'LONGITUDE', id_col='ID')
+    matches = index.match(queries, 'LATITUDE', 'LONGITUDE', k=2)
+
+    assert list(matches.columns) == ['index', 'rank', 'id', 'distance']
+    assert len(matches) == 2 * len(queries)
+
+    path = str(tmp_path / 'index.pkl')
+    index.save(path)
+    pd.testing.assert_frame_equal(SpatialIndex.load(path).match(queries, 'LATITUDE', 'LONGITUDE', k=2), matches)
+
+
+def test_insert_remove():
+    """Test if inserted points are found, removed points are skipped, and the ids are stable across rebuilds"""
+
+    index = SpatialIndex.from_dataframe(points.iloc[:400], 'LATITUDE', 'LONGITUDE', id_col='ID')
+    index.insert(points['LATITUDE'].values[400:], points['LONGITUDE'].values[400:], ids=points['ID'].values[400:])
+    removed = points['ID'].values[::3]
+    assert index.remove(removed) == len(removed)
+    assert index.remove(removed) == 0, 'Removed points are removed again'
+    assert len(index) == len(points) - len(removed)
+
+    expected = SpatialIndex.from_dataframe(points[~points['ID'].isin(removed)], 'LATITUDE', 'LONGITUDE', id_col='ID')
+    expected_distances, expected_ids = expected.query(queries['LATITUDE'], queries['LONGITUDE'], k=5)
+
+    for rebuild in (False, True):
+        if rebuild:
+            index.rebuild()
+            assert len(index.tree.data) == len(index), 'Tombstones are not dropped at the rebuild'
+        distances, ids = index.query(queries['LATITUDE'], queries['LONGITUDE'], k=5)
+        np.testing.assert_allclose(distances, expected_distances)
+        assert (ids == expected_ids).all(), 'Neighbours are different from an index built from the live points'
+
+        radius = index.query_radius(queries['LATITUDE'], queries['LONGITUDE'], 20000)
+        expected_radius = expected.query_radius(queries['LATITUDE'], queries['LONGITUDE'], 20000)
+        assert all(set(r[1]) == set(e[1]) for r, e in zip(radius, expected_radius))
+
+
+def test_insert_default_ids():
+    """Test if inserted points get the next ids, and the rest of the ids do not change after a removal"""
+
+    index = SpatialIndex.from_wgs(points['LATITUDE'].values[:3], points['LONGITUDE'].values[:3])
+    index.remove([0])
+    index.insert(points['LATITUDE'].values[3:4], points['LONGITUDE'].values[3:4])
+
+    _, ids = index.query(points['LATITUDE'].values[1:4], points['LONGITUDE'].values[1:4])
+    assert ids[:, 0].tolist() == [1, 2, 3]
+
+    # The id of a removed point is not given out again, also after the rebuild drops it
+    index.remove([3])
+    index.rebuild()
+    index.insert(points['LATITUDE'].values[4:5], points['LONGITUDE'].values[4:5])
+    _, ids = index.query(points['LATITUDE'].values[4:5], points['LONGITUDE'].values[4:5])
+    assert ids[0, 0] == 4, 'Id of a removed point is reused'
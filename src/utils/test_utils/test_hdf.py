@@ -0,0 +1,34 @@
+from src.utils.hdfreader import HDFReader
+from src.utils.hdfwriter import HDFWriter
+
+import pandas as pd
+
+writer = HDFWriter('hdf_writer', 'test')
+reader = HDFReader('hdf_reader', 'test')
+
+
+# TESTS
+# =====
+def test_hdf_table_upsert(tmp_path):
+    """Test upsert by key and where queries of a table format store"""
+
+    path = str(tmp_path / 'sales.h5')
+
+    day_1 = pd.DataFrame({'DATE': pd.to_datetime(['2019-01-01', '2019-01-01', '2019-01-02']),
+                          'SKU': ['a', 'b', 'a'],
+                          'QTY': [1.0, 2.0, 3.0]})
+    day_2 = pd.DataFrame({'DATE': pd.to_datetime(['2019-01-02', '2019-01-03']),
+                          'SKU': ['a', 'a'],
+                          'QTY': [30.0, 40.0]})
+
+    writer.run(path, 'sales', day_1, format='table', key_cols=['DATE', 'SKU'], data_columns=['QTY'])
+    writer.run(path, 'sales', day_2, format='table', key_cols=['DATE', 'SKU'], data_columns=['QTY'])
+
+    res_df = reader.run(path, 'sales')
+    filtered = reader.run(path, 'sales', where='DATE >= "2019-01-02" & QTY > 35', columns=['SKU', 'QTY'])
+    chunks = list(reader.iter_chunks(path, 'sales', chunksize=2, where='QTY > 1'))
+
+    assert res_df['QTY'].tolist() == [1.0, 2.0, 30.0, 40.0], 'Existing key is not replaced'
+    assert filtered['QTY'].tolist() == [40.0]
+    assert list(filtered.columns) == ['SKU', 'QTY']
+    assert [len(chunk) for chunk in chunks] == [2, 1]
@@ -34,3 +34,19 @@ def test_hearbeat():
     hd_td = [(x1-x0).seconds for (x0, x1) in zip(hb_resp_cont[:-1], hb_resp_cont[1:])]
 
     assert all([x > 1 for x in hd_td]), 'Heartbeat is sent with higher frequency than set'
+
+
+def test_heartbeat_background():
+    """Test heartbeat sent from the background thread"""
+
+    hb = HeartBeat(postgresmanager=postgresman, table_name='hiflylabs_eta_heartbeat_test')
+
+    hb.start(interval=1)
+    time.sleep(1.5)
+    hb_resp_0 = postgresman.read('hiflylabs_eta_heartbeat_test').values[0, 0]
+    time.sleep(1)
+    hb_resp_1 = postgresman.read('hiflylabs_eta_heartbeat_test').values[0, 0]
+    hb.stop()
+
+    assert not hb.running, 'Heartbeat thread is still running'
+    assert 0.5 < (hb_resp_1 - hb_resp_0).total_seconds() < 1.5, 'Heartbeat is not sent with the set interval'
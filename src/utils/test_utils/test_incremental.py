@@ -0,0 +1,78 @@
+from src.utils.incremental import IncrementalLoader, WatermarkStore
+
+import decimal
+from unittest import mock
+
+import pandas as pd
+import pytest
+
+
+# TESTS
+# =====
+def test_incremental_loader(tmp_path):
+    """Test full load, then incremental load of changed and new rows only"""
+
+    source = pd.DataFrame({'ID': [1, 2, 3], 'VALUE': ['a', 'b', 'c'], 'UPDATED': [1, 2, 3]})
+    queries = []
+
+    def read(where, params):
+        queries.append((where, params))
+        if where is None:
+            return source
+        return source[source['UPDATED'] > params['watermark']]
+
+    loader = IncrementalLoader('incremental_loader', 'test', state_path=str(tmp_path / 'watermarks.json'),
+                               snapshot_dir=str(tmp_path / 'snapshots'))
+
+    loader.run('test.source', read, watermark_col='UPDATED', key_cols=['ID'])
+
+    # Row 2 is updated, row 4 is inserted
+    source = pd.DataFrame({'ID': [1, 2, 3, 4], 'VALUE': ['a', 'B', 'c', 'd'], 'UPDATED': [1, 4, 3, 5]})
+    snapshot = loader.run('test.source', read, watermark_col='UPDATED', key_cols=['ID'])
+
+    assert queries[0] == (None, None), 'First load is not a full load'
+    assert queries[1] == ('UPDATED > :watermark', {'watermark': 3})
+    assert snapshot.sort_values('ID')['VALUE'].tolist() == ['a', 'B', 'c', 'd']
+    assert loader.watermarks.get('test.source') == ('UPDATED', 5)
+
+
+def test_incremental_loader_failed_state_update(tmp_path):
+    """Test if a run failing after the snapshot is saved does not duplicate rows of an insert-only source"""
+
+    source = pd.DataFrame({'ID': [decimal.Decimal(1), decimal.Decimal(2)], 'VALUE': ['a', 'b']})
+
+    def read(where, params):
+        if where is None:
+            return source
+        return source[source['ID'] > params['watermark']]
+
+    loader = IncrementalLoader('incremental_loader', 'test', state_path=str(tmp_path / 'watermarks.json'),
+                               snapshot_dir=str(tmp_path / 'snapshots'))
+    loader.run('test.source', read, watermark_col='ID')
+
+    source = pd.DataFrame({'ID': [decimal.Decimal(i) for i in (1, 2, 3)], 'VALUE': ['a', 'b', 'c']})
+    set_watermark = loader.watermarks.set
+    loader.watermarks.set = mock.Mock(side_effect=OSError('State file is not writable'))
+    with pytest.raises(OSError):
+        loader.run('test.source', read, watermark_col='ID')
+    loader.watermarks.set = set_watermark
+
+    snapshot = loader.run('test.source', read, watermark_col='ID')
+
+    assert snapshot['VALUE'].tolist() == ['a', 'b', 'c'], 'Rows of the failed run are loaded again'
+    assert loader.watermarks.get('test.source') == ('ID', decimal.Decimal(3))
+
+
+def test_watermark_store_types(tmp_path):
+    """Test if Decimal watermarks are stored, and unsupported types are rejected"""
+
+    store = WatermarkStore(str(tmp_path / 'watermarks.json'))
+    store.set('a', 'ID', decimal.Decimal('12.50'))
+    assert store.get('a') == ('ID', decimal.Decimal('12.5'))
+
+    # Not representable as float
+    store.set('a', 'ID', decimal.Decimal('0.10000000000000000001'))
+    assert store.get('a') == ('ID', decimal.Decimal('0.10000000000000000001'))
+
+    with pytest.raises(TypeError):
+        store.set('b', 'ID', b'\x00')
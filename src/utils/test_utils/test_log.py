@@ -0,0 +1,54 @@
+from src.utils import log
+from src.utils.pipe import Pipe
+from src.utils.pipeline import Pipeline
+
+import json
+import os
+
+
+class LoggingPipe(Pipe):
+    """Pipe which logs the id of the process it runs in"""
+
+    def run(self):
+        self.logger.info(f'message from process {os.getpid()}')
+        return os.getpid()
+
+
+# TESTS
+# =====
+def test_create_logger_cached(tmp_path):
+    """Test if a logname is configured once, and the queued records reach the log file"""
+
+    logdir = str(tmp_path) + '/'
+    loggers = [log.create_logger(name=f'pipe_{i}', logname='test_log', logdir=logdir) for i in range(100)]
+
+    assert len({id(logger.logger) for logger in loggers}) == 1
+    assert len(loggers[0].logger.handlers) == 1, 'Handlers are added more than once'
+
+    loggers[-1].info('queued message')
+    log.set_mode('queue', json_format=True)
+    loggers[-1].info('json message')
+    log.set_mode('queue', json_format=False)  # Stopping the listener writes out the queued records
+
+    with open(logdir + 'test_log.log') as f:
+        lines = f.read().splitlines()
+
+    assert lines[0].endswith('pipe_99 - INFO - queued message')
+    assert json.loads(lines[1])['message'] == 'json message'
+
+
+def test_process_pool_logging():
+    """Test if the records logged in the workers of a process pool Pipeline reach the log file"""
+
+    pipeline = Pipeline('pipeline', 'test_log_process', executor='process', max_workers=2)
+    for i in range(2):
+        pipeline.add(f'step_{i}', LoggingPipe(f'step_{i}', 'test_log_process'), outputs=f'pid_{i}')
+    pids = pipeline.run()
+
+    # The workers write out their queues when they exit, at the end of the Pipeline
+    with open('/log/test_log_process.log') as f:
+        content = f.read()
+
+    assert os.getpid() not in pids.values(), 'Steps did not run in worker processes'
+    for pid in pids.values():
+        assert f'message from process {pid}' in content, 'Record of a worker process is lost'
@@ -1,8 +1,11 @@
 from src.utils.mongomanager import MongoManager
 
 from pdb import set_trace
+import hashlib
+import pickle
 import pandas as pd
 import pymongo
+import pytest
 
 # Network config
 host = 'mongo'
@@ -148,3 +151,79 @@ def test_mongo_delete():
                                        'ind': [6, 7]}).sort_values(['one', 'two', 'ind']).reset_index(drop=True)
 
     assert all(result.sort_index(axis=1) == expected.sort_index(axis=1)), 'delete method failed'
+
+
+def test_mongo_bulk_insert():
+    """Test if bulk insert loads every batch and reports the inserted documents"""
+
+    test_df = pd.DataFrame.from_dict({'one': list(range(25)),
+                                      'ts': pd.date_range('2019-01-01', periods=25, freq='H')})
+
+    report = mongoman.bulk_insert(test_df, collection='test', batch_size=10, n_workers=2, drop_collection=True)
+    result = pd.DataFrame(mongoman.read(collection='test')).sort_values('one').reset_index(drop=True)
+
+    assert report['inserted'] == 25 and report['failed'] == 0, f'Bulk insert report: {report}'
+    assert len(report['batches']) == 3
+    assert result['one'].tolist() == list(range(25)), 'Bulk inserted and read data from MongoDB are different'
+
+
+def test_mongo_read_projection_dataframe():
+    """Test if read with projection returns only the projected fields as a DataFrame"""
+
+    test_list = [{'one': i, 'two': i * 2, 'three': 'x'} for i in range(5)]
+
+    mongoman.insert(data=test_list, collection='test', drop_collection=True)
+    res_df = mongoman.read(collection='test', projection=['one', 'two'], sort=[('one', pymongo.ASCENDING)],
+                           batch_size=2, as_dataframe=True)
+    chunks = list(mongoman.iter_read(collection='test', batch_size=2))
+
+    assert list(res_df.columns) == ['one', 'two'], f'Projected columns: {list(res_df.columns)}'
+    assert res_df['two'].tolist() == [0, 2, 4, 6, 8], 'Projected read data from MongoDB is different'
+    assert [len(chunk) for chunk in chunks] == [2, 2, 1], 'iter_read batches are different'
+
+
+def test_get_stats_many():
+    """Test statistics of several filter groups and group keys in one request"""
+
+    test_list = [{'one': 1, 'grp': 'a', 'two': 2},
+                 {'one': 1, 'grp': 'a', 'two': 4},
+                 {'one': 1, 'grp': 'b', 'two': 7},
+                 {'one': 6, 'grp': 'b', 'two': 5},
+                 {'one': 6, 'grp': 'b', 'two': 9}]
+
+    mongoman.insert(data=test_list, collection='test', drop_collection=True)
+
+    stats = mongoman.get_stats_many('test', {'one_1': {'one': 1}, 'one_6': {'one': 6}}, ['two'], group_by=['grp'])
+    stats = stats.sort_values(['filter_group', 'grp']).reset_index(drop=True)
+
+    mongoman.drop_collection('test')
+
+    assert stats['filter_group'].tolist() == ['one_1', 'one_1', 'one_6']
+    assert stats['grp'].tolist() == ['a', 'b', 'b']
+    assert stats['count'].tolist() == [2, 1, 2]
+    assert stats['mean'].tolist() == [3, 7, 7]
+    assert stats['q50'].tolist() == [4, 7, 9]
+
+
+def test_put_get_model():
+    """Test compressed model round trip, deduplication and the model cache"""
+
+    model = pickle.dumps({'coef': list(range(10000))})
+
+    model_id = mongoman.put_model(model, collection='test_models', compression='zlib')
+    same_id = mongoman.put_model(model, collection='test_models', compression='zlib')
+
+    assert model_id == same_id, 'Identical model is stored twice'
+    assert mongoman.get_model('test_models', id=model_id) == model, 'Stored and read model are different'
+    assert mongoman.get_model('test_models', sha256=hashlib.sha256(model).hexdigest()) == model, 'Read by hash failed'
+    assert mongoman.read_model('test_models', model_id) == model, 'read_model result is different'
+
+    mongoman.delete_model('test_models', model_id)
+    assert ('test_models', str(model_id)) not in mongoman._model_cache, 'Deleted model is still cached'
+
+
+def test_get_model_without_id_or_hash():
+    """Test if get_model refuses to pick an arbitrary model when neither id nor sha256 is given"""
+
+    with pytest.raises(ValueError):
+        mongoman.get_model('test_models')
@@ -0,0 +1,25 @@
+from src.utils.mssqlreader import MSSQLReader
+
+import datetime
+import decimal
+
+import pytest
+
+
+# TESTS
+# =====
+def test_partition_bounds():
+    """Test the inner partition bounds of integer, DECIMAL and datetime partition columns"""
+
+    assert MSSQLReader._partition_bounds('ID', 0, 100, 4) == [25, 50, 75]
+    assert MSSQLReader._partition_bounds('ID', decimal.Decimal(0), decimal.Decimal(100), 4) == [25, 50, 75]
+    assert MSSQLReader._partition_bounds('ID', 5, 5, 4) == []
+
+    bounds = MSSQLReader._partition_bounds('AMOUNT', decimal.Decimal('0.1'), decimal.Decimal('0.5'), 2)
+    assert len(bounds) == 1 and isinstance(bounds[0], decimal.Decimal)
+
+    assert MSSQLReader._partition_bounds('DATE', datetime.datetime(2019, 1, 1), datetime.datetime(2019, 1, 5), 4) == \
+        [datetime.datetime(2019, 1, d) for d in (2, 3, 4)]
+
+    with pytest.raises(ValueError):
+        MSSQLReader._partition_bounds('NAME', 'a', 'z', 4)
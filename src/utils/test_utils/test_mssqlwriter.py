@@ -0,0 +1,27 @@
+from src.utils.mssqlwriter import sql_dtypes
+
+from sqlalchemy.dialects import mssql
+import numpy as np
+import pandas as pd
+
+
+# TESTS
+# =====
+def test_sql_dtypes():
+    """Test the MSSQL types of numpy and nullable extension dtypes"""
+
+    df = pd.DataFrame({'INT8': np.array([1, -1], dtype=np.int8),
+                       'UINT32': np.array([1, 2], dtype=np.uint32),
+                       'NULLABLE_INT': pd.array([1, None], dtype='Int64'),
+                       'NULLABLE_UINT': pd.array([1, None], dtype='UInt8'),
+                       'FLAG': [True, False],
+                       'NAME': ['a', None]})
+
+    types = sql_dtypes(df)
+
+    assert isinstance(types['INT8'], mssql.SMALLINT)
+    assert isinstance(types['UINT32'], mssql.BIGINT)
+    assert isinstance(types['NULLABLE_INT'], mssql.BIGINT)
+    assert isinstance(types['NULLABLE_UINT'], mssql.SMALLINT)
+    assert isinstance(types['FLAG'], mssql.BIT)
+    assert isinstance(types['NAME'], mssql.NVARCHAR) and types['NAME'].length == 50
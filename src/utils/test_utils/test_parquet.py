@@ -0,0 +1,55 @@
+from src.utils.parquetreader import ParquetReader
+from src.utils.parquetwriter import ParquetWriter
+
+import pandas as pd
+
+df = pd.DataFrame({'YEAR': [2019, 2019, 2020, 2020],
+                   'SKU': ['a', 'b', 'a', 'b'],
+                   'QTY': [1.0, 2.0, 3.0, 4.0]})
+
+writer = ParquetWriter('parquet_writer', 'test')
+reader = ParquetReader('parquet_reader', 'test')
+
+
+# TESTS
+# =====
+def test_parquet_partitioned(tmp_path):
+    """Test projection and partition filters of a partitioned dataset, and partition replacement"""
+
+    path = str(tmp_path / 'sales')
+
+    writer.run(path, df, partition_cols=['YEAR'], compression='zstd')
+    res_df = reader.run(path, columns=['SKU', 'QTY'], filters=[('YEAR', '=', 2020)])
+
+    assert list(res_df.columns) == ['SKU', 'QTY']
+    assert res_df['QTY'].tolist() == [3.0, 4.0], 'Filtered data is different'
+
+    # Only the partition of 2020 is replaced
+    writer.run(path, df[df['YEAR'] == 2020].assign(QTY=5.0), partition_cols=['YEAR'])
+    res_df = reader.run(path).sort_values(['YEAR', 'SKU'])
+
+    assert res_df['QTY'].tolist() == [1.0, 2.0, 5.0, 5.0], 'Partition is not replaced'
+
+
+def test_parquet_file_chunks(tmp_path):
+    """Test row group filters and chunked read of a single file"""
+
+    path = str(tmp_path / 'sales.parquet')
+
+    writer.run(path, df, row_group_size=2, use_dictionary=['SKU'])
+    chunks = list(reader.iter_chunks(path, filters=[('QTY', '>', 1.0)], chunksize=2))
+
+    assert reader.run(path).equals(df), 'Written and read data are different'
+    assert pd.concat(chunks)['QTY'].tolist() == [2.0, 3.0, 4.0]
+
+
+def test_parquet_index_not_written(tmp_path):
+    """Test if the index of a filtered DataFrame is not written"""
+
+    path = str(tmp_path / 'sales_2020.parquet')
+
+    writer.run(path, df[df['YEAR'] == 2020])
+    res_df = reader.run(path)
+
+    assert isinstance(res_df.index, pd.RangeIndex), 'Index of the filtered DataFrame is written'
+    assert res_df.equals(df[df['YEAR'] == 2020].reset_index(drop=True))
@@ -0,0 +1,61 @@
+from src.utils.pipe import Pipe
+from src.utils.pipeline import Pipeline
+
+import pandas as pd
+import pytest
+import time
+
+
+class SleepLoader(Pipe):
+    """Returns a DataFrame after sleeping, simulating an I/O bound read"""
+
+    def run(self, value, delay):
+        time.sleep(delay)
+        return pd.DataFrame({'key': [1, 2], 'value': [value, value]})
+
+
+class Join(Pipe):
+
+    def run(self, left, right):
+        return left.merge(right, on='key', suffixes=('_left', '_right'))
+
+
+# TESTS
+# =====
+def test_pipeline_join():
+    """Test if a two-branch Pipeline returns the joined result"""
+
+    pipeline = Pipeline('pipeline', 'test')
+    pipeline.add('left', SleepLoader('left', 'test'), params={'value': 'a', 'delay': 0}, outputs='left')
+    pipeline.add('right', SleepLoader('right', 'test'), params={'value': 'b', 'delay': 0}, outputs='right')
+    pipeline.add('join', Join('join', 'test'), inputs={'left': 'left', 'right': 'right'}, outputs='abt')
+
+    result = pipeline.run(outputs=['abt'])
+
+    assert list(result) == ['abt']
+    assert result['abt']['value_left'].tolist() == ['a', 'a']
+    assert result['abt']['value_right'].tolist() == ['b', 'b']
+
+
+def test_pipeline_parallel_branches():
+    """Test if independent branches run at the same time"""
+
+    pipeline = Pipeline('pipeline', 'test', max_workers=2)
+    pipeline.add('left', SleepLoader('left', 'test'), params={'value': 'a', 'delay': 1}, outputs='left')
+    pipeline.add('right', SleepLoader('right', 'test'), params={'value': 'b', 'delay': 1}, outputs='right')
+
+    ts = time.time()
+    pipeline.run()
+
+    assert time.time() - ts < 1.8, 'Independent branches are not executed in parallel'
+
+
+def test_pipeline_cycle():
+    """Test if cyclic dependencies are detected"""
+
+    pipeline = Pipeline('pipeline', 'test')
+    pipeline.add('one', Join('one', 'test'), inputs={'left': 'b', 'right': 'b'}, outputs='a')
+    pipeline.add('two', Join('two', 'test'), inputs={'left': 'a', 'right': 'a'}, outputs='b')
+
+    with pytest.raises(ValueError):
+        pipeline.run()
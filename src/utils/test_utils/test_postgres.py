@@ -50,6 +50,36 @@ def test_write_read_postgres():
     assert eta_resp.equals(eta_test), 'Written and read data from PostgreSQL are different'
 
 
+def test_write_read_postgres_bulk():
+    """Test if dataframe written with COPY and staging swap is returned the same"""
+
+    # Read and write table
+    postgresman.write(df=eta_test, table_name='eta', bulk=True)
+    eta_resp = postgresman.read(table_name='eta')
+
+    assert eta_resp.equals(eta_test), 'Bulk written and read data from PostgreSQL are different'
+
+
+def test_write_bulk_nulls():
+    """Test if COPY keeps empty strings and backslash strings, and loads only None as NULL"""
+
+    df = pd.DataFrame({'ID': [1, 2, 3, 4], 'TEXT': ['', '\\N', None, 'a "quoted", value']})
+    postgresman.write(df=df, table_name='test_copy_nulls', bulk=True)
+    result = postgresman.read(table_name='test_copy_nulls').sort_values('ID').reset_index(drop=True)
+
+    assert result.equals(df), 'Strings are changed by COPY'
+
+
+def test_truncate_insert_bulk():
+    """Test if truncate_insert with COPY replaces the records"""
+
+    postgresman.write(df=eta_test, table_name='eta')
+    postgresman.truncate_insert('eta', eta_test.iloc[:2], bulk=True)
+    eta_resp = postgresman.read(table_name='eta')
+
+    assert eta_resp.equals(eta_test.iloc[:2]), 'Bulk truncate-inserted and read data from PostgreSQL are different'
+
+
 def test_update_eta_postgres():
     """Test if updated dataframe is returned the same"""
 
@@ -136,6 +166,29 @@ def test_update_eta_old_id(setup):
     assert all(result.sort_index(axis=1) == expected.sort_index(axis=1)), 'Inserting with already existing ID-s is not working properly'
 
 
+def test_upsert_delete_insert(setup):
+    """Test if upsert replaces the records of existing keys and appends the new ones"""
+
+    to_load = pd.DataFrame().from_dict({'PHARMACY_ID': [1, 5],
+                                        'ETA_ID': ['1', '1'],
+                                        'TOUR_ID': [104, 104],
+                                        'ETA': [datetime.datetime(2019, 1, 1, 12, 0, 0),
+                                                datetime.datetime(2019, 1, 1, 12, 10, 0)]})
+    postgresman.upsert(to_load, 'eta', key_cols=['PHARMACY_ID', 'ETA_ID'], how='delete_insert')
+
+    result = postgresman.read('eta').sort_values(['PHARMACY_ID', 'ETA_ID']).reset_index(drop=True)
+    expected = pd.DataFrame().from_dict({'PHARMACY_ID': [1, 1, 1, 2, 5],
+                                         'ETA_ID': ['1', '2', '3', '1', '1'],
+                                         'TOUR_ID': [104, 103, 103, 107, 104],
+                                         'ETA': [datetime.datetime(2019, 1, 1, 12, 0, 0),
+                                                 datetime.datetime(2019, 1, 1, 11, 10, 0),
+                                                 datetime.datetime(2019, 1, 1, 11, 20, 0),
+                                                 datetime.datetime(2019, 1, 1, 11, 0, 0),
+                                                 datetime.datetime(2019, 1, 1, 12, 10, 0)]})
+
+    assert result.equals(expected), 'Upsert with delete_insert is not working properly'
+
+
 def test_drop_old_recs():
     """Test drop_old_recs method"""
 
@@ -176,3 +229,17 @@ def test_delete(setup):
                                                 datetime.datetime(2019, 1, 1, 11, 0, 0)]})
 
     assert all(result == expected)
+
+
+def test_schema_cache(setup):
+    """Test if table definitions are reflected only once"""
+
+    postgresman.invalidate_table()
+    hits = postgresman.schema_cache_stats['hits']
+    misses = postgresman.schema_cache_stats['misses']
+
+    postgresman.delete('eta', {'TOUR_ID': 103, 'ETA_ID': '2'})
+    postgresman.delete('eta', {'TOUR_ID': 103, 'ETA_ID': '3'})
+
+    assert postgresman.schema_cache_stats['misses'] == misses + 1, 'Table is reflected more than once'
+    assert postgresman.schema_cache_stats['hits'] == hits + 1, 'Cached table definition is not reused'
@@ -0,0 +1,52 @@
+from src.utils.profiling import Profiler, profile, record, record_frame
+
+import json
+import time
+
+import pandas as pd
+
+
+# TESTS
+# =====
+def test_profiler_nested_stages(tmp_path):
+    """Test if stages are nested, counters are recorded and the run is exported"""
+
+    with Profiler('nightly') as profiler:
+        with profiler.stage('load'):
+            for _ in range(2):
+                with profile('chunk'):
+                    time.sleep(0.05)
+                    record(rows_out=10, bytes_read=100)
+        with profiler.stage('score', rows_in=20):
+            # Allocates 8 MB for the peak memory measurement
+            record(rows_out=len([0] * 1000000))
+            record_frame(pd.DataFrame({'NAME': ['x' * 100] * 10}))
+
+    summary = profiler.summary().set_index('stage')
+
+    assert summary.index.tolist() == ['nightly', 'nightly/load', 'nightly/load/chunk', 'nightly/score']
+    assert summary.loc['nightly/load/chunk', 'calls'] == 2
+    assert summary.loc['nightly/load/chunk', 'rows_out'] == 20
+    assert summary.loc['nightly/load/chunk', 'bytes_read'] == 200
+    assert summary.loc['nightly/load', 'wall_s'] >= 0.1
+    assert summary.loc['nightly/score', 'peak_memory_bytes'] >= 8000000, 'Peak memory of the stage is not measured'
+    assert summary.loc['nightly/score', 'bytes_read'] > 1000, 'Memory usage of the strings is not recorded'
+
+    profiler.to_json(str(tmp_path / 'nightly.json'))
+    profiler.to_prometheus(str(tmp_path / 'nightly.prom'))
+
+    with open(str(tmp_path / 'nightly.json')) as f:
+        assert len(json.load(f)['stages']) == 5
+    with open(str(tmp_path / 'nightly.prom')) as f:
+        assert 'pipe_stage_wall_seconds{run="nightly",stage="nightly/load/chunk"}' in f.read()
+
+    assert set(profiler.compare(str(tmp_path / 'nightly.json'))['wall_ratio']) == {1.0}
+
+
+def test_profile_without_profiler():
+    """Test if profile and record do nothing without an active profiler"""
+
+    with profile('stage') as stage:
+        record(rows_in=1)
+
+    assert stage is None
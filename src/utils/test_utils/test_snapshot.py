@@ -0,0 +1,53 @@
+from src.utils.snapshotreader import SnapshotReader
+from src.utils.snapshotwriter import SnapshotWriter
+
+import numpy as np
+import os
+import pandas as pd
+import pytest
+
+writer = SnapshotWriter('snapshot_writer', 'test')
+reader = SnapshotReader('snapshot_reader', 'test')
+
+
+# TESTS
+# =====
+def test_snapshot_round_trip(tmp_path):
+    """Test if every column type is restored, and numeric columns are memory mapped"""
+
+    path = str(tmp_path / 'abt')
+
+    df = pd.DataFrame({'QTY': np.arange(5, dtype=np.float64),
+                       'FLAG': [True, False, True, False, True],
+                       'SKU': pd.Categorical(['a', 'b', 'a', 'c', 'b']),
+                       'DATE': pd.date_range('2019-01-01', periods=5),
+                       'DATE_TZ': pd.date_range('2019-01-01', periods=5, tz='Europe/Budapest'),
+                       'NAME': ['x', 'y', None, 'z', 'w']}, index=pd.Index([10, 11, 12, 13, 14], name='ID'))
+
+    writer.run(path, df)
+    res_df = reader.run(path)
+
+    assert isinstance(res_df['QTY'].values.base, np.memmap), 'Numeric column is not memory mapped'
+    # Values only, the memory mapped arrays are not plain numpy arrays
+    pd.testing.assert_frame_equal(res_df.copy(), df)
+    assert list(reader.run(path, columns=['SKU', 'QTY']).columns) == ['SKU', 'QTY']
+
+
+def test_snapshot_replace_and_reject(tmp_path):
+    """Test if a snapshot is replaced without leftover directories, and unsupported frames are rejected up front"""
+
+    path = str(tmp_path / 'abt')
+
+    writer.run(path, pd.DataFrame({'QTY': [1.0, 2.0]}))
+    writer.run(path, pd.DataFrame({'QTY': [3.0]}))
+
+    assert reader.run(path)['QTY'].tolist() == [3.0]
+    assert os.listdir(str(tmp_path)) == ['abt'], 'Temporary or old snapshot directories are left'
+
+    for df in [pd.DataFrame([[1, 2]], columns=['A', 'A']),
+               pd.DataFrame([[1, 2]], columns=pd.MultiIndex.from_tuples([('A', 'x'), ('A', 'y')])),
+               pd.DataFrame({'A': [1]}, index=pd.MultiIndex.from_tuples([(1, 2)]))]:
+        with pytest.raises(ValueError):
+            writer.run(path, df)
+
+    assert reader.run(path)['QTY'].tolist() == [3.0], 'Rejected write changed the snapshot'